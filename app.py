@@ -4,35 +4,108 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Any, Dict
+import mimetypes
+import os
+import time
+from typing import Any, Dict, Literal
 
-from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+IMPORT_STARTED = time.monotonic()  # Origin of the startup phases in /health
 
-from gateway import GatewayManager
-from gateway.config import GatewayConfig
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, model_validator
 
+from gateway import GatewayManager, logs, metrics, tracing
+from gateway.broker import SlowConsumerError
+from gateway.bus import BusUnavailableError
+from gateway.config import GatewayConfig
+from gateway.directory import TargetResolutionError
+from gateway.filters import EventFilter
+from gateway.media import MediaTooLargeError, open_file, spool
 
-logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s - %(name)s: %(message)s")
 
 app = FastAPI(title="DingTalk HA Gateway", version="0.1.0")
 config = GatewayConfig.load()
+logs.setup_logging(
+    level=config.log_level,
+    queue_size=config.log_queue_size,
+    message_rate=config.log_message_rate,
+    sample_rate=config.log_sample_rate,
+    content_policy=config.log_content,
+)
 manager = GatewayManager(config=config)
+IMPORT_SECONDS = round(time.monotonic() - IMPORT_STARTED, 3)
 
 logger = logging.getLogger(__name__)
 
 
+Priority = Literal["high", "normal", "low"]
+
+MAX_BATCH_MESSAGES = 500
+MAX_CARD_BUTTONS = 5
+
+
 class SendMessageSchema(BaseModel):
     target: str
     content: str
     at_list: list[str] | None = None
+    priority: Priority = "normal"
+    conversation_id: str | None = None
+    trace_id: str | None = None
+    async_: bool = Field(default=False, alias="async")  # Answer 202 and send in the background
 
 
 class SendMarkdownSchema(BaseModel):
     target: str
     title: str | None = "通知"
     content: str
+    priority: Priority = "normal"
+    conversation_id: str | None = None
+    trace_id: str | None = None
+    async_: bool = Field(default=False, alias="async")
+
+
+class CardButtonSchema(BaseModel):
+    title: str
+    url: str
+
+
+class SendActionCardSchema(BaseModel):
+    target: str
+    title: str | None = "通知"
+    content: str  # Markdown body of the card
+    buttons: list[CardButtonSchema] = Field(min_length=1, max_length=MAX_CARD_BUTTONS)
+    priority: Priority = "normal"
+    conversation_id: str | None = None
+    trace_id: str | None = None
+    async_: bool = Field(default=False, alias="async")
+
+
+class BatchMessageSchema(BaseModel):
+    type: Literal["text", "markdown", "action_card"] = "text"
+    target: str
+    content: str
+    title: str | None = "通知"
+    at_list: list[str] | None = None
+    buttons: list[CardButtonSchema] | None = Field(default=None, min_length=1, max_length=MAX_CARD_BUTTONS)
+    priority: Priority = "normal"
+    conversation_id: str | None = None
+    trace_id: str | None = None
+    async_: bool = Field(default=False, alias="async")
+
+    @model_validator(mode="after")
+    def _card_has_buttons(self) -> "BatchMessageSchema":
+        if self.type == "action_card" and not self.buttons:
+            raise ValueError("action_card messages need buttons")
+        return self
+
+
+class SendBatchSchema(BaseModel):
+    messages: list[BatchMessageSchema] = Field(min_length=1, max_length=MAX_BATCH_MESSAGES)
+
+
+def _send_status_code(result: Dict[str, Any]) -> int:
+    return 202 if result.get("status") == "accepted" else 200
 
 
 async def token_guard(x_access_token: str | None = Header(default=None)):
@@ -41,6 +114,17 @@ async def token_guard(x_access_token: str | None = Header(default=None)):
     return True
 
 
+@app.exception_handler(TargetResolutionError)
+async def target_not_found(request: Request, exc: TargetResolutionError) -> JSONResponse:
+    return JSONResponse({"detail": str(exc)}, status_code=404)
+
+
+@app.exception_handler(BusUnavailableError)
+async def leader_unavailable(request: Request, exc: BusUnavailableError) -> JSONResponse:
+    # Sends from a follower go through the leader; mid-election there is none
+    return JSONResponse({"detail": str(exc)}, status_code=503)
+
+
 @app.on_event("startup")
 async def on_startup() -> None:
     await manager.start()
@@ -49,24 +133,158 @@ async def on_startup() -> None:
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     await manager.stop()
+    logs.stop_logging()
 
 
 @app.get("/health")
 async def health_check() -> Dict[str, Any]:
-    return {"status": "ok", "channel": "dingtalk"}
+    """Liveness, plus the startup phases reached in seconds since the app began importing."""
+    readiness = manager.readiness(since=IMPORT_STARTED)
+    readiness["phases"] = {"import": IMPORT_SECONDS, **readiness["phases"]}
+    return {"status": "ok", "channel": "dingtalk", **readiness}
 
 
 @app.post("/send_message")
 async def send_message(payload: SendMessageSchema, guard: bool = Depends(token_guard)) -> JSONResponse:
-    result = await manager.send_text(payload.model_dump())
-    return JSONResponse(result)
+    result = await manager.send_text(payload.model_dump(by_alias=True))
+    return JSONResponse(result, status_code=_send_status_code(result))
 
 
 @app.post("/send_markdown")
 async def send_markdown(payload: SendMarkdownSchema, guard: bool = Depends(token_guard)) -> JSONResponse:
     """Send markdown message."""
-    result = await manager.send_markdown(payload.model_dump())
-    return JSONResponse(result)
+    result = await manager.send_markdown(payload.model_dump(by_alias=True))
+    return JSONResponse(result, status_code=_send_status_code(result))
+
+
+@app.post("/send_action_card")
+async def send_action_card(payload: SendActionCardSchema, guard: bool = Depends(token_guard)) -> JSONResponse:
+    """Send an actionCard message with link buttons."""
+    result = await manager.send_action_card(payload.model_dump(by_alias=True))
+    return JSONResponse(result, status_code=_send_status_code(result))
+
+
+@app.post("/send_image")
+async def send_image(
+    request: Request,
+    target: str,
+    path: str | None = None,
+    filename: str | None = None,
+    priority: Priority = "normal",
+    conversation_id: str | None = None,
+    trace_id: str | None = None,
+    async_: bool = Query(default=False, alias="async"),
+    guard: bool = Depends(token_guard),
+) -> JSONResponse:
+    """Send an image from the request body, or from ``path`` inside ``GATEWAY_MEDIA_DIRS``."""
+    payload = {
+        "target": target,
+        "filename": filename,
+        "priority": priority,
+        "conversation_id": conversation_id,
+        "trace_id": trace_id,
+        "async": async_,
+    }
+    return await _send_media("image", request, payload, path)
+
+
+@app.post("/send_file")
+async def send_file(
+    request: Request,
+    target: str,
+    path: str | None = None,
+    filename: str | None = None,
+    priority: Priority = "normal",
+    conversation_id: str | None = None,
+    trace_id: str | None = None,
+    async_: bool = Query(default=False, alias="async"),
+    guard: bool = Depends(token_guard),
+) -> JSONResponse:
+    """Send a file from the request body, or from ``path`` inside ``GATEWAY_MEDIA_DIRS``."""
+    payload = {
+        "target": target,
+        "filename": filename,
+        "priority": priority,
+        "conversation_id": conversation_id,
+        "trace_id": trace_id,
+        "async": async_,
+    }
+    return await _send_media("file", request, payload, path)
+
+
+async def _send_media(kind: str, request: Request, payload: Dict[str, Any], path: str | None) -> JSONResponse:
+    """Stream the media to disk (or hash it in place), then upload and send it."""
+    try:
+        if path:
+            media = await open_file(_allowed_media_path(path), config.media_max_bytes)
+            payload["filename"] = payload["filename"] or os.path.basename(path)
+        else:
+            media = await spool(request.stream(), config.media_max_bytes)
+            if not payload["filename"]:
+                extension = mimetypes.guess_extension(request.headers.get("content-type", "").split(";")[0]) or ""
+                payload["filename"] = f"{kind}{extension}"
+    except MediaTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        if media.size == 0:
+            raise HTTPException(status_code=400, detail="Empty media")
+        result = await manager.send_media(kind, payload, media)
+    finally:
+        media.discard()
+    return JSONResponse(result, status_code=_send_status_code(result))
+
+
+def _allowed_media_path(path: str) -> str:
+    real = os.path.realpath(path)
+    if not any(real == d or real.startswith(d + os.sep) for d in config.media_dirs):
+        raise HTTPException(status_code=403, detail="Path is outside GATEWAY_MEDIA_DIRS")
+    if not os.path.isfile(real):
+        raise HTTPException(status_code=404, detail="File not found")
+    return real
+
+
+@app.post("/send_batch")
+async def send_batch(payload: SendBatchSchema, guard: bool = Depends(token_guard)) -> JSONResponse:
+    """Send many text/markdown messages in one request, with per-message results."""
+    results = await manager.send_batch([message.model_dump(by_alias=True) for message in payload.messages])
+    failed = sum(1 for result in results if result["status"] == "error")
+    return JSONResponse({"total": len(results), "failed": failed, "results": results})
+
+
+@app.get("/status/{message_id}")
+async def message_status(message_id: str, guard: bool = Depends(token_guard)) -> Dict[str, Any]:
+    """Delivery status of a message sent with ``async``."""
+    status = await manager.get_message_status(message_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return status
+
+
+@app.get("/stats")
+async def stats(guard: bool = Depends(token_guard)) -> Dict[str, Any]:
+    """Outbound queue depth and wait times."""
+    return await manager.get_stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics(guard: bool = Depends(token_guard)) -> PlainTextResponse:
+    """Prometheus text exposition of hot-path latencies and counters."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/traces")
+async def debug_traces(
+    trace_id: str | None = None,
+    limit: int = 50,
+    guard: bool = Depends(token_guard),
+) -> Dict[str, Any]:
+    """Recent sampled traces, newest first, or a single trace by id."""
+    if trace_id:
+        trace = tracing.TRACER.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Trace not found")
+        return trace.asdict()
+    return {"tracing": tracing.TRACER.stats(), "traces": tracing.TRACER.recent(limit)}
 
 
 @app.post("/dingtalk/webhook")
@@ -80,13 +298,14 @@ async def dingtalk_webhook(request: Request) -> Dict[str, Any]:
         signature = request.headers.get("sign", "")
         timestamp = request.headers.get("timestamp", "")
         
-        event_data = await request.json()
-        logger.debug(f"[DingTalk] Received webhook event")
+        # Raw body: the signature is checked before anything is parsed
+        body = await request.body()
+        logger.debug("[DingTalk] Received webhook event")
         
-        result = await manager.handle_dingtalk_webhook(event_data, signature, timestamp)
+        result = await manager.handle_dingtalk_webhook(body, signature, timestamp)
         return result
     except Exception as e:
-        logger.error(f"[DingTalk] Error handling webhook: {e}", exc_info=True)
+        logger.error("[DingTalk] Error handling webhook: %s", e, exc_info=True)
         return {"success": False, "error": str(e)}
 
 
@@ -96,26 +315,76 @@ async def websocket_endpoint(websocket: WebSocket):
     if config.access_token and token != config.access_token:
         await websocket.close(code=4403)
         return
+    # Resume after a reconnect: replay events newer than the last one received
+    last_event_id = websocket.query_params.get("last_event_id") or websocket.headers.get("Last-Event-ID")
     await websocket.accept()
-    queue = await manager.register_listener()
+    params = websocket.query_params
+    try:
+        event_filter = EventFilter.from_params(params)
+        subscription = await manager.register_listener(
+            last_event_id or None,
+            event_filter,
+            policy=params.get("policy"),
+            max_lag=int(params["max_lag"]) if params.get("max_lag") else None,
+            max_drops=int(params["max_drops"]) if params.get("max_drops") else None,
+        )
+    except ValueError as e:
+        await websocket.close(code=4400, reason=str(e))
+        return
+    # Watch for the client going away while we wait for events to send
+    sender = asyncio.create_task(_pump_events(websocket, subscription))
+    receiver = asyncio.create_task(_wait_disconnect(websocket))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        await manager.unregister_listener(subscription)
+
+
+async def _pump_events(websocket: WebSocket, subscription) -> None:
     try:
         while True:
-            event = await queue.get()
-            await websocket.send_json(event)
+            # Pre-encoded frame shared by all subscribers
+            frame = await subscription.get_frame()
+            await asyncio.wait_for(websocket.send_text(frame), config.ws_send_timeout)
+            sent_at = time.perf_counter()
+            metrics.DELIVERY_LATENCY.observe(sent_at - subscription.last_published_at)
+            trace = tracing.TRACER.get(subscription.last_trace_id)
+            if trace is not None:
+                trace.add_span("ws_delivery", subscription.last_published_at, sent_at, subscriber=subscription.id)
+    except (SlowConsumerError, asyncio.TimeoutError):
+        logger.warning("[WebSocket] Disconnecting slow subscriber %s", subscription.id)
+        try:
+            await websocket.close(code=1013, reason="slow consumer")
+        except Exception:
+            pass
     except WebSocketDisconnect:
         pass
-    finally:
-        await manager.unregister_listener(queue)
+
+
+async def _wait_disconnect(websocket: WebSocket) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
 
 
 def run():  # pragma: no cover - helper for uvicorn
     import uvicorn
 
     uvicorn.run(
-        "app:app",
+        # A single worker serves this module's app; an import string would
+        # make uvicorn import (and configure) everything a second time
+        app if config.workers == 1 else "app:app",
         host=config.listen_host,
         port=config.listen_port,
+        workers=config.workers,
         reload=False,
+        # Leave logging to gateway.logs so uvicorn's lines also go through the queue
+        log_config=None,
+        access_log=config.access_log,
     )
 
 
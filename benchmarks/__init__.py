@@ -0,0 +1,4 @@
+"""Benchmarks for the DingTalk gateway.
+
+Run from the repository root, e.g. ``python -m benchmarks.bench_http_pool``.
+"""
@@ -0,0 +1,281 @@
+"""End-to-end gateway benchmark against a local DingTalk stand-in.
+
+Starts a fake ``oapi.dingtalk.com`` and the gateway app in-process, then
+measures throughput and p50/p99 latency of:
+
+* ``/send_message`` (session webhook path, cached from a fake stream message)
+* ``/send_markdown`` (work notification path, to a user without a session webhook)
+* ``/ws`` fanout at several subscriber counts, with events fed through
+  ``DingTalkClient._handle_stream_message`` by a fake stream producer
+
+Usage::
+
+    python -m benchmarks.bench_e2e [--requests 500] [--concurrency 20]
+        [--subscribers 1,10,100] [--events 200] [--latency-ms 0]
+        [--error-rate 0] [--output bench_e2e.json] [--baseline OLD.json]
+
+Outbound rate limits are lifted (unless set in the environment) so the
+numbers reflect the gateway rather than DingTalk's quotas. With
+``--baseline`` the run is compared to an earlier result file and the exit
+status is non-zero if throughput or p99 latency regressed beyond
+``--tolerance``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+from .fake_dingtalk import FakeDingTalk
+from .fake_stream import FakeStreamProducer
+
+BENCH_USER = "bench-user"
+NOTIFY_USER = "bench-notify"
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _summarize(latencies: List[float], elapsed: float, count: int, errors: int) -> Dict[str, Any]:
+    return {
+        "count": count,
+        "errors": errors,
+        "throughput_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def bench_http(
+    session: aiohttp.ClientSession,
+    url: str,
+    body: Dict[str, Any],
+    count: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one() -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.post(url, json=body) as response:
+                await response.read()
+                ok = response.status == 200
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return _summarize(latencies, time.perf_counter() - start, count, errors)
+
+
+async def bench_fanout(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    manager: Any,
+    producer: FakeStreamProducer,
+    subscribers: int,
+    events: int,
+    interval: float,
+) -> Dict[str, Any]:
+    broker = manager._broker
+    sockets = [await session.ws_connect(f"{base_url}/ws") for _ in range(subscribers)]
+    while broker.subscriber_count < subscribers:
+        await asyncio.sleep(0.01)
+
+    latencies: List[float] = []
+    expected = subscribers * events
+
+    async def consume(ws: aiohttp.ClientWebSocketResponse) -> None:
+        for _ in range(events):
+            message = await ws.receive()
+            if message.type != aiohttp.WSMsgType.TEXT:
+                return
+            # Content carries the producer's perf_counter at emit time
+            latencies.append(time.perf_counter() - float(json.loads(message.data)["content"]))
+
+    consumers = [asyncio.create_task(consume(ws)) for ws in sockets]
+    start = time.perf_counter()
+    for _ in range(events):
+        await producer.emit(repr(time.perf_counter()), sender=BENCH_USER)
+        if interval:
+            await asyncio.sleep(interval)
+    done, pending = await asyncio.wait(consumers, timeout=30)
+    elapsed = time.perf_counter() - start
+    for task in pending:
+        task.cancel()
+    for ws in sockets:
+        await ws.close()
+    while broker.subscriber_count:
+        await asyncio.sleep(0.01)
+
+    result = _summarize(latencies, elapsed, len(latencies), expected - len(latencies))
+    result["subscribers"] = subscribers
+    result["events"] = events
+    return result
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return descriptions of results that regressed beyond ``tolerance``."""
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        if old["throughput_per_s"] and result["throughput_per_s"] < old["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old['throughput_per_s']} -> {result['throughput_per_s']}/s")
+        if old["p99_ms"] and result["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {old['p99_ms']} -> {result['p99_ms']}ms")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake = FakeDingTalk(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+        seed=args.seed,
+    )
+    api_base = await fake.start()
+
+    # The app reads its configuration at import time
+    os.environ.update({
+        "DINGTALK_CLIENT_ID": "bench-client-id",
+        "DINGTALK_CLIENT_SECRET": "bench-secret",
+        "DINGTALK_AGENT_ID": "0",
+        "DINGTALK_USE_STREAM": "false",
+        "DINGTALK_API_BASE": api_base,
+        "GATEWAY_TOKEN": "",
+        "GATEWAY_OUTBOX_PATH": "",
+    })
+    os.environ.setdefault("DINGTALK_API_QPS", "1000000")
+    os.environ.setdefault("DINGTALK_WEBHOOK_PER_MINUTE", "60000000")
+    os.environ.setdefault("GATEWAY_WS_MAX_LAG", str(max(100, args.events)))
+
+    import uvicorn
+
+    import app as gateway_app
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = uvicorn.Server(uvicorn.Config(gateway_app.app, host="127.0.0.1", port=0, log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if serve_task.done():
+            serve_task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    manager = gateway_app.manager
+    producer = FakeStreamProducer(manager._client, fake.webhook_url(BENCH_USER))
+    results: Dict[str, Any] = {}
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            # Cache a session webhook for the bench user so replies take the fast path
+            await producer.emit("warm up", sender=BENCH_USER)
+
+            results["send_message"] = await bench_http(
+                session,
+                f"{base_url}/send_message",
+                {"target": BENCH_USER, "content": "bench"},
+                args.requests,
+                args.concurrency,
+            )
+            results["send_markdown"] = await bench_http(
+                session,
+                f"{base_url}/send_markdown",
+                # No cached webhook for this user: measures the work notification path
+                {"target": NOTIFY_USER, "title": "bench", "content": "**bench**"},
+                args.requests,
+                args.concurrency,
+            )
+            for count in args.subscribers:
+                results[f"ws_fanout_{count}"] = await bench_fanout(
+                    session, base_url, manager, producer, count, args.events, args.event_interval_ms / 1000
+                )
+    finally:
+        server.should_exit = True
+        await serve_task
+        await fake.stop()
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "events": args.events,
+            "event_interval_ms": args.event_interval_ms,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "http_error_rate": args.http_error_rate,
+        },
+        "upstream_calls": fake.calls,
+        "upstream_errors": fake.errors,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per send endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--subscribers", default="1,10,100", help="Comma-separated /ws subscriber counts")
+    parser.add_argument("--events", type=int, default=200, help="Events published per fanout run")
+    parser.add_argument("--event-interval-ms", type=float, default=1.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fake DingTalk response delay")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of sends answered with errcode 90018")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Fraction of sends answered with HTTP 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--baseline", default=None, help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+    args.subscribers = [int(part) for part in args.subscribers.split(",") if part.strip()]
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for name, result in report["results"].items():
+        print(
+            f"{name:16} {result['throughput_per_s']:>10}/s  p50={result['p50_ms']:>8}ms  "
+            f"p99={result['p99_ms']:>8}ms  errors={result['errors']}"
+        )
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
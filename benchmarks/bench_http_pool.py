@@ -0,0 +1,95 @@
+"""Compare back-to-back send latency with a fresh session per call vs the pooled client.
+
+The "fresh" mode reproduces the previous behaviour of opening a new
+``aiohttp.ClientSession`` for every API call. The "pooled" mode goes through
+``DingTalkClient`` which keeps one session alive for its whole lifetime.
+
+Usage::
+
+    python -m benchmarks.bench_http_pool [--count 200] [--base-url URL]
+
+Without ``--base-url`` a local fake DingTalk server is started. Point it at a
+TLS endpoint to include handshake costs in the comparison.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+from gateway.dingtalk_client import DingTalkClient
+
+from .fake_dingtalk import FakeDingTalk
+
+
+# The same message body for both modes
+BODY = {"msgtype": "text", "text": {"content": "bench"}}
+
+
+def _summary(samples: list[float]) -> str:
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"mean={statistics.mean(samples):7.2f}ms p50={p50:7.2f}ms p99={p99:7.2f}ms"
+
+
+async def bench_fresh(webhook_url: str, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(webhook_url, json=BODY, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                await response.json(content_type=None)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def bench_pooled(client: DingTalkClient, webhook_url: str, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await client._send_via_webhook(webhook_url, BODY)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--base-url", default=None, help="Session webhook URL to target instead of the local fake")
+    args = parser.parse_args()
+
+    fake = None
+    if args.base_url:
+        webhook_url = args.base_url
+    else:
+        fake = FakeDingTalk()
+        await fake.start()
+        webhook_url = fake.webhook_url()
+
+    client = DingTalkClient(
+        client_id="bench-client-id",
+        client_secret="bench-secret",
+        agent_id="0",
+        on_message=lambda event: None,
+        use_stream=False,
+    )
+    try:
+        fresh = await bench_fresh(webhook_url, args.count)
+        pooled = await bench_pooled(client, webhook_url, args.count)
+    finally:
+        await client.close()
+        if fake:
+            await fake.stop()
+
+    print(f"back-to-back sends: {args.count}")
+    print(f"  fresh session per call: {_summary(fresh)}")
+    print(f"  pooled session:         {_summary(pooled)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Measure durable outbox enqueue throughput with group commit.
+
+Usage::
+
+    python -m benchmarks.bench_outbox [--count 5000] [--concurrency 64] [--path DIR]
+
+Every enqueue is acknowledged only after its transaction is committed with
+``synchronous=FULL``. Concurrent enqueues share commits, so the report shows
+how many operations each fsync carried. Run it on the target hardware (e.g.
+a Raspberry Pi SD card) with ``--path`` pointing at the add-on data volume.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from gateway.outbox import Outbox
+
+
+async def _noop_deliver(kind: str, payload: dict) -> None:
+    return None
+
+
+async def run(path: str, count: int, concurrency: int) -> None:
+    outbox = Outbox(path, _noop_deliver)
+    await outbox.start(run_workers=False)
+    payload = {"target": "user123", "content": "门铃响了", "priority": "high"}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            await outbox.enqueue("text", payload)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    stats = await outbox.stats()
+    await outbox.close()
+
+    commits = max(stats["commits"], 1)
+    print(f"enqueued {count} messages with concurrency {concurrency} in {elapsed:.2f}s")
+    print(f"  throughput:       {count / elapsed:,.0f} enqueues/s")
+    print(f"  commits (fsyncs): {stats['commits']}")
+    print(f"  ops per commit:   {stats['operations'] / commits:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--path", default=None, help="Directory for the benchmark database")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.path) as tmp:
+        asyncio.run(run(str(Path(tmp) / "outbox.db"), args.count, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Measure how long the gateway takes from process start to serving and to ready.
+
+Each run starts ``python app.py`` against a local fake DingTalk server and
+polls ``/health``: "listening" is the first answer, "ready" the first answer
+with every startup phase reached. The phases the gateway reports (seconds
+since ``app`` began importing) are averaged over the runs.
+
+Usage::
+
+    python -m benchmarks.bench_startup [--runs 5] [--latency 0.2]
+
+``--latency`` delays every fake API response, standing in for the round trip
+to DingTalk. Stream mode is off, since it needs the real DingTalk service.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+
+from .fake_dingtalk import FakeDingTalk
+
+APP_DIR = Path(__file__).resolve().parent.parent
+POLL_INTERVAL = 0.01
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_once(base_url: str, timeout: float) -> dict:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "DINGTALK_CLIENT_ID": "bench-client-id",
+        "DINGTALK_CLIENT_SECRET": "bench-secret",
+        "DINGTALK_AGENT_ID": "0",
+        "DINGTALK_USE_STREAM": "false",
+        "DINGTALK_API_BASE": base_url,
+        "GATEWAY_HOST": "127.0.0.1",
+        "GATEWAY_PORT": str(port),
+        "GATEWAY_LOG_LEVEL": "WARNING",
+    }
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "app.py", cwd=APP_DIR, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    result: dict = {"listening": None, "ready": None, "phases": {}}
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1)) as session:
+            while time.perf_counter() - started < timeout:
+                if process.returncode is not None:
+                    raise RuntimeError(f"gateway exited with code {process.returncode}")
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/health") as response:
+                        health = await response.json()
+                except aiohttp.ClientError:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                elapsed = time.perf_counter() - started
+                if result["listening"] is None:
+                    result["listening"] = elapsed
+                if health.get("ready"):
+                    result["ready"] = elapsed
+                    result["phases"] = health["phases"]
+                    break
+                await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        process.terminate()
+        await process.wait()
+    if result["ready"] is None:
+        raise RuntimeError(f"gateway not ready after {timeout}s")
+    return result
+
+
+def _summary(samples: list[float]) -> str:
+    return f"mean={statistics.mean(samples) * 1000:8.1f}ms min={min(samples) * 1000:8.1f}ms"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds added to each fake API response")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for each run to become ready")
+    args = parser.parse_args()
+
+    fake = FakeDingTalk(latency=args.latency)
+    base_url = await fake.start()
+    try:
+        results = [await run_once(base_url, args.timeout) for _ in range(args.runs)]
+    finally:
+        await fake.stop()
+
+    print(f"runs={args.runs} api latency={args.latency * 1000:.0f}ms")
+    print(f"  listening  {_summary([r['listening'] for r in results])}")
+    print(f"  ready      {_summary([r['ready'] for r in results])}")
+    print("  phases (since app import began):")
+    for phase in results[0]["phases"]:
+        print(f"    {phase:<8} {_summary([r['phases'][phase] for r in results])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+"""Local stand-in for the DingTalk open API used by the benchmarks."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import random
+
+from aiohttp import web
+
+
+class FakeDingTalk:
+    """Minimal fake of ``oapi.dingtalk.com`` serving the endpoints the gateway calls.
+
+    Args:
+        latency: Fixed delay in seconds added to every response.
+        jitter: Extra uniformly distributed delay in seconds.
+        error_rate: Fraction of send calls answered with ``error_code``.
+        http_error_rate: Fraction of send calls answered with HTTP 503.
+        error_code: DingTalk errcode used for injected errors (90018 is
+            DingTalk's rate limit code).
+        seed: Seed for the injection RNG, for repeatable runs.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        error_code: int = 90018,
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.error_code = error_code
+        self._random = random.Random(seed)
+        self.calls: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self._task_ids = itertools.count(1)
+        self._task_users: dict[int, list[str]] = {}  # task_id -> recipients, reported as unread
+        self.read_users: set[str] = set()  # Recipients reported as having read their messages
+        # Org directory: parent dept_id -> sub-departments, dept_id -> members
+        self.departments: dict[int, list[dict]] = {}
+        self.users: dict[int, list[dict]] = {}
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+        self.app = web.Application()
+        self.app.router.add_get("/gettoken", self._gettoken)
+        self.app.router.add_post("/topapi/message/corpconversation/asyncsend_v2", self._asyncsend)
+        self.app.router.add_post("/topapi/message/corpconversation/getsendresult", self._getsendresult)
+        self.app.router.add_post("/media/upload", self._media_upload)
+        self.app.router.add_post("/topapi/v2/department/listsub", self._listsub)
+        self.app.router.add_post("/topapi/v2/user/list", self._user_list)
+        self.app.router.add_post("/topapi/v2/user/getbymobile", self._getbymobile)
+        self.app.router.add_post("/robot/sendBySession", self._session_webhook)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def webhook_url(self, session: str = "bench") -> str:
+        return f"{self.base_url}/robot/sendBySession?session={session}"
+
+    async def _respond(self, name: str, payload: dict, inject: bool = True) -> web.Response:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if inject:
+            roll = self._random.random()
+            if roll < self.http_error_rate:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                return web.json_response({"errcode": -1, "errmsg": "injected"}, status=503)
+            if roll < self.http_error_rate + self.error_rate:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                return web.json_response({"errcode": self.error_code, "errmsg": "injected"})
+        return web.json_response(payload)
+
+    async def _gettoken(self, request: web.Request) -> web.Response:
+        return await self._respond("gettoken", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "access_token": "fake-token",
+            "expires_in": 7200,
+        }, inject=False)
+
+    async def _asyncsend(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        task_id = next(self._task_ids)
+        self._task_users[task_id] = str(body.get("userid_list", "")).split(",")
+        return await self._respond("asyncsend_v2", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "task_id": task_id,
+            "request_id": "fake",
+        })
+
+    async def _getsendresult(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        users = self._task_users.get(body.get("task_id"), [])
+        return await self._respond("getsendresult", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "send_result": {
+                "read_user_id_list": [u for u in users if u in self.read_users],
+                "unread_user_id_list": [u for u in users if u not in self.read_users],
+                "failed_user_id_list": [],
+                "forbidden_list": [],
+                "invalid_user_id_list": [],
+                "invalid_dept_id_list": [],
+            },
+        }, inject=False)
+
+    async def _media_upload(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        size = 0
+        async for part in reader:
+            while chunk := await part.read_chunk():
+                size += len(chunk)
+        return await self._respond("media_upload", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "type": request.query.get("type", "image"),
+            "media_id": f"@fake{next(self._task_ids)}-{size}",
+            "created_at": 0,
+        })
+
+    async def _listsub(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return await self._respond("listsub", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "result": self.departments.get(body["dept_id"], []),
+        }, inject=False)
+
+    async def _user_list(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        members = self.users.get(body["dept_id"], [])
+        cursor, size = body.get("cursor") or 0, body.get("size") or 100
+        page = members[cursor:cursor + size]
+        return await self._respond("user_list", {
+            "errcode": 0,
+            "errmsg": "ok",
+            "result": {"has_more": cursor + size < len(members), "next_cursor": cursor + size, "list": page},
+        }, inject=False)
+
+    async def _getbymobile(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        for members in self.users.values():
+            for user in members:
+                if user.get("mobile") == body["mobile"]:
+                    return await self._respond("getbymobile", {
+                        "errcode": 0, "errmsg": "ok", "result": {"userid": user["userid"]},
+                    }, inject=False)
+        return await self._respond("getbymobile", {"errcode": 60121, "errmsg": "找不到该用户"}, inject=False)
+
+    async def _session_webhook(self, request: web.Request) -> web.Response:
+        await request.read()
+        return await self._respond("session_webhook", {"errcode": 0, "errmsg": "ok"})
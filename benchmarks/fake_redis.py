@@ -0,0 +1,155 @@
+"""Local stand-in for Redis, covering what the ``redis`` event bus backend uses.
+
+Supports ``PING``, ``AUTH``, ``SELECT``, ``GET``, ``SET`` (``NX``/``XX``,
+``PX``/``EX``), ``PEXPIRE``, ``DEL``, ``PUBLISH`` and ``SUBSCRIBE``. Run it
+on its own to try several gateway workers without a Redis server::
+
+    python -m benchmarks.fake_redis [--port 6379]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[str, float | None]] = {}
+        self._channels: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._server: asyncio.AbstractServer | None = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        bound_port = self._server.sockets[0].getsockname()[1]
+        self.url = f"redis://{host}:{bound_port}/0"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            for writers in self._channels.values():
+                for writer in writers:
+                    writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _get(self, key: str) -> str | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        subscribed: List[str] = []
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    return
+                name = args[0].upper()
+                if name == "SUBSCRIBE":
+                    for channel in args[1:]:
+                        self._channels.setdefault(channel, set()).add(writer)
+                        subscribed.append(channel)
+                        writer.write(_encode(["subscribe", channel, len(subscribed)]))
+                else:
+                    writer.write(_encode(self._execute(name, args[1:])))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self._channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    def _execute(self, name: str, args: List[str]) -> Any:
+        if name in ("PING", "AUTH", "SELECT"):
+            return _Status("PONG" if name == "PING" else "OK")
+        if name == "GET":
+            return self._get(args[0])
+        if name == "SET":
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            exists = self._get(key) is not None
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                return None
+            expires_at = None
+            if "PX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index("PX") + 1]) / 1000
+            elif "EX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index("EX") + 1])
+            self._data[key] = (value, expires_at)
+            return _Status("OK")
+        if name == "PEXPIRE":
+            value = self._get(args[0])
+            if value is None:
+                return 0
+            self._data[args[0]] = (value, time.monotonic() + int(args[1]) / 1000)
+            return 1
+        if name == "DEL":
+            return sum(1 for key in args if self._data.pop(key, None) is not None)
+        if name == "PUBLISH":
+            channel, message = args
+            subscribers = self._channels.get(channel, set())
+            for subscriber in subscribers:
+                subscriber.write(_encode(["message", channel, message]))
+            return len(subscribers)
+        return _Error(f"ERR unknown command '{name}'")
+
+
+class _Status(str):
+    pass
+
+
+class _Error(str):
+    pass
+
+
+def _encode(value: Any) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, _Status):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, _Error):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(_encode(item) for item in value)
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def _read_command(reader: asyncio.StreamReader) -> List[str] | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.decode().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readline()
+        data = await reader.readexactly(int(header[1:-2]) + 2)
+        args.append(data[:-2].decode())
+    return args
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = FakeRedis()
+    print(f"fake redis listening on {await server.start(args.host, args.port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
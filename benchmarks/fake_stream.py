@@ -0,0 +1,68 @@
+"""Fake DingTalk Stream producer driving the client's message handler."""
+
+from __future__ import annotations
+
+import itertools
+import time
+from types import SimpleNamespace
+
+from gateway.dingtalk_client import DingTalkClient
+
+
+def make_chatbot_message(
+    sender: str,
+    content: str,
+    conversation_id: str,
+    session_webhook: str | None = None,
+    message_id: str | None = None,
+    is_group: bool = False,
+    at_me: bool = False,
+    webhook_ttl: float = 3600.0,
+) -> SimpleNamespace:
+    """Build an object with the attributes of ``dingtalk_stream.ChatbotMessage`` the gateway reads."""
+    return SimpleNamespace(
+        conversation_type="2" if is_group else "1",
+        sender_staff_id=sender,
+        sender_id=f"${sender}",
+        sender_nick=sender,
+        message_id=message_id or f"msg-{time.monotonic_ns()}",
+        conversation_id=conversation_id,
+        conversation_title="Bench group" if is_group else None,
+        session_webhook=session_webhook,
+        session_webhook_expired_time=int((time.time() + webhook_ttl) * 1000),
+        text=SimpleNamespace(content=content),
+        is_in_at_list=at_me,
+    )
+
+
+class FakeStreamProducer:
+    """Feed synthetic chatbot messages into ``DingTalkClient._handle_stream_message``.
+
+    This skips the Stream websocket and SDK callback dispatch, so it measures
+    the gateway from message parsing onwards.
+    """
+
+    def __init__(self, client: DingTalkClient, webhook_url: str | None = None) -> None:
+        self._client = client
+        self._webhook_url = webhook_url
+        self._ids = itertools.count(1)
+        self.sent = 0
+
+    async def emit(
+        self,
+        content: str,
+        sender: str = "bench-user",
+        conversation_id: str | None = None,
+        is_group: bool = False,
+    ) -> None:
+        message = make_chatbot_message(
+            sender=sender,
+            content=content,
+            conversation_id=conversation_id or f"cid-{sender}",
+            session_webhook=self._webhook_url,
+            message_id=f"bench-{next(self._ids)}",
+            is_group=is_group,
+            at_me=is_group,
+        )
+        await self._client._handle_stream_message(message)
+        self.sent += 1
@@ -0,0 +1,143 @@
+"""Coalesce identical work notifications into shared ``userid_list`` calls."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[str, Dict[str, Any], str], Awaitable[Dict[str, Any]]]
+
+
+class PartialSendError(Exception):
+    """Some of the calls a large send was split into failed.
+
+    ``results`` holds the API results of the calls that went out,
+    ``failed_targets`` the user ids the others carried and ``error`` the
+    first failure.
+    """
+
+    def __init__(self, results: List[Dict[str, Any]], failed_targets: List[str], error: BaseException) -> None:
+        super().__init__(f"Not sent to {len(failed_targets)} users: {error}")
+        self.results = results
+        self.failed_targets = failed_targets
+        self.error = error
+
+
+class _Batch:
+    __slots__ = ("msg", "priority", "targets", "waiters", "timer")
+
+    def __init__(self, msg: Dict[str, Any], priority: str) -> None:
+        self.msg = msg
+        self.priority = priority
+        self.targets: Dict[str, None] = {}  # Ordered set of user ids
+        self.waiters: List[asyncio.Future] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class NotificationBatcher:
+    """Collect identical payloads for a short window and send them in one request.
+
+    ``asyncsend_v2`` accepts up to 100 comma-separated user ids, so a broadcast
+    to many users costs one round trip instead of one per user. Every caller
+    receives the API result (or exception) of the request that carried its
+    targets. A send to more users than one request takes is split; if only
+    some of its requests fail it raises :class:`PartialSendError`, so a retry
+    can skip the users already reached.
+    """
+
+    def __init__(self, send: SendFunc, window: float = 0.005, max_targets: int = 100) -> None:
+        self._send = send
+        self._window = window
+        self._max_targets = max_targets
+        self._pending: Dict[str, _Batch] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(
+        self, userid_list: str, msg: Dict[str, Any], priority: str = "normal", wait: bool = True,
+    ) -> Dict[str, Any]:
+        """Queue ``msg`` for the given comma-separated user ids and wait for the result.
+
+        With ``wait=False`` the send joins a batch already collecting the same
+        message but does not hold a new one open for later callers.
+        """
+        targets = [t for t in (part.strip() for part in userid_list.split(",")) if t]
+        if self._window <= 0:
+            return await self._send(",".join(targets), msg, priority)
+        if len(targets) > self._max_targets:
+            chunks = [targets[i:i + self._max_targets] for i in range(0, len(targets), self._max_targets)]
+            results = await asyncio.gather(
+                *(self._enqueue(chunk, msg, priority, wait) for chunk in chunks), return_exceptions=True
+            )
+            failed = [(chunk, r) for chunk, r in zip(chunks, results) if isinstance(r, BaseException)]
+            if not failed:
+                return {**results[0], "task_ids": [r.get("task_id") for r in results]}
+            if len(failed) == len(chunks):
+                raise failed[0][1]
+            raise PartialSendError(
+                [r for r in results if not isinstance(r, BaseException)],
+                [target for chunk, _ in failed for target in chunk],
+                failed[0][1],
+            )
+        return await self._enqueue(targets, msg, priority, wait)
+
+    async def _enqueue(self, targets: List[str], msg: Dict[str, Any], priority: str, wait: bool) -> Dict[str, Any]:
+        # Messages of different priority are never merged
+        key = priority + json.dumps(msg, sort_keys=True, ensure_ascii=False)
+        batch = self._pending.get(key)
+        if batch is not None and (
+            len(batch.targets) + len(targets) > self._max_targets
+            or any(t in batch.targets for t in targets)
+        ):
+            # Full, or the same user would receive this message twice: send it now
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = _Batch(msg, priority)
+            if wait:
+                batch.timer = asyncio.get_running_loop().call_later(self._window, self._flush, key)
+            self._pending[key] = batch
+
+        batch.targets.update(dict.fromkeys(targets))
+        waiter = asyncio.get_running_loop().create_future()
+        batch.waiters.append(waiter)
+        if not wait or len(batch.targets) >= self._max_targets:
+            self._flush(key)
+        return await waiter
+
+    def _flush(self, key: str) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch) -> None:
+        if len(batch.waiters) > 1:
+            logger.debug(
+                "[DingTalk] Batched %d requests into one call for %d users",
+                len(batch.waiters), len(batch.targets),
+            )
+        try:
+            result = await self._send(",".join(batch.targets), batch.msg, batch.priority)
+        except Exception as e:
+            for waiter in batch.waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in batch.waiters:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+    async def close(self) -> None:
+        """Send anything still pending and wait for in-flight batches."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
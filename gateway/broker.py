@@ -1,56 +1,477 @@
-"""Simple asyncio-based pub/sub broker for message fanout."""
+"""Ring-buffer event log with cursor-based subscriptions for message fanout."""
 
 from __future__ import annotations
 
 import asyncio
-from typing import Any, AsyncIterator, Dict, Set
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Set, Tuple
+
+from .filters import EventFilter, event_field
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Published events are dicts or objects with a cached ``to_json()`` (see events.py)
+Event = Any
+
+# What to do when a subscriber falls more than ``max_lag`` events behind
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"  # Keep only the newest event per conversation
+DISCONNECT = "disconnect"  # Drop oldest, disconnect after ``max_drops`` drops
+POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE, DISCONNECT)
+
+
+class SlowConsumerError(Exception):
+    """Raised to a subscriber that was disconnected for falling behind."""
+
+
+def new_epoch() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+def format_event_id(epoch: str, seq: int) -> str:
+    return f"{epoch}-{seq}"
+
+
+def parse_event_id(event_id: str) -> Tuple[str, int]:
+    """Split an ``<epoch>-<seq>`` event id; a bare number has no epoch.
+
+    Raises:
+        ValueError: If the sequence part is not a number.
+    """
+    epoch, _, seq = event_id.rpartition("-")
+    if not seq.isdigit():
+        raise ValueError(f"Malformed event id: {event_id!r}")
+    return epoch, int(seq)
+
+
+class _Entry:
+    """One ring slot; caches the encoded frame shared by every subscriber."""
+
+    __slots__ = ("seq", "event_id", "event", "published_at", "_frame")
+
+    def __init__(self, seq: int, event_id: str, event: Event) -> None:
+        self.seq = seq
+        self.event_id = event_id
+        self.event = event
+        self.published_at = time.perf_counter()
+        self._frame: str | None = None
+
+    def frame(self) -> str:
+        if self._frame is None:
+            to_json = getattr(self.event, "to_json", None)
+            if to_json is None:
+                self._frame = dumps(self.event)
+            else:
+                # Splice the event_id into the event's cached JSON object
+                self._frame = f'{to_json()[:-1]},"event_id":"{self.event_id}"}}'
+        return self._frame
+
+
+def _coalesce_key(event: Event) -> tuple:
+    return (
+        event_field(event, "event_type"),
+        event_field(event, "room_id") or event_field(event, "sender"),
+    )
+
+
+class Subscription:
+    """A subscriber's read cursor into the broker's event log.
+
+    Unfiltered subscriptions read the shared ring directly. Filtered ones,
+    and ones that overflowed ``max_lag``, are served from a private backlog
+    the backpressure policy has already been applied to.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        broker: "MessageBroker",
+        cursor: int,
+        event_filter: EventFilter | None = None,
+        policy: str = DROP_OLDEST,
+        max_lag: int = 1000,
+        max_drops: int = 0,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        self.id = next(self._ids)
+        self._broker = broker
+        self.cursor = cursor  # Sequence number of the next ring event to read
+        self.filter = event_filter
+        self.policy = policy
+        self.max_lag = max(1, max_lag)
+        self.max_drops = max_drops
+        self.dropped = 0  # Events this subscriber never received
+        self.delivered = 0
+        self.closed = False
+        self.last_read = time.monotonic()
+        self.last_published_at = 0.0  # perf_counter() publish time of the last event read
+        self.last_trace_id: str | None = None  # Trace id of the last event read
+        self._backlog: Deque[_Entry] = deque()
+        self._waiter: asyncio.Future | None = None
+
+    async def get(self) -> Event:
+        """Wait for and return the next event."""
+        return (await self._broker._next(self)).event
+
+    async def get_frame(self) -> str:
+        """Wait for the next event and return it JSON-encoded, ``event_id`` included."""
+        return (await self._broker._next(self)).frame()
+
+    @property
+    def lag(self) -> int:
+        if self.filter is not None:
+            return len(self._backlog)
+        return len(self._backlog) + self._broker._next_seq - self.cursor
+
+    def _deliver(self, entry: _Entry) -> None:
+        """Queue a matching entry for a filtered subscription."""
+        if len(self._backlog) >= self.max_lag:
+            if self.policy in (DROP_OLDEST, DISCONNECT):
+                self._backlog.popleft()
+                self._drop(1)
+            else:
+                self._backlog = deque(self._apply_policy(list(self._backlog) + [entry]))
+                self._wake()
+                return
+        self._backlog.append(entry)
+        self._wake()
+
+    def _apply_policy(self, entries: List[_Entry]) -> List[_Entry]:
+        """Trim an overflowing list of entries down to ``max_lag``."""
+        if self.policy == DROP_NEWEST:
+            kept = entries[:self.max_lag]
+        elif self.policy == COALESCE:
+            latest: Dict[tuple, _Entry] = {}
+            for entry in entries:
+                key = _coalesce_key(entry.event)
+                latest.pop(key, None)
+                latest[key] = entry
+            kept = list(latest.values())[-self.max_lag:]
+        else:
+            kept = entries[-self.max_lag:]
+        self._drop(len(entries) - len(kept))
+        return kept
+
+    def _drop(self, count: int) -> None:
+        self.dropped += count
+        if self.policy == DISCONNECT and self.dropped > self.max_drops:
+            self._close()
+
+    def _close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "policy": self.policy,
+            "filtered": self.filter is not None,
+            "lag": self.lag,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "idle_s": round(time.monotonic() - self.last_read, 1),
+        }
 
 
 class MessageBroker:
-    """Fan out events to multiple asyncio subscribers."""
+    """Fan out events through one bounded, sequence-numbered ring buffer.
 
-    def __init__(self) -> None:
-        self._subscribers: Set[asyncio.Queue] = set()
-        self._lock = asyncio.Lock()
+    Each event gets an ``event_id`` of ``<epoch>-<seq>``: the sequence number
+    increases by one per event and the epoch is picked at random when the
+    broker starts, so ids from before a restart are never mistaken for new
+    ones. Publishing writes one slot and
+    wakes waiting readers, independent of the number of subscribers. Each
+    subscriber reads at its own cursor, so a slow reader never holds up the
+    others; it only loses events once the ring wraps past its cursor. A
+    reconnecting client passes the last ``event_id`` it saw to replay the
+    events after it, or everything still in the ring if its id belongs to
+    another epoch.
+
+    Subscriptions with an :class:`EventFilter` are indexed by sender or room
+    id, so a publish only evaluates the filters that could match it.
+
+    Each subscription picks a backpressure policy for when it falls more than
+    ``max_lag`` events behind, and :meth:`evict_slow_consumers` disconnects
+    subscribers that stopped reading altogether.
+    """
+
+    def __init__(self, capacity: int = 1000) -> None:
+        self._capacity = capacity
+        self._ring: List[_Entry | None] = [None] * capacity
+        self.epoch = new_epoch()
+        self._next_seq = 1
+        self._first_seq = 1  # Oldest id of the current contiguous range
+        self._subscribers: Set[Subscription] = set()
+        # Filtered subscriptions, each indexed under exactly one of these
+        self._by_sender: Dict[str, Set[Subscription]] = {}
+        self._by_room: Dict[str, Set[Subscription]] = {}
+        self._scan: Set[Subscription] = set()
+        self._filtered = 0
+        self._waiter: asyncio.Future | None = None
         self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self.evicted = 0
 
     def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
         self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    @property
+    def last_event_id(self) -> str:
+        return format_event_id(self.epoch, self._next_seq - 1)
+
+    @property
+    def _oldest_seq(self) -> int:
+        return max(self._first_seq, self._next_seq - self._capacity)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def subscribe(
+        self,
+        last_event_id: str | None = None,
+        event_filter: EventFilter | None = None,
+        policy: str = DROP_OLDEST,
+        max_lag: int | None = None,
+        max_drops: int = 0,
+    ) -> Subscription:
+        """Subscribe to new events, or replay events after ``last_event_id``.
+
+        Args:
+            last_event_id: Replay events after this id (``None`` for new events only)
+            event_filter: Deliver only matching events
+            policy: Backpressure policy, one of :data:`POLICIES`
+            max_lag: Events a subscriber may fall behind before the policy applies
+                (defaults to the ring capacity)
+            max_drops: Drops tolerated by the ``disconnect`` policy
+
+        Raises:
+            ValueError: If ``policy`` or ``last_event_id`` is malformed.
+        """
+        if last_event_id is None:
+            cursor = self._next_seq
+        else:
+            epoch, seq = parse_event_id(last_event_id)
+            if epoch != self.epoch:
+                # Client saw ids from before a gateway restart: replay what we have
+                cursor = self._oldest_seq
+            else:
+                # An id this worker has not reached yet resumes at its newest event
+                cursor = min(max(seq + 1, self._oldest_seq), self._next_seq)
+        subscription = Subscription(
+            self,
+            cursor,
+            event_filter,
+            policy=policy,
+            max_lag=min(max_lag or self._capacity, self._capacity),
+            max_drops=max_drops,
+        )
+        if event_filter is not None:
+            for seq in range(cursor, self._next_seq):
+                entry = self._ring[seq % self._capacity]
+                if event_filter.matches(entry.event):
+                    subscription._deliver(entry)
+            subscription.cursor = self._next_seq
+            self._index(subscription, add=True)
+        self._subscribers.add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self._subscribers and subscription.filter is not None:
+            self._index(subscription, add=False)
+        self._subscribers.discard(subscription)
 
-    async def subscribe(self, max_queue: int = 100) -> asyncio.Queue:
-        queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
-        async with self._lock:
-            self._subscribers.add(queue)
-        return queue
+    def _index(self, subscription: Subscription, add: bool) -> None:
+        event_filter = subscription.filter
+        if event_filter.senders:
+            index, keys = self._by_sender, event_filter.senders
+        elif event_filter.room_ids:
+            index, keys = self._by_room, event_filter.room_ids
+        else:
+            index, keys = None, ()
 
-    async def unsubscribe(self, queue: asyncio.Queue) -> None:
-        async with self._lock:
-            self._subscribers.discard(queue)
+        if index is None:
+            (self._scan.add if add else self._scan.discard)(subscription)
+        for key in keys:
+            if add:
+                index.setdefault(key, set()).add(subscription)
+            else:
+                bucket = index.get(key)
+                if bucket is not None:
+                    bucket.discard(subscription)
+                    if not bucket:
+                        del index[key]
+        self._filtered += 1 if add else -1
 
-    def publish(self, event: Dict[str, Any]) -> None:
-        """Publish event to all subscribers (sync version for backward compatibility)."""
-        if not self._subscribers:
-            return
+    def publish(self, event: Event) -> int:
+        """Publish an event; safe to call from any thread."""
         if self._loop is None:
             raise RuntimeError("Event loop not attached")
+        if threading.get_ident() == self._loop_thread:
+            return self._append(event)
+        self._loop.call_soon_threadsafe(self._append, event)
+        return 0
 
-        for queue in list(self._subscribers):
-            asyncio.run_coroutine_threadsafe(self._safe_put(queue, event), self._loop)
-    
-    async def async_publish(self, event: Dict[str, Any]) -> None:
-        """Publish event to all subscribers asynchronously (faster)."""
-        if not self._subscribers:
-            return
-        
-        # Use asyncio.gather for parallel puts (faster than sequential)
-        await asyncio.gather(
-            *[self._safe_put(queue, event) for queue in list(self._subscribers)],
-            return_exceptions=True
-        )
+    async def async_publish(self, event: Event, event_id: str | None = None) -> int:
+        """Publish an event from the event loop.
+
+        ``event_id`` is an id assigned elsewhere (by the event bus shared by
+        several workers). Ids that were already published are ignored; a
+        skipped range (e.g. after joining late) or another epoch starts a new
+        contiguous range.
+        """
+        if event_id is not None:
+            epoch, seq = parse_event_id(event_id)
+            if epoch != self.epoch:
+                self.epoch = epoch
+                self._skip_to(seq)
+            elif seq < self._next_seq:
+                return 0
+            elif seq > self._next_seq:
+                self._skip_to(seq)
+        return self._append(event)
+
+    def _skip_to(self, seq: int) -> None:
+        # Cursor subscribers keep their unread events as backlog
+        for subscription in self._subscribers:
+            if subscription.filter is None and subscription.cursor < self._next_seq:
+                start = max(subscription.cursor, self._oldest_seq)
+                subscription._backlog.extend(
+                    self._ring[s % self._capacity] for s in range(start, self._next_seq)
+                )
+            if subscription.filter is None:
+                subscription.cursor = seq
+        self._next_seq = self._first_seq = seq
+
+    def _append(self, event: Event) -> int:
+        seq = self._next_seq
+        self._next_seq += 1
+        event_id = format_event_id(self.epoch, seq)
+        if isinstance(event, dict):
+            event["event_id"] = event_id
+        entry = self._ring[seq % self._capacity] = _Entry(seq, event_id, event)
+        if self._filtered:
+            self._route(entry)
+        self._wake_readers()
+        return seq
+
+    def _wake_readers(self) -> None:
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _route(self, entry: _Entry) -> None:
+        """Push an entry to the filtered subscriptions it matches."""
+        event = entry.event
+        groups = [self._scan]
+        sender = event_field(event, "sender")
+        if sender is not None and sender in self._by_sender:
+            groups.append(self._by_sender[sender])
+        room_id = event_field(event, "room_id")
+        if room_id is not None and room_id in self._by_room:
+            groups.append(self._by_room[room_id])
+        for group in groups:
+            for subscription in group:
+                if subscription.filter.matches(event):
+                    subscription._deliver(entry)
+
+    async def _next(self, subscription: Subscription) -> _Entry:
+        entry = await self._read(subscription)
+        subscription.delivered += 1
+        subscription.last_read = time.monotonic()
+        subscription.last_published_at = entry.published_at
+        subscription.last_trace_id = event_field(entry.event, "trace_id")
+        return entry
+
+    async def _read(self, subscription: Subscription) -> _Entry:
+        if subscription.closed:
+            raise SlowConsumerError("Subscriber fell too far behind")
+
+        if subscription.filter is not None:
+            while not subscription._backlog:
+                if subscription._waiter is None or subscription._waiter.done():
+                    subscription._waiter = asyncio.get_running_loop().create_future()
+                await subscription._waiter
+                if subscription.closed:
+                    raise SlowConsumerError("Subscriber fell too far behind")
+            return subscription._backlog.popleft()
+
+        if subscription._backlog:
+            return subscription._backlog.popleft()
+
+        while subscription.cursor >= self._next_seq:
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            # Shield: one cancelled reader must not cancel the shared wakeup
+            await asyncio.shield(self._waiter)
+            if subscription.closed:
+                raise SlowConsumerError("Subscriber fell too far behind")
+
+        oldest = self._oldest_seq
+        if subscription.cursor < oldest:
+            # Overwritten in the ring before this subscriber got to them
+            subscription._drop(oldest - subscription.cursor)
+            subscription.cursor = oldest
+
+        if self._next_seq - subscription.cursor > subscription.max_lag:
+            entries = [self._ring[seq % self._capacity] for seq in range(subscription.cursor, self._next_seq)]
+            subscription.cursor = self._next_seq
+            subscription._backlog.extend(subscription._apply_policy(entries))
+        if subscription.closed:
+            raise SlowConsumerError("Subscriber fell too far behind")
+        if subscription._backlog:
+            return subscription._backlog.popleft()
+
+        entry = self._ring[subscription.cursor % self._capacity]
+        subscription.cursor = entry.seq + 1
+        return entry
+
+    def evict_slow_consumers(self, idle_timeout: float) -> int:
+        """Disconnect subscribers holding unread events that have not read for ``idle_timeout`` seconds."""
+        now = time.monotonic()
+        evicted = 0
+        for subscription in list(self._subscribers):
+            if not subscription.closed and subscription.lag > 0 and now - subscription.last_read > idle_timeout:
+                logger.warning(
+                    "[Broker] Evicting slow subscriber %d (lag %d, idle %.0fs)",
+                    subscription.id, subscription.lag, now - subscription.last_read,
+                )
+                subscription._close()
+                evicted += 1
+        if evicted:
+            self.evicted += evicted
+            # Wake cursor readers so they observe ``closed``
+            self._wake_readers()
+        return evicted
 
-    async def _safe_put(self, queue: asyncio.Queue, event: Dict[str, Any]) -> None:
-        try:
-            await queue.put(event)
-        except asyncio.QueueFull:
-            await queue.get()
-            await queue.put(event)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "filtered_subscribers": self._filtered,
+            "last_event_id": self.last_event_id,
+            "buffer_capacity": self._capacity,
+            "buffered": min(self._capacity, self._next_seq - self._first_seq),
+            "max_lag": max((s.lag for s in self._subscribers), default=0),
+            "dropped": sum(s.dropped for s in self._subscribers),
+            "evicted": self.evicted,
+            "subscriptions": [s.stats() for s in self._subscribers],
+        }
@@ -0,0 +1,616 @@
+"""Cross-process event bus for running several gateway workers.
+
+With more than one uvicorn worker (or gateway node), exactly one process
+may hold the DingTalk Stream connection, while ``/ws`` clients can be
+connected to any of them. The bus elects that leader and carries ingested
+events between processes:
+
+* every worker hands the events it ingests to the leader;
+* the leader assigns the event id (its epoch and the next sequence
+  number) and broadcasts the event to all workers,
+  itself included, which publish it on their local :class:`MessageBroker`.
+
+Event ids therefore agree across workers, and ``last_event_id`` replay
+works against whichever worker a client reconnects to. Envelopes also carry
+the sender's session webhook, so any worker can reply on the fast path.
+
+Followers also :meth:`~EventBus.call` the leader, so that sends go through
+one set of rate limits, per-target lanes and receipt store.
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Set
+from urllib.parse import urlparse
+
+from .broker import format_event_id, new_epoch, parse_event_id
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# {"event": {...}, "webhook": {...} | None, "epoch": str, "seq": int}, or
+# {"receipt": {...}, "epoch": str, "seq": int};
+# calls travel as {"request": {...}, "call_id": str, "node": str} and
+# {"response": {...}, "call_id": str}, without a sequence number
+Envelope = Dict[str, Any]
+OnEvent = Callable[[Envelope], Awaitable[None]]
+OnLeadership = Callable[[bool], Awaitable[None]]
+OnRequest = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+Admit = Callable[[Envelope], bool]
+
+RETRY_DELAY = 0.5  # Seconds between attempts to reach or become the leader
+MAX_PEER_BUFFER = 4 * 1024 * 1024  # Unsent bytes before a follower is dropped
+CALL_TIMEOUT = 60.0  # Seconds a follower waits for the leader to answer a call
+
+
+class BusUnavailableError(ConnectionError):
+    """Raised when a call cannot reach the leader or gets no answer in time."""
+
+
+class EventBus(abc.ABC):
+    """Base class for bus backends; subclasses implement transport and election."""
+
+    backend = "local"
+
+    def __init__(self) -> None:
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._on_event: OnEvent | None = None
+        self._on_leadership: OnLeadership | None = None
+        self._last_event_id: Callable[[], str] = lambda: format_event_id(new_epoch(), 0)
+        self._on_request: OnRequest | None = None
+        self._admit: Admit = lambda envelope: True
+        self._epoch = ""
+        self._seq = 0
+        self._task: asyncio.Task | None = None
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._request_tasks: Set[asyncio.Task] = set()
+
+        self.published = 0
+        self.received = 0
+        self.lost = 0  # Events ingested while no leader was reachable
+        self.elections = 0
+        self.calls = 0
+        self.call_errors = 0
+        self.rejected = 0  # Events the leader's admit check turned away
+
+    async def start(
+        self,
+        on_event: OnEvent,
+        on_leadership: OnLeadership,
+        last_event_id: Callable[[], str],
+        on_request: OnRequest | None = None,
+        admit: Admit | None = None,
+    ) -> None:
+        """Join the bus.
+
+        Args:
+            on_event: Called with every sequenced envelope, in id order
+            on_leadership: Called with ``True``/``False`` when this process
+                gains or loses leadership
+            last_event_id: Id of the newest event published locally, used to
+                continue its epoch and sequence after taking over as leader
+            on_request: Answers :meth:`call` requests while this process leads
+            admit: Checked by the leader before sequencing an envelope;
+                envelopes it returns ``False`` for are dropped
+        """
+        self._on_event = on_event
+        self._on_leadership = on_leadership
+        self._last_event_id = last_event_id
+        self._on_request = on_request
+        if admit is not None:
+            self._admit = admit
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for task in list(self._request_tasks):
+            task.cancel()
+        self._fail_calls("bus closed")
+        await self._set_leader(False)
+
+    @abc.abstractmethod
+    async def publish(self, envelope: Envelope) -> None:
+        """Hand an ingested event to the leader for sequencing and broadcast."""
+
+    @abc.abstractmethod
+    async def _run(self) -> None:
+        """Elect the leader and move envelopes between processes until cancelled."""
+
+    @abc.abstractmethod
+    async def _send_request(self, envelope: Envelope) -> None:
+        """Send a call envelope to the leader; raise ``BusUnavailableError`` if there is none."""
+
+    @abc.abstractmethod
+    async def _send_response(self, request: Envelope, envelope: Envelope, origin: Any) -> None:
+        """Send a response envelope back to the follower that made ``request``."""
+
+    async def call(self, request: Dict[str, Any], timeout: float = CALL_TIMEOUT) -> Dict[str, Any]:
+        """Have the leader answer ``request`` and return its response.
+
+        The leader answers its own calls directly. A handler failure comes
+        back as ``{"error": message, "error_type": class name}``.
+
+        Raises:
+            BusUnavailableError: If no leader is reachable or it does not
+                answer within ``timeout`` seconds. The request may or may
+                not have been carried out.
+        """
+        self.calls += 1
+        if self.is_leader:
+            return await self._answer(request)
+        call_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        try:
+            await self._send_request({"request": request, "call_id": call_id, "node": self.node_id})
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.call_errors += 1
+            raise BusUnavailableError(f"Leader did not answer within {timeout}s") from None
+        except BusUnavailableError:
+            self.call_errors += 1
+            raise
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def _answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if self._on_request is None:
+            return {"error": "calls are not served", "error_type": "RuntimeError"}
+        try:
+            return await self._on_request(request)
+        except Exception as e:
+            return {"error": str(e), "error_type": type(e).__name__}
+
+    def _serve_request(self, envelope: Envelope, origin: Any = None) -> None:
+        """Answer a follower's call in the background, so the bus keeps reading."""
+        async def serve() -> None:
+            response = await self._answer(envelope["request"])
+            try:
+                await self._send_response(envelope, {"response": response, "call_id": envelope["call_id"]}, origin)
+            except (OSError, RedisError) as e:
+                logger.warning("[Bus] Could not answer call from %s: %s", envelope.get("node"), e)
+
+        task = asyncio.create_task(serve())
+        self._request_tasks.add(task)
+        task.add_done_callback(self._request_tasks.discard)
+
+    def _resolve_call(self, envelope: Envelope) -> None:
+        future = self._calls.get(envelope.get("call_id"))
+        if future is not None and not future.done():
+            future.set_result(envelope["response"])
+
+    def _fail_calls(self, reason: str) -> None:
+        """Fail calls waiting on a leader connection that went away."""
+        for future in self._calls.values():
+            if not future.done():
+                future.set_exception(BusUnavailableError(f"Leader connection lost: {reason}"))
+
+    def _sequence_admitted(self, envelope: Envelope) -> Envelope | None:
+        if not self._admit(envelope):
+            self.rejected += 1
+            return None
+        return self._sequence(envelope)
+
+    async def _set_leader(self, leader: bool) -> None:
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            self.elections += 1
+            self._epoch, self._seq = parse_event_id(self._last_event_id())
+            logger.info("[Bus] %s is now the leader (%s)", self.node_id, self.backend)
+        else:
+            logger.info("[Bus] %s is no longer the leader", self.node_id)
+        if self._on_leadership:
+            try:
+                await self._on_leadership(leader)
+            except Exception as e:
+                if leader:
+                    raise
+                logger.error("[Bus] Failed to hand back leadership: %s", e, exc_info=True)
+
+    async def _take_leadership(self) -> bool:
+        """Become the leader; if taking over fails, step down again and return ``False``."""
+        try:
+            await self._set_leader(True)
+        except Exception as e:
+            logger.error("[Bus] %s failed to take over as leader: %s", self.node_id, e, exc_info=True)
+            await self._set_leader(False)
+            return False
+        return True
+
+    def _sequence(self, envelope: Envelope) -> Envelope:
+        self._seq += 1
+        return {**envelope, "epoch": self._epoch, "seq": self._seq}
+
+    async def _deliver(self, envelope: Envelope) -> None:
+        self.received += 1
+        # Keep a later leader's sequence ahead of everything seen so far; two
+        # leaders overlapping on a lapsed lease converge on the newest epoch
+        if envelope["epoch"] != self._epoch:
+            self._epoch, self._seq = envelope["epoch"], envelope["seq"]
+        else:
+            self._seq = max(self._seq, envelope["seq"])
+        try:
+            await self._on_event(envelope)
+        except Exception as e:
+            logger.error("[Bus] Failed to publish event %s: %s", envelope.get("seq"), e, exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "node_id": self.node_id,
+            "leader": self.is_leader,
+            "published": self.published,
+            "received": self.received,
+            "lost": self.lost,
+            "elections": self.elections,
+            "calls": self.calls,
+            "call_errors": self.call_errors,
+            "rejected": self.rejected,
+        }
+
+
+class UnixSocketBus(EventBus):
+    """Bus for workers on one host: a file lock elects the leader, which
+    serves newline-delimited JSON on a Unix socket.
+
+    Followers connect to the socket and send their ingested events up it;
+    the leader writes every sequenced event back down to all of them. When
+    the leader exits, its lock is released and the followers race for it.
+    """
+
+    backend = "unix"
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self._lock_path = f"{path}.lock"
+        self._lock_fd: int | None = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._upstream: asyncio.StreamWriter | None = None
+
+    async def close(self) -> None:
+        await super().close()
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+        if self._lock_fd is not None:
+            # Closing the descriptor releases the lock for the next leader
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def publish(self, envelope: Envelope) -> None:
+        self.published += 1
+        if self.is_leader:
+            sequenced = self._sequence_admitted(envelope)
+            if sequenced is not None:
+                await self._broadcast(sequenced)
+        elif self._upstream is not None and not self._upstream.is_closing():
+            self._upstream.write(dumps(envelope).encode() + b"\n")
+        else:
+            self.lost += 1
+            logger.warning("[Bus] No leader reachable, event dropped")
+
+    async def _send_request(self, envelope: Envelope) -> None:
+        if self._upstream is None or self._upstream.is_closing():
+            raise BusUnavailableError("No leader reachable")
+        self._upstream.write(dumps(envelope).encode() + b"\n")
+
+    async def _send_response(self, request: Envelope, envelope: Envelope, origin: asyncio.StreamWriter) -> None:
+        if not origin.is_closing():
+            origin.write(dumps(envelope).encode() + b"\n")
+
+    async def _run(self) -> None:
+        import fcntl
+
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                await self._follow()
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            try:
+                await self._lead()
+            except OSError as e:
+                logger.error("[Bus] Cannot serve %s: %s", self.path, e)
+            # Not serving after all: let another worker take the lock
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            await self._set_leader(False)
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def _lead(self) -> None:
+        # We hold the lock, so any existing socket file is stale
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        server = await asyncio.start_unix_server(self._serve_peer, self.path)
+        try:
+            if await self._take_leadership():
+                await server.serve_forever()
+        finally:
+            server.close()
+            # Followers that connected meanwhile reconnect to the next leader
+            for writer in list(self._peers):
+                writer.close()
+            self._peers.clear()
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                envelope = loads(line)
+                if "request" in envelope:
+                    self._serve_request(envelope, writer)
+                    continue
+                sequenced = self._sequence_admitted(envelope)
+                if sequenced is not None:
+                    await self._broadcast(sequenced)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("[Bus] Follower connection failed: %s", e)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _broadcast(self, envelope: Envelope) -> None:
+        line = dumps(envelope).encode() + b"\n"
+        for writer in list(self._peers):
+            if writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                logger.warning("[Bus] Dropping follower that stopped reading")
+                self._peers.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
+        await self._deliver(envelope)
+
+    async def _follow(self) -> None:
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            return
+        self._upstream = writer
+        logger.info("[Bus] Following leader at %s", self.path)
+        try:
+            while line := await reader.readline():
+                envelope = loads(line)
+                if "response" in envelope:
+                    self._resolve_call(envelope)
+                else:
+                    await self._deliver(envelope)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("[Bus] Leader connection failed: %s", e)
+        finally:
+            self._upstream = None
+            self._fail_calls("leader went away")
+            writer.close()
+
+
+class RedisBus(EventBus):
+    """Bus over the Redis protocol, for workers on one or several hosts.
+
+    Leadership is a lease: ``SET <prefix>:leader <node> NX PX <ttl>``, renewed
+    by the holder every third of the TTL. Followers ``PUBLISH`` ingested
+    events on ``<prefix>:ingest``; the leader sequences them and publishes on
+    ``<prefix>:events``, which every worker subscribes to. If a lease expires
+    while its holder is stalled, both may briefly sequence events; workers
+    ignore ids they have already seen. Calls go up ``<prefix>:ingest`` too
+    and are answered on the caller's own ``<prefix>:reply:<node>`` channel.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "dingtalk_gateway", ttl: float = 10.0) -> None:
+        super().__init__()
+        self.url = url
+        self._prefix = prefix
+        self._ttl_ms = int(ttl * 1000)
+        self._leader_key = f"{prefix}:leader"
+        self._events_channel = f"{prefix}:events"
+        self._ingest_channel = f"{prefix}:ingest"
+        self._reply_channel = self._reply_channel_of(self.node_id)
+        self._commands: _RespConnection | None = None
+
+    def _reply_channel_of(self, node_id: str) -> str:
+        return f"{self._prefix}:reply:{node_id}"
+
+    async def publish(self, envelope: Envelope) -> None:
+        self.published += 1
+        try:
+            if self.is_leader:
+                sequenced = self._sequence_admitted(envelope)
+                if sequenced is not None:
+                    await self._command("PUBLISH", self._events_channel, dumps(sequenced))
+            else:
+                await self._command("PUBLISH", self._ingest_channel, dumps(envelope))
+        except (OSError, RedisError) as e:
+            self.lost += 1
+            logger.warning("[Bus] Redis publish failed, event dropped: %s", e)
+
+    async def _send_request(self, envelope: Envelope) -> None:
+        try:
+            receivers = await self._command("PUBLISH", self._ingest_channel, dumps(envelope))
+        except (OSError, RedisError) as e:
+            raise BusUnavailableError(f"Redis publish failed: {e}") from e
+        if not receivers:
+            raise BusUnavailableError("No leader reachable")
+
+    async def _send_response(self, request: Envelope, envelope: Envelope, origin: Any) -> None:
+        await self._command("PUBLISH", self._reply_channel_of(request["node"]), dumps(envelope))
+
+    async def close(self) -> None:
+        if self.is_leader and self._commands is not None:
+            try:
+                await self._release_lease()
+            except (OSError, RedisError):
+                pass
+        await super().close()
+        if self._commands is not None:
+            await self._commands.close()
+            self._commands = None
+
+    async def _release_lease(self) -> None:
+        if await self._command("GET", self._leader_key) == self.node_id:
+            await self._command("DEL", self._leader_key)
+
+    async def _command(self, *args: Any) -> Any:
+        if self._commands is None:
+            raise RedisError("not connected")
+        return await self._commands.command(*args)
+
+    async def _run(self) -> None:
+        while True:
+            subscriber = None
+            try:
+                self._commands = await _RespConnection.open(self.url)
+                subscriber = await _RespConnection.open(self.url)
+                await subscriber.send("SUBSCRIBE", self._events_channel, self._ingest_channel, self._reply_channel)
+                listener = asyncio.create_task(self._listen(subscriber))
+                try:
+                    await self._elect(listener)
+                finally:
+                    listener.cancel()
+            except (OSError, RedisError) as e:
+                logger.warning("[Bus] Redis connection failed: %s", e)
+            finally:
+                # Without Redis we cannot renew the lease, so step down
+                await self._set_leader(False)
+                for connection in (self._commands, subscriber):
+                    if connection is not None:
+                        await connection.close()
+                self._commands = None
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def _elect(self, listener: asyncio.Task) -> None:
+        interval = self._ttl_ms / 3000
+        while not listener.done():
+            if self.is_leader:
+                if await self._command("GET", self._leader_key) == self.node_id:
+                    await self._command("PEXPIRE", self._leader_key, self._ttl_ms)
+                else:
+                    await self._set_leader(False)
+            elif await self._command("SET", self._leader_key, self.node_id, "NX", "PX", self._ttl_ms) == "OK":
+                if not await self._take_leadership():
+                    # Let another worker take over rather than hold a lease we cannot serve
+                    await self._release_lease()
+            await asyncio.wait({listener}, timeout=interval)
+        listener.result()
+
+    async def _listen(self, subscriber: "_RespConnection") -> None:
+        while True:
+            message = await subscriber.read()
+            if not isinstance(message, list) or len(message) != 3 or message[0] != "message":
+                continue
+            _, channel, data = message
+            if channel == self._events_channel:
+                await self._deliver(loads(data))
+            elif channel == self._reply_channel:
+                self._resolve_call(loads(data))
+            elif channel == self._ingest_channel and self.is_leader:
+                envelope = loads(data)
+                if "request" in envelope:
+                    self._serve_request(envelope)
+                    continue
+                sequenced = self._sequence_admitted(envelope)
+                if sequenced is not None:
+                    await self._command("PUBLISH", self._events_channel, dumps(sequenced))
+
+
+class RedisError(Exception):
+    """Error reply from the Redis server."""
+
+
+class _RespConnection:
+    """Minimal Redis protocol (RESP2) client, enough for leases and pub/sub."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, url: str) -> "_RespConnection":
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        connection = cls(reader, writer)
+        if parsed.password:
+            args = ("AUTH", parsed.username, parsed.password) if parsed.username else ("AUTH", parsed.password)
+            await connection.command(*args)
+        database = parsed.path.lstrip("/")
+        if database and database != "0":
+            await connection.command("SELECT", database)
+        return connection
+
+    async def command(self, *args: Any) -> Any:
+        async with self._lock:
+            await self.send(*args)
+            return await self.read()
+
+    async def send(self, *args: Any) -> None:
+        parts: List[bytes] = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+
+    async def read(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self.read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception:
+            pass
+
+
+def create_bus(backend: str, path: str, redis_url: str, leader_ttl: float) -> EventBus | None:
+    """Return the bus for ``backend``, or ``None`` for the in-process ``local`` backend.
+
+    Raises:
+        ValueError: If ``backend`` is unknown.
+    """
+    if backend == "local":
+        return None
+    if backend == "unix":
+        return UnixSocketBus(path)
+    if backend == "redis":
+        return RedisBus(redis_url, ttl=leader_ttl)
+    raise ValueError(f"Unknown broker backend: {backend}")
@@ -0,0 +1,148 @@
+"""Bounded TTL/LRU cache of DingTalk session webhooks."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+Key = Tuple[str, str]  # (user id, conversation id)
+
+
+class WebhookEntry:
+    __slots__ = ("url", "expires_at", "user_id", "conversation_id", "is_group")
+
+    def __init__(self, url: str, expires_at: float, user_id: str, conversation_id: str, is_group: bool) -> None:
+        self.url = url
+        self.expires_at = expires_at  # Epoch seconds
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.is_group = is_group
+
+
+class SessionWebhookCache:
+    """Session webhooks keyed by (user, conversation), bounded in size and expiring with the webhook.
+
+    A user id resolves to the webhook of that user's 1:1 chat with the bot; a
+    conversation id resolves to the newest webhook seen in that conversation,
+    so group replies also take the fast path.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Key, WebhookEntry]" = OrderedDict()
+        self._direct: Dict[str, Key] = {}  # user id -> key of the 1:1 chat
+        self._conversations: Dict[str, Key] = {}  # conversation id -> newest key
+        self._sweeper: asyncio.Task | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.fallbacks = 0  # Cache hits whose webhook send failed or was throttled
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(
+        self,
+        user_id: str,
+        conversation_id: str,
+        url: str,
+        expires_at_ms: int | None,
+        is_group: bool,
+    ) -> None:
+        """Store a session webhook; ``expires_at_ms`` is DingTalk's expiry timestamp in ms."""
+        expires_at = (expires_at_ms or 0) / 1000
+        if expires_at <= time.time():
+            return
+        key = (user_id, conversation_id or "")
+        self._entries[key] = WebhookEntry(url, expires_at, user_id, conversation_id, is_group)
+        self._entries.move_to_end(key)
+        if conversation_id:
+            self._conversations[conversation_id] = key
+        if not is_group:
+            self._direct[user_id] = key
+        while len(self._entries) > self._max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def lookup(self, target: str, conversation_id: str | None = None) -> str | None:
+        """Return a live webhook URL for a user or conversation id, or ``None``."""
+        if conversation_id:
+            key = (target, conversation_id)
+            if key not in self._entries:
+                key = self._conversations.get(conversation_id)
+        else:
+            key = self._conversations.get(target) or self._direct.get(target)
+
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.url
+
+    def entry(self, user_id: str, conversation_id: str | None) -> WebhookEntry | None:
+        """Return the cached entry for exactly (user, conversation), without touching stats."""
+        return self._entries.get((user_id, conversation_id or ""))
+
+    def record_fallback(self) -> None:
+        self.fallbacks += 1
+
+    def _remove(self, key: Key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if self._direct.get(entry.user_id) == key:
+            del self._direct[entry.user_id]
+        if entry.conversation_id and self._conversations.get(entry.conversation_id) == key:
+            del self._conversations[entry.conversation_id]
+
+    def sweep(self) -> int:
+        """Drop expired entries and return how many were removed."""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.expired += len(expired)
+        return len(expired)
+
+    def start_sweeper(self, interval: float = 60.0) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    async def close(self) -> None:
+        if self._sweeper and not self._sweeper.done():
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+        self._sweeper = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "fallbacks": self.fallbacks,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -27,6 +27,25 @@ class GatewayConfig:
     listen_host: str = "0.0.0.0"
     listen_port: int = 8099
     access_token: str | None = None
+    event_buffer_size: int = 1000  # Events kept for /ws replay after reconnects
+    dedup_window: float = 300.0  # Seconds a msg_id is remembered to drop redeliveries (0 disables)
+    dedup_max_entries: int = 100_000  # Bound on remembered msg_ids
+    trace_sample_rate: float = 0.0  # Fraction of messages traced for /debug/traces (0 disables)
+    trace_buffer_size: int = 256  # Recent traces kept
+    workers: int = 1  # uvicorn worker processes
+
+    # Event bus shared by workers (local = single process only)
+    broker_backend: str = "local"  # local, unix, redis
+    broker_path: str = "/tmp/dingtalk-gateway.sock"  # Unix socket of the unix backend
+    redis_url: str = "redis://127.0.0.1:6379/0"
+    leader_ttl: float = 10.0  # Seconds a leader lease lasts without renewal (redis)
+
+    # WebSocket backpressure defaults (overridable per connection)
+    ws_policy: str = "drop_oldest"  # drop_oldest, drop_newest, coalesce, disconnect
+    ws_max_lag: int = 100  # Events a subscriber may fall behind before the policy applies
+    ws_max_drops: int = 100  # Drops tolerated by the disconnect policy
+    ws_send_timeout: float = 10.0  # Seconds a single frame may take to send
+    slow_consumer_timeout: float = 60.0  # Evict subscribers not reading for this long
     
     # DingTalk settings (新版Stream模式使用ClientId和ClientSecret)
     dingtalk_client_id: str | None = None
@@ -36,6 +55,59 @@ class GatewayConfig:
     # DingTalk connection mode
     dingtalk_use_stream: bool = True  # True for Stream mode, False for Webhook
     dingtalk_webhook_secret: str | None = None  # Only for Webhook mode
+    stream_fast_ack: bool = False  # ACK Stream callbacks before processing them
+    stream_workers: int = 4  # Workers processing fast-ack callbacks
+    stream_queue_size: int = 1000  # Callbacks queued per worker
+
+    # Outbound HTTP connection pool (shared by all DingTalk API calls)
+    dingtalk_api_base: str = "https://oapi.dingtalk.com"
+    http_pool_size: int = 100  # Total connections across all hosts
+    http_pool_per_host: int = 20  # Connections kept per host
+    http_dns_ttl: int = 300  # DNS cache lifetime in seconds
+    http_keepalive: float = 60.0  # Idle keep-alive timeout in seconds
+    http_timeout: float = 10.0  # Total timeout per request in seconds
+
+    # Work notification batching
+    batch_window_ms: float = 5.0  # Window to merge identical notifications (0 disables)
+    batch_max_targets: int = 100  # asyncsend_v2 accepts up to 100 user ids
+
+    # Outbound rate limits
+    api_qps: float = 20.0  # Per API family
+    webhook_per_minute: float = 20.0  # Per session webhook
+    webhook_max_wait: float = 5.0  # Seconds to wait for a webhook slot before falling back
+    webhook_cache_size: int = 1024  # Session webhooks kept per (user, conversation)
+
+    # Durable outbox (disabled unless a path is set)
+    outbox_path: str | None = None
+    outbox_workers: int = 4
+    outbox_max_attempts: int = 8
+
+    # Bulk sends
+    send_batch_concurrency: int = 10  # Messages of one /send_batch dispatched at once
+    send_workers: int = 16  # Sends in flight at once across all targets
+
+    # Async sends and delivery receipts
+    receipt_poll_interval: float = 5.0  # Seconds between getsendresult rounds
+    receipt_buffer_size: int = 10000  # Async message statuses kept for /status
+
+    # Images and files
+    media_max_bytes: int = 20 * 1024 * 1024  # DingTalk's upload limit
+    media_cache_ttl: float = 86400.0  # Seconds an uploaded media_id is reused
+    media_cache_size: int = 1024
+    media_dirs: tuple[str, ...] = ()  # Directories /send_image may read files from by path
+
+    # mobile:/name:/dept: targets
+    directory_preload: bool = False  # Load the org directory for name:/dept: targets
+    directory_refresh: float = 3600.0  # Seconds to cycle through every department once
+    directory_lookup_ttl: float = 3600.0  # Seconds getbymobile fallback results are cached
+
+    # Logging
+    log_level: str = "INFO"
+    log_queue_size: int = 10000  # Records waiting for the writer thread before new ones are dropped
+    log_message_rate: float = 20.0  # Per-message INFO lines written per second (0 = unlimited)
+    log_sample_rate: float = 1.0  # Fraction of per-message INFO lines considered for writing
+    log_content: str = "truncate"  # Message text in logs: full, truncate or redact
+    access_log: bool = True  # uvicorn per-request access log
 
     @classmethod
     def load(cls) -> "GatewayConfig":
@@ -43,6 +115,23 @@ class GatewayConfig:
         host = os.getenv("GATEWAY_HOST", "0.0.0.0")
         port = int(os.getenv("GATEWAY_PORT", "8099"))
         token = os.getenv("GATEWAY_TOKEN")
+        event_buffer_size = int(os.getenv("GATEWAY_EVENT_BUFFER", "1000"))
+        dedup_window = float(os.getenv("GATEWAY_DEDUP_WINDOW", "300"))
+        dedup_max_entries = int(os.getenv("GATEWAY_DEDUP_MAX_ENTRIES", "100000"))
+        trace_sample_rate = float(os.getenv("GATEWAY_TRACE_SAMPLE_RATE", "0"))
+        trace_buffer_size = int(os.getenv("GATEWAY_TRACE_BUFFER", "256"))
+        workers = int(os.getenv("GATEWAY_WORKERS", "1"))
+        
+        # Several workers need a shared bus; default to the Unix socket one
+        broker_backend = os.getenv("GATEWAY_BROKER") or ("unix" if workers > 1 else "local")
+        broker_path = os.getenv("GATEWAY_BROKER_PATH", "/tmp/dingtalk-gateway.sock")
+        redis_url = os.getenv("GATEWAY_REDIS_URL", "redis://127.0.0.1:6379/0")
+        leader_ttl = float(os.getenv("GATEWAY_LEADER_TTL", "10"))
+        ws_policy = os.getenv("GATEWAY_WS_POLICY", "drop_oldest")
+        ws_max_lag = int(os.getenv("GATEWAY_WS_MAX_LAG", "100"))
+        ws_max_drops = int(os.getenv("GATEWAY_WS_MAX_DROPS", "100"))
+        ws_send_timeout = float(os.getenv("GATEWAY_WS_SEND_TIMEOUT", "10"))
+        slow_consumer_timeout = float(os.getenv("GATEWAY_SLOW_CONSUMER_TIMEOUT", "60"))
         
         # DingTalk configuration (新版Stream模式)
         dingtalk_client_id = os.getenv("DINGTALK_CLIENT_ID")
@@ -50,15 +139,120 @@ class GatewayConfig:
         dingtalk_agent_id = os.getenv("DINGTALK_AGENT_ID")  # 发送消息需要
         dingtalk_use_stream = os.getenv("DINGTALK_USE_STREAM", "true").lower() == "true"
         dingtalk_webhook_secret = os.getenv("DINGTALK_WEBHOOK_SECRET")
+        stream_fast_ack = os.getenv("DINGTALK_STREAM_FAST_ACK", "false").lower() == "true"
+        stream_workers = int(os.getenv("DINGTALK_STREAM_WORKERS", "4"))
+        stream_queue_size = int(os.getenv("DINGTALK_STREAM_QUEUE_SIZE", "1000"))
+
+        # Outbound HTTP connection pool
+        dingtalk_api_base = os.getenv("DINGTALK_API_BASE", "https://oapi.dingtalk.com").rstrip("/")
+        http_pool_size = int(os.getenv("DINGTALK_HTTP_POOL_SIZE", "100"))
+        http_pool_per_host = int(os.getenv("DINGTALK_HTTP_POOL_PER_HOST", "20"))
+        http_dns_ttl = int(os.getenv("DINGTALK_HTTP_DNS_TTL", "300"))
+        http_keepalive = float(os.getenv("DINGTALK_HTTP_KEEPALIVE", "60"))
+        http_timeout = float(os.getenv("DINGTALK_HTTP_TIMEOUT", "10"))
+
+        # Work notification batching
+        batch_window_ms = float(os.getenv("DINGTALK_BATCH_WINDOW_MS", "5"))
+        batch_max_targets = int(os.getenv("DINGTALK_BATCH_MAX_TARGETS", "100"))
+
+        # Outbound rate limits
+        api_qps = float(os.getenv("DINGTALK_API_QPS", "20"))
+        webhook_per_minute = float(os.getenv("DINGTALK_WEBHOOK_PER_MINUTE", "20"))
+        webhook_max_wait = float(os.getenv("DINGTALK_WEBHOOK_MAX_WAIT", "5"))
+        webhook_cache_size = int(os.getenv("DINGTALK_WEBHOOK_CACHE_SIZE", "1024"))
+
+        # Durable outbox
+        outbox_path = os.getenv("GATEWAY_OUTBOX_PATH") or None
+        outbox_workers = int(os.getenv("GATEWAY_OUTBOX_WORKERS", "4"))
+        outbox_max_attempts = int(os.getenv("GATEWAY_OUTBOX_MAX_ATTEMPTS", "8"))
+        
+        # Bulk sends
+        send_batch_concurrency = int(os.getenv("GATEWAY_SEND_BATCH_CONCURRENCY", "10"))
+        send_workers = int(os.getenv("GATEWAY_SEND_WORKERS", "16"))
+        
+        # Async sends and delivery receipts
+        receipt_poll_interval = float(os.getenv("GATEWAY_RECEIPT_POLL_INTERVAL", "5"))
+        receipt_buffer_size = int(os.getenv("GATEWAY_RECEIPT_BUFFER", "10000"))
+        
+        # Images and files
+        media_max_bytes = int(os.getenv("GATEWAY_MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+        media_cache_ttl = float(os.getenv("GATEWAY_MEDIA_CACHE_TTL", "86400"))
+        media_cache_size = int(os.getenv("GATEWAY_MEDIA_CACHE_SIZE", "1024"))
+        media_dirs = tuple(
+            os.path.realpath(d.strip()) for d in os.getenv("GATEWAY_MEDIA_DIRS", "").split(",") if d.strip()
+        )
+        
+        # mobile:/name:/dept: targets
+        directory_preload = os.getenv("GATEWAY_DIRECTORY", "false").lower() == "true"
+        directory_refresh = float(os.getenv("GATEWAY_DIRECTORY_REFRESH", "3600"))
+        directory_lookup_ttl = float(os.getenv("GATEWAY_DIRECTORY_LOOKUP_TTL", "3600"))
+        
+        # Logging
+        log_level = os.getenv("GATEWAY_LOG_LEVEL", "INFO")
+        log_queue_size = int(os.getenv("GATEWAY_LOG_QUEUE", "10000"))
+        log_message_rate = float(os.getenv("GATEWAY_LOG_MESSAGE_RATE", "20"))
+        log_sample_rate = float(os.getenv("GATEWAY_LOG_SAMPLE_RATE", "1"))
+        log_content = os.getenv("GATEWAY_LOG_CONTENT", "truncate").lower()
+        access_log = os.getenv("GATEWAY_ACCESS_LOG", "true").lower() == "true"
         
         return cls(
             channel_type=channel_type,
             listen_host=host,
             listen_port=port,
             access_token=token,
+            event_buffer_size=event_buffer_size,
+            dedup_window=dedup_window,
+            dedup_max_entries=dedup_max_entries,
+            trace_sample_rate=trace_sample_rate,
+            trace_buffer_size=trace_buffer_size,
+            workers=workers,
+            broker_backend=broker_backend,
+            broker_path=broker_path,
+            redis_url=redis_url,
+            leader_ttl=leader_ttl,
+            ws_policy=ws_policy,
+            ws_max_lag=ws_max_lag,
+            ws_max_drops=ws_max_drops,
+            ws_send_timeout=ws_send_timeout,
+            slow_consumer_timeout=slow_consumer_timeout,
             dingtalk_client_id=dingtalk_client_id,
             dingtalk_client_secret=dingtalk_client_secret,
             dingtalk_agent_id=dingtalk_agent_id,
             dingtalk_use_stream=dingtalk_use_stream,
             dingtalk_webhook_secret=dingtalk_webhook_secret,
+            stream_fast_ack=stream_fast_ack,
+            stream_workers=stream_workers,
+            stream_queue_size=stream_queue_size,
+            dingtalk_api_base=dingtalk_api_base,
+            http_pool_size=http_pool_size,
+            http_pool_per_host=http_pool_per_host,
+            http_dns_ttl=http_dns_ttl,
+            http_keepalive=http_keepalive,
+            http_timeout=http_timeout,
+            batch_window_ms=batch_window_ms,
+            batch_max_targets=batch_max_targets,
+            api_qps=api_qps,
+            webhook_per_minute=webhook_per_minute,
+            webhook_max_wait=webhook_max_wait,
+            webhook_cache_size=webhook_cache_size,
+            outbox_path=outbox_path,
+            outbox_workers=outbox_workers,
+            outbox_max_attempts=outbox_max_attempts,
+            send_batch_concurrency=send_batch_concurrency,
+            send_workers=send_workers,
+            receipt_poll_interval=receipt_poll_interval,
+            receipt_buffer_size=receipt_buffer_size,
+            media_max_bytes=media_max_bytes,
+            media_cache_ttl=media_cache_ttl,
+            media_cache_size=media_cache_size,
+            media_dirs=media_dirs,
+            directory_preload=directory_preload,
+            directory_refresh=directory_refresh,
+            directory_lookup_ttl=directory_lookup_ttl,
+            log_level=log_level,
+            log_queue_size=log_queue_size,
+            log_message_rate=log_message_rate,
+            log_sample_rate=log_sample_rate,
+            log_content=log_content,
+            access_log=access_log,
         )
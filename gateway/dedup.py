@@ -0,0 +1,83 @@
+"""Time-windowed, memory-bounded deduplication of incoming message ids."""
+
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Any, Dict, Set
+
+
+def _fingerprint(msg_id: str) -> int:
+    # 64-bit digest: stable across processes, unlike hash(), and compact
+    return int.from_bytes(hashlib.blake2b(msg_id.encode(), digest_size=8).digest(), "little")
+
+
+class MessageDeduplicator:
+    """Remember recently seen message ids in two rotating generations.
+
+    Ids go into the current generation; lookups check it and the previous
+    one. The generations rotate every ``window`` seconds, so an id is
+    remembered for between ``window`` and twice that. At most
+    ``max_entries`` fingerprints are held: a generation that fills up early
+    rotates early, shortening the window under extreme rates instead of
+    growing memory.
+    """
+
+    def __init__(self, window: float = 300.0, max_entries: int = 100_000) -> None:
+        self.window = window
+        self._generation_size = max(1, max_entries // 2)
+        self._current: Set[int] = set()
+        self._previous: Set[int] = set()
+        self._rotated_at = time.monotonic()
+
+        self.checked = 0
+        self.duplicates = 0
+        self.rotations = 0
+
+    def seen(self, msg_id: str | None) -> bool:
+        """Record ``msg_id`` and return whether it was seen within the window."""
+        if not msg_id:
+            return False
+        self._maybe_rotate()
+        self.checked += 1
+        fingerprint = _fingerprint(msg_id)
+        if fingerprint in self._current or fingerprint in self._previous:
+            self.duplicates += 1
+            return True
+        self._current.add(fingerprint)
+        return False
+
+    def remember(self, msg_id: str | None) -> None:
+        """Record ``msg_id`` as seen without checking it, e.g. when another process checked it."""
+        if not msg_id:
+            return
+        self._maybe_rotate()
+        fingerprint = _fingerprint(msg_id)
+        if fingerprint not in self._previous:
+            self._current.add(fingerprint)
+
+    def _maybe_rotate(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated_at >= self.window or len(self._current) >= self._generation_size:
+            self._rotate(now)
+
+    def _rotate(self, now: float) -> None:
+        if now - self._rotated_at >= 2 * self.window:
+            # Idle for a whole window: the previous generation has expired too
+            self._current.clear()
+        self._previous, self._current = self._current, set()
+        self._rotated_at = now
+        self.rotations += 1
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "size": len(self),
+            "max_entries": self._generation_size * 2,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "rotations": self.rotations,
+        }
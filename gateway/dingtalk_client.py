@@ -3,27 +3,122 @@
 from __future__ import annotations
 
 import asyncio
+import importlib
 import json
 import logging
 import time
 import hmac
 import hashlib
 import base64
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Optional, Tuple
 from dataclasses import asdict
 
 import aiohttp
-import requests
 
+from . import metrics, tracing
+from .batcher import NotificationBatcher, PartialSendError
+from .cache import SessionWebhookCache
+from .logs import content, message_logger
+from .media import MediaCache, MediaFile
+from .scheduler import OutboundScheduler
+from .serialization import loads
 from .events import IncomingMessageEvent, OutgoingMessageRequest
 
 logger = logging.getLogger(__name__)
 
+# Renew the access token this many seconds before it stops being handed out,
+# so the background renewal always wins the race against send paths.
+TOKEN_RENEW_MARGIN = 60
+TOKEN_RETRY_MAX_DELAY = 60
+
+# Seconds between attempts to open the Stream connection (the SDK's own delay)
+STREAM_RETRY_DELAY = 10
+
+# Webhook callbacks whose timestamp is further off than this are rejected
+WEBHOOK_MAX_AGE = 3600
+
+# errcodes that mean "try again later" (system busy, rate limited)
+TRANSIENT_ERRCODES = {-1, 90018}
+
+# errcodes of user lookups that found nobody
+USER_NOT_FOUND_ERRCODES = frozenset({60121})
+
 
 class DingTalkClientError(Exception):
     """Base exception for DingTalk client failures."""
 
 
+class DingTalkTransientError(DingTalkClientError):
+    """Failure that may succeed on retry (network error, 5xx, busy/rate limited)."""
+
+
+class DingTalkPartialSendError(DingTalkClientError):
+    """A work notification split across several calls reached only some users.
+
+    ``result`` describes the part that was sent (as :meth:`send_message`
+    returns it), ``failed_targets`` lists the users not reached and ``error``
+    is why; retrying is worthwhile if ``error`` is transient.
+    """
+
+    def __init__(self, message: str, result: Dict[str, Any], failed_targets: str, error: BaseException) -> None:
+        super().__init__(message)
+        self.result = result
+        self.failed_targets = failed_targets
+        self.error = error
+
+
+def _work_notification_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    # Sends split into several asyncsend_v2 calls have no single task id
+    if "task_ids" in result:
+        return {"path": "work_notification", "task_ids": result["task_ids"]}
+    return {"path": "work_notification", "task_id": result.get("task_id")}
+
+
+def _webhook_message(request: OutgoingMessageRequest) -> Dict[str, Any] | None:
+    """Session webhook (robot) message body for ``request``, or ``None`` if robots cannot send it."""
+    if request.msg_type == "file":
+        return None
+    if request.msg_type == "image":
+        # Robot messages have no image type; markdown can embed an uploaded media id
+        return {"msgtype": "markdown", "markdown": {"title": request.title or "图片", "text": f"![image]({request.media_id})"}}
+    if request.msg_type == "actionCard":
+        card: Dict[str, Any] = {"title": request.title or "通知", "text": request.content}
+        buttons = request.buttons or []
+        if len(buttons) == 1:
+            card["singleTitle"] = buttons[0]["title"]
+            card["singleURL"] = buttons[0]["url"]
+        else:
+            card["btnOrientation"] = "0"
+            card["btns"] = [{"title": b["title"], "actionURL": b["url"]} for b in buttons]
+        return {"msgtype": "actionCard", "actionCard": card}
+    if request.msg_type == "markdown":
+        data: Dict[str, Any] = {"msgtype": "markdown", "markdown": {"title": request.title or "通知", "text": request.content}}
+    else:
+        data = {"msgtype": "text", "text": {"content": request.content}}
+    if request.at_list:
+        data["at"] = {"atUserIds": request.at_list}
+    return data
+
+
+def _notification_message(request: OutgoingMessageRequest) -> Dict[str, Any]:
+    """Work notification (``asyncsend_v2``) ``msg`` for ``request``."""
+    if request.msg_type == "actionCard":
+        card: Dict[str, Any] = {"title": request.title or "通知", "markdown": request.content}
+        buttons = request.buttons or []
+        if len(buttons) == 1:
+            card["single_title"] = buttons[0]["title"]
+            card["single_url"] = buttons[0]["url"]
+        else:
+            card["btn_orientation"] = "0"
+            card["btn_json_list"] = [{"title": b["title"], "action_url": b["url"]} for b in buttons]
+        return {"msgtype": "action_card", "action_card": card}
+    if request.msg_type == "markdown":
+        return {"msgtype": "markdown", "markdown": {"title": request.title or "通知", "text": request.content}}
+    if request.msg_type in ("image", "file"):
+        return {"msgtype": request.msg_type, request.msg_type: {"media_id": request.media_id}}
+    return {"msgtype": "text", "text": {"content": request.content}}
+
+
 class DingTalkClient:
     """Encapsulates the DingTalk client lifecycle and API interactions."""
 
@@ -35,6 +130,23 @@ class DingTalkClient:
         on_message: Callable[[IncomingMessageEvent], None],
         use_stream: bool = True,
         webhook_secret: Optional[str] = None,
+        api_base: str = "https://oapi.dingtalk.com",
+        http_pool_size: int = 100,
+        http_pool_per_host: int = 20,
+        http_dns_ttl: int = 300,
+        http_keepalive: float = 60.0,
+        http_timeout: float = 10.0,
+        batch_window: float = 0.005,
+        batch_max_targets: int = 100,
+        api_qps: float = 20.0,
+        webhook_per_minute: float = 20.0,
+        webhook_max_wait: float = 5.0,
+        webhook_cache_size: int = 1024,
+        stream_fast_ack: bool = False,
+        stream_workers: int = 4,
+        stream_queue_size: int = 1000,
+        media_cache_ttl: float = 86400.0,
+        media_cache_size: int = 1024,
     ) -> None:
         """
         Initialize DingTalk client.
@@ -46,6 +158,26 @@ class DingTalkClient:
             on_message: Callback function for incoming messages
             use_stream: Use Stream mode (True) or Webhook mode (False)
             webhook_secret: Secret for webhook signature verification (Webhook mode only)
+            api_base: Base URL of the DingTalk open API
+            http_pool_size: Maximum number of pooled connections in total
+            http_pool_per_host: Maximum number of pooled connections per host
+            http_dns_ttl: Seconds to cache DNS lookups
+            http_keepalive: Seconds to keep idle connections open
+            http_timeout: Total timeout for each API request in seconds
+            batch_window: Seconds to collect identical work notifications (0 disables batching)
+            batch_max_targets: Maximum user ids merged into one work notification
+            api_qps: Requests per second allowed for each DingTalk API family
+            webhook_per_minute: Messages per minute allowed for each session webhook
+            webhook_max_wait: Longest wait for a session webhook slot before
+                falling back to work notification
+            webhook_cache_size: Maximum number of cached session webhooks
+            stream_fast_ack: ACK Stream callbacks as soon as they are queued and
+                process them on background workers
+            stream_workers: Workers processing queued Stream callbacks
+            stream_queue_size: Callbacks queued per worker before the Stream
+                handler processes inline again
+            media_cache_ttl: Seconds an uploaded media id is reused
+            media_cache_size: Maximum number of cached media ids
         """
         self.client_id = client_id
         self.client_secret = client_secret
@@ -53,13 +185,86 @@ class DingTalkClient:
         self._on_message = on_message
         self.use_stream = use_stream
         self.webhook_secret = webhook_secret
+        self.api_base = api_base.rstrip("/")
+        
+        self._http_pool_size = http_pool_size
+        self._http_pool_per_host = http_pool_per_host
+        self._http_dns_ttl = http_dns_ttl
+        self._http_keepalive = http_keepalive
+        self._http_timeout = http_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.scheduler = OutboundScheduler(api_qps=api_qps, webhook_per_minute=webhook_per_minute)
+        self._webhook_max_wait = webhook_max_wait
+        self._batcher = NotificationBatcher(
+            self._post_work_notification,
+            window=batch_window,
+            max_targets=batch_max_targets,
+        )
         
         self._access_token: Optional[str] = None
         self._token_expires_at: float = 0
-        self._contact_cache: Dict[str, str] = {}
+        self._token_refresh: Optional[asyncio.Task] = None
+        self._token_renewer: Optional[asyncio.Task] = None
+        # Where a worker that does not renew the token itself gets one, as
+        # (token, expiry in time.time() seconds); None fetches from /gettoken
+        self.token_source: Optional[Callable[[], Awaitable[Tuple[str, float]]]] = None
+        self.webhooks = SessionWebhookCache(max_entries=webhook_cache_size)
+        self.media = MediaCache(ttl=media_cache_ttl, max_entries=media_cache_size)
+        self._uploads: Dict[tuple, asyncio.Future] = {}  # In-flight uploads by (type, digest)
         self._stream_task: Optional[asyncio.Task] = None
+        # time.monotonic() when startup phases were reached, for readiness reporting
+        self.token_ready_at: Optional[float] = None
+        self.stream_opened_at: Optional[float] = None
         
-        logger.info(f"[DingTalk] Client initialized with client_id: {client_id[:10]}... (Stream mode: {use_stream})")
+        self.stream_fast_ack = stream_fast_ack
+        self._stream_queues = [asyncio.Queue(maxsize=stream_queue_size) for _ in range(max(1, stream_workers))]
+        self._stream_workers: list[asyncio.Task] = []
+        self.stream_processed = 0
+        self.stream_inline = 0  # Fast-ack callbacks processed inline because the queue was full
+        
+        logger.info("[DingTalk] Client initialized with client_id: %s... (Stream mode: %s)", client_id[:10], use_stream)
+
+    def _http(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use.
+
+        A single session keeps TCP/TLS connections and DNS results alive
+        between calls, so back-to-back sends skip the handshake.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._http_pool_size,
+                limit_per_host=self._http_pool_per_host,
+                ttl_dns_cache=self._http_dns_ttl,
+                keepalive_timeout=self._http_keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._http_timeout),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Stop background tasks and release pooled HTTP connections."""
+        await self._batcher.close()
+        await self.scheduler.close()
+        await self.webhooks.close()
+        for task in self._stream_workers:
+            task.cancel()
+        await asyncio.gather(*self._stream_workers, return_exceptions=True)
+        self._stream_workers.clear()
+        for task in (self._token_renewer, self._token_refresh):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._token_renewer = None
+        self._token_refresh = None
+        
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def start_stream(self) -> None:
         """Start Stream connection for receiving messages."""
@@ -68,9 +273,23 @@ class DingTalkClient:
             return
         
         try:
-            # Import dingtalk-stream SDK
+            # Importing the SDK takes seconds on small boards; do it in a thread
+            # so the token fetch and HTTP requests proceed meanwhile
+            await asyncio.to_thread(importlib.import_module, "dingtalk_stream")
             from dingtalk_stream import AckMessage, ChatbotHandler, ChatbotMessage, DingTalkStreamClient, Credential
             
+            class StreamClient(DingTalkStreamClient):
+                """Stream client that can be handed an already opened connection.
+
+                The SDK opens connections with a blocking HTTP call on the event
+                loop; the first one is opened in a thread instead.
+                """
+                opened = None
+                
+                def open_connection(self):
+                    connection, self.opened = self.opened, None
+                    return connection or super().open_connection()
+            
             class MessageHandler(ChatbotHandler):
                 def __init__(self, parent: DingTalkClient):
                     super().__init__()
@@ -78,137 +297,237 @@ class DingTalkClient:
                 
                 async def process(self, callback_message):
                     """Process incoming message from Stream."""
+                    received_at = time.perf_counter()
                     try:
+                        # Fast-ack: queue the raw payload, ACK right away
+                        if self.parent._queue_stream_payload(callback_message.data, received_at):
+                            return AckMessage.STATUS_OK, "OK"
                         # Parse message - ChatbotMessage 已经帮我们处理好了
                         incoming_message = ChatbotMessage.from_dict(callback_message.data)
-                        await self.parent._handle_stream_message(incoming_message)
+                        await self.parent._handle_stream_message(incoming_message, received_at)
                         return AckMessage.STATUS_OK, "OK"
                     except Exception as e:
-                        logger.error(f"[DingTalk] Error processing stream message: {e}", exc_info=True)
+                        logger.error("[DingTalk] Error processing stream message: %s", e, exc_info=True)
                         return AckMessage.STATUS_SYSTEM_EXCEPTION, str(e)
+                    finally:
+                        metrics.STREAM_ACK_LATENCY.observe(time.perf_counter() - received_at)
+            
+            if self.stream_fast_ack:
+                self._start_stream_workers(ChatbotMessage.from_dict)
             
             # Create credential
             credential = Credential(self.client_id, self.client_secret)
             
             # Create stream client
-            stream_client = DingTalkStreamClient(credential)
+            stream_client = StreamClient(credential)
             
             # Register chatbot handler with the correct topic
             stream_client.register_callback_handler(ChatbotMessage.TOPIC, MessageHandler(self))
             
-            # Start stream connection in background
+            # Open the connection off the loop, alongside the first token fetch
             logger.info("[DingTalk] Starting Stream connection...")
+            while True:
+                stream_client.opened = await asyncio.to_thread(DingTalkStreamClient.open_connection, stream_client)
+                if stream_client.opened:
+                    break
+                logger.warning("[DingTalk] Opening Stream connection failed, retrying in %ss", STREAM_RETRY_DELAY)
+                await asyncio.sleep(STREAM_RETRY_DELAY)
+            self.stream_opened_at = time.monotonic()
             await stream_client.start()
             
         except ImportError:
             logger.error("[DingTalk] dingtalk-stream package not installed. Please install: pip install dingtalk-stream")
             raise DingTalkClientError("dingtalk-stream package required for Stream mode")
         except Exception as e:
-            logger.error(f"[DingTalk] Failed to start Stream connection: {e}", exc_info=True)
+            logger.error("[DingTalk] Failed to start Stream connection: %s", e, exc_info=True)
             raise DingTalkClientError(f"Stream connection failed: {e}")
+        finally:
+            self.stream_opened_at = None
+
+    def _start_stream_workers(self, parse: Callable[[Dict[str, Any]], Any]) -> None:
+        if not self._stream_workers:
+            self._stream_workers = [
+                asyncio.create_task(self._process_stream_queue(queue, parse)) for queue in self._stream_queues
+            ]
+
+    def _queue_stream_payload(self, data: Dict[str, Any], received_at: float) -> bool:
+        """Queue a raw Stream callback payload for the workers.
+        
+        Payloads are sharded by conversation, so each conversation is still
+        processed in order. Returns ``False`` (process inline) when fast-ack
+        is off or the worker's queue is full.
+        """
+        if not self.stream_fast_ack or not self._stream_workers:
+            return False
+        conversation_id = data.get("conversationId") if isinstance(data, dict) else None
+        queue = self._stream_queues[hash(conversation_id) % len(self._stream_queues)]
+        try:
+            queue.put_nowait((data, received_at))
+        except asyncio.QueueFull:
+            self.stream_inline += 1
+            return False
+        return True
 
-    async def _handle_stream_message(self, incoming_message) -> None:
+    async def _process_stream_queue(self, queue: asyncio.Queue, parse: Callable[[Dict[str, Any]], Any]) -> None:
+        while True:
+            data, received_at = await queue.get()
+            try:
+                await self._handle_stream_message(parse(data), received_at)
+            except Exception as e:
+                logger.error("[DingTalk] Error processing queued stream message: %s", e, exc_info=True)
+            self.stream_processed += 1
+
+    def stream_stats(self) -> Dict[str, Any]:
+        return {
+            "fast_ack": self.stream_fast_ack,
+            "queued": sum(queue.qsize() for queue in self._stream_queues),
+            "processed": self.stream_processed,
+            "inline": self.stream_inline,
+        }
+
+    async def _handle_stream_message(self, incoming_message, received_at: float | None = None) -> None:
         """Handle incoming message from Stream connection.
         
         Args:
             incoming_message: ChatbotMessage object from dingtalk-stream SDK
+            received_at: ``time.perf_counter()`` when the callback arrived
         """
+        receive_started = received_at or time.perf_counter()
         try:
-            # Extract message fields from ChatbotMessage object
-            conversation_type = incoming_message.conversation_type
-            sender_id = incoming_message.sender_staff_id or incoming_message.sender_id
-            sender_nick = incoming_message.sender_nick or sender_id
-            msg_id = incoming_message.message_id
-            conversation_id = incoming_message.conversation_id
-            
-            # 保存 session_webhook 用于回复到聊天框
-            session_webhook = incoming_message.session_webhook
-            webhook_expired_time = incoming_message.session_webhook_expired_time
-            
             # Get text content
             if incoming_message.text and hasattr(incoming_message.text, 'content'):
                 content_text = incoming_message.text.content or ""
             else:
                 content_text = ""
             
-            is_group = conversation_type == "2"
-            
-            # Check if bot is mentioned
-            at_me = incoming_message.is_in_at_list or False
-            
-            # Skip group messages without mention
-            if is_group and not at_me:
-                logger.debug("[DingTalk] Group message without mention, skipping")
-                return
-            
-            # 缓存 session_webhook 供后续使用
-            if session_webhook:
-                self._contact_cache[sender_id] = {
-                    'webhook': session_webhook,
-                    'expired_at': webhook_expired_time,
-                    'conversation_id': conversation_id
-                }
-                logger.debug(f"[DingTalk] Cached session_webhook for {sender_id}")
-            
-            # Build incoming message event
-            incoming_event = IncomingMessageEvent(
-                msg_id=msg_id,
-                sender=sender_id,
-                sender_name=sender_nick,
-                receiver=self.client_id,
-                content=content_text,
-                is_group=is_group,
-                timestamp=int(time.time() * 1000),
-                room_id=conversation_id if is_group else None,
-                room_name=incoming_message.conversation_title,
-                at_me=at_me if is_group else None,
+            # Extract message fields from ChatbotMessage object
+            self._ingest_message(
+                conversation_type=incoming_message.conversation_type,
+                sender_id=incoming_message.sender_staff_id or incoming_message.sender_id,
+                sender_nick=incoming_message.sender_nick,
+                msg_id=incoming_message.message_id,
+                conversation_id=incoming_message.conversation_id,
+                conversation_title=incoming_message.conversation_title,
+                content_text=content_text,
+                at_me=incoming_message.is_in_at_list or False,
+                session_webhook=incoming_message.session_webhook,
+                webhook_expired_time=incoming_message.session_webhook_expired_time,
+                received_at=receive_started,
             )
-            
-            # 记录接收时间用于性能分析
-            receive_time = time.time()
-            logger.info(f"[DingTalk] Received message from {sender_nick}: {content_text[:50]}")
-            
-            # Trigger callback (同步调用，避免额外延迟)
-            self._on_message(incoming_event)
-            
-            # 记录处理耗时
-            process_time = (time.time() - receive_time) * 1000
-            logger.debug(f"[DingTalk] Message processing time: {process_time:.2f}ms")
-            
         except Exception as e:
-            logger.error(f"[DingTalk] Error handling stream message: {e}", exc_info=True)
+            logger.error("[DingTalk] Error handling stream message: %s", e, exc_info=True)
+
+    def _ingest_message(
+        self,
+        conversation_type: str | None,
+        sender_id: str,
+        sender_nick: str | None,
+        msg_id: str,
+        conversation_id: str,
+        conversation_title: str | None,
+        content_text: str,
+        at_me: bool,
+        session_webhook: str | None,
+        webhook_expired_time: int | None,
+        received_at: float,
+    ) -> None:
+        """Cache the reply webhook and emit an event for a chatbot message.
+        
+        Shared by Stream and webhook mode, so both produce identical events.
+        """
+        sender_nick = sender_nick or sender_id
+        is_group = conversation_type == "2"
+        
+        # Skip group messages without mention
+        if is_group and not at_me:
+            logger.debug("[DingTalk] Group message without mention, skipping")
+            return
+        
+        trace_id, trace = tracing.TRACER.start("incoming", origin=received_at, msg_id=msg_id, sender=sender_id)
+        
+        # 缓存 session_webhook 供后续使用
+        if session_webhook:
+            self.webhooks.put(sender_id, conversation_id, session_webhook, webhook_expired_time, is_group)
+            logger.debug("[DingTalk] Cached session_webhook for %s in %s", sender_id, conversation_id)
+        
+        # Build incoming message event
+        incoming_event = IncomingMessageEvent(
+            msg_id=msg_id,
+            sender=sender_id,
+            sender_name=sender_nick,
+            receiver=self.client_id,
+            content=content_text,
+            is_group=is_group,
+            timestamp=int(time.time() * 1000),
+            room_id=conversation_id if is_group else None,
+            room_name=conversation_title,
+            at_me=at_me if is_group else None,
+            trace_id=trace_id,
+            received_at=received_at,
+            conversation_id=conversation_id,
+        )
+        if trace is not None:
+            trace.add_span("receive", received_at, time.perf_counter())
+        
+        # 记录接收时间用于性能分析
+        receive_time = time.perf_counter()
+        message_logger.info("[DingTalk] Received message from %s: %s", sender_nick, content(content_text))
+        
+        # Trigger callback (同步调用，避免额外延迟); tasks it starts join the trace
+        with tracing.use(trace):
+            self._on_message(incoming_event)
+        
+        # 记录处理耗时
+        logger.debug("[DingTalk] Message processing time: %.2fms", (time.perf_counter() - receive_time) * 1000)
 
-    async def handle_webhook(self, event_data: Dict[str, Any], signature: str = "", timestamp: str = "") -> Dict[str, Any]:
+    async def handle_webhook(self, body: bytes, signature: str = "", timestamp: str = "") -> Dict[str, Any]:
         """
-        Handle incoming webhook event from DingTalk.
+        Handle incoming webhook (HTTP callback) event from DingTalk.
+        
+        The signature and timestamp are checked before the body is parsed,
+        so forged or replayed requests cost no decoding.
         
         Args:
-            event_data: Raw event data from DingTalk
-            signature: Request signature for verification
-            timestamp: Request timestamp
+            body: Raw request body
+            signature: ``sign`` header
+            timestamp: ``timestamp`` header (ms since epoch)
             
         Returns:
             Response dict for DingTalk server
         """
+        received_at = time.perf_counter()
         if self.use_stream:
             logger.warning("[DingTalk] Received webhook request but Stream mode is enabled")
             return {"success": False, "error": "webhook_disabled"}
         
-        # Verify signature
+        # Verify timestamp and signature
         if self.webhook_secret:
+            if not self._webhook_timestamp_fresh(timestamp):
+                logger.warning("[DingTalk] Stale webhook timestamp: %s", timestamp)
+                return {"success": False, "error": "stale_timestamp"}
             if not self._verify_webhook_signature(timestamp, signature):
                 logger.warning("[DingTalk] Invalid webhook signature")
                 return {"success": False, "error": "invalid_signature"}
         
         try:
-            await self._handle_webhook_message(event_data)
+            event_data = loads(body)
+            self._handle_webhook_message(event_data, received_at)
             return {"success": True}
         except Exception as e:
-            logger.error(f"[DingTalk] Error handling webhook: {e}", exc_info=True)
+            logger.error("[DingTalk] Error handling webhook: %s", e, exc_info=True)
             return {"success": False, "error": str(e)}
 
+    @staticmethod
+    def _webhook_timestamp_fresh(timestamp: str) -> bool:
+        """DingTalk rejects callbacks whose timestamp is more than an hour off; so do we."""
+        try:
+            sent_at = int(timestamp) / 1000
+        except (TypeError, ValueError):
+            return False
+        return abs(time.time() - sent_at) <= WEBHOOK_MAX_AGE
+
     def _verify_webhook_signature(self, timestamp: str, signature: str) -> bool:
-        """Verify webhook request signature."""
+        """Verify webhook request signature in constant time."""
         if not self.webhook_secret:
             return True
         
@@ -218,160 +537,414 @@ class DingTalkClient:
             string_to_sign.encode('utf-8'),
             digestmod=hashlib.sha256
         ).digest()
-        expected_signature = base64.b64encode(hmac_code).decode('utf-8')
+        expected_signature = base64.b64encode(hmac_code)
         
-        return signature == expected_signature
+        return hmac.compare_digest(signature.encode('utf-8'), expected_signature)
 
-    async def _handle_webhook_message(self, event_data: Dict[str, Any]) -> None:
-        """Process incoming message from webhook."""
-        # Similar to stream message handling
-        # Implementation depends on DingTalk webhook payload structure
-        logger.info("[DingTalk] Processing webhook message")
-        # TODO: Implement based on actual webhook payload format
+    def _handle_webhook_message(self, event_data: Dict[str, Any], received_at: float) -> None:
+        """Process incoming chatbot message from a webhook callback."""
+        text = event_data.get("text")
+        content_text = (text.get("content") or "") if isinstance(text, dict) else ""
+        
+        self._ingest_message(
+            conversation_type=event_data.get("conversationType"),
+            sender_id=event_data.get("senderStaffId") or event_data.get("senderId"),
+            sender_nick=event_data.get("senderNick"),
+            msg_id=event_data.get("msgId"),
+            conversation_id=event_data.get("conversationId"),
+            conversation_title=event_data.get("conversationTitle"),
+            content_text=content_text,
+            at_me=bool(event_data.get("isInAtList")),
+            session_webhook=event_data.get("sessionWebhook"),
+            webhook_expired_time=event_data.get("sessionWebhookExpiredTime"),
+            received_at=received_at,
+        )
 
-    async def send_text(self, request: OutgoingMessageRequest) -> None:
+    async def send_message(self, request: OutgoingMessageRequest) -> Dict[str, Any]:
         """
-        Send text message to DingTalk.
+        Send a text, markdown or actionCard message to DingTalk.
         优先使用 session_webhook（显示在聊天框），否则使用工作通知API
         
         Args:
-            request: Outgoing message request
+            request: Outgoing message request; ``msg_type`` selects the message type
+        
+        Returns:
+            The path used, and the ``task_id`` of a work notification
+        
+        Raises:
+            DingTalkPartialSendError: If a notification split across several
+                calls reached only some of its users
         """
-        # 先尝试使用 session_webhook（聊天框回复）
-        if request.target in self._contact_cache:
-            webhook_info = self._contact_cache.get(request.target)
-            if isinstance(webhook_info, dict):
-                webhook_url = webhook_info.get('webhook')
-                expired_at = webhook_info.get('expired_at', 0)
-                
-                # 检查是否过期（webhook有效期通常2小时）
-                if webhook_url and time.time() * 1000 < expired_at:
-                    try:
-                        await self._send_via_webhook(webhook_url, request.content)
-                        logger.info(f"[DingTalk] ✅ Message sent to chat via webhook: {request.target}")
-                        return
-                    except Exception as e:
-                        logger.warning(f"[DingTalk] Webhook send failed, fallback to work notification: {e}")
-                        # 如果webhook失败，继续使用工作通知方式
+        # 先尝试使用 session_webhook（聊天框回复，缓存会跳过已过期的webhook）
+        webhook_msg = _webhook_message(request)
+        webhook_url = self.webhooks.lookup(request.target, request.conversation_id) if webhook_msg else None
+        if webhook_url:
+            try:
+                with tracing.span("webhook_rate_limit"):
+                    await self.scheduler.acquire(
+                        "session_webhook",
+                        key=webhook_url,
+                        priority=request.priority,
+                        timeout=self._webhook_max_wait,
+                    )
+                with tracing.span("session_webhook", msgtype=request.msg_type):
+                    await self._send_via_webhook(webhook_url, webhook_msg)
+                message_logger.info("[DingTalk] ✅ Message (%s) sent to chat via webhook: %s", request.msg_type, request.target)
+                return {"path": "session_webhook"}
+            except asyncio.TimeoutError:
+                self.webhooks.record_fallback()
+                logger.warning("[DingTalk] Session webhook rate limited, fallback to work notification: %s", request.target)
+            except Exception as e:
+                self.webhooks.record_fallback()
+                logger.warning("[DingTalk] Webhook send failed, fallback to work notification: %s", e)
+                # 如果webhook失败，继续使用工作通知方式
         
         # 如果没有webhook或已过期，使用工作通知API
-        logger.info(f"[DingTalk] 📢 Sending via work notification (no active webhook for {request.target})")
-        await self._send_via_work_notification(request)
+        message_logger.info("[DingTalk] 📢 Sending via work notification (no active webhook for %s)", request.target)
+        result = await self._send_via_work_notification(request)
+        return _work_notification_result(result)
+    
+    async def send_text(self, request: OutgoingMessageRequest) -> Dict[str, Any]:
+        """Send a text message; see :meth:`send_message`."""
+        return await self.send_message(request)
     
-    async def _send_via_webhook(self, webhook_url: str, content: str) -> None:
+    async def _send_via_webhook(self, webhook_url: str, data: Dict[str, Any]) -> None:
         """通过 session_webhook 发送消息（显示在聊天框）"""
-        data = {
-            "msgtype": "text",
-            "text": {
-                "content": content
-            }
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(webhook_url, json=data, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                result = await response.json()
-                if result.get("errcode") != 0:
-                    raise DingTalkClientError(f"Webhook send failed: {result.get('errmsg')}")
+        started = time.perf_counter()
+        async with self._http().post(webhook_url, json=data) as response:
+            result = await response.json()
+        metrics.SEND_LATENCY.observe(time.perf_counter() - started, "session_webhook")
+        if result.get("errcode") != 0:
+            metrics.API_ERRORS.inc("session_webhook", str(result.get("errcode")))
+            raise DingTalkClientError(f"Webhook send failed: {result.get('errmsg')}")
     
-    async def _send_via_work_notification(self, request: OutgoingMessageRequest) -> None:
+    async def _send_via_work_notification(self, request: OutgoingMessageRequest) -> Dict[str, Any]:
         """通过工作通知API发送消息（显示在工作通知中）"""
+        msg = _notification_message(request)
+        # Covers batching window, token, rate limit and the API call
+        with tracing.span("work_notification", msgtype=request.msg_type):
+            try:
+                return await self._batcher.submit(request.target, msg, request.priority, wait=request.coalesce)
+            except PartialSendError as e:
+                raise DingTalkPartialSendError(
+                    f"Work notification not sent to {len(e.failed_targets)} users: {e.error}",
+                    _work_notification_result({"task_ids": [r.get("task_id") for r in e.results]}),
+                    ",".join(e.failed_targets),
+                    e.error,
+                ) from e
+
+    async def _post_work_notification(self, userid_list: str, msg: Dict[str, Any], priority: str = "normal") -> Dict[str, Any]:
+        """Call asyncsend_v2 once for a comma-separated list of users."""
         access_token = await self._get_access_token()
+        await self.scheduler.acquire("work_notification", priority=priority)
         
-        url = "https://oapi.dingtalk.com/topapi/message/corpconversation/asyncsend_v2"
+        url = f"{self.api_base}/topapi/message/corpconversation/asyncsend_v2"
         params = {"access_token": access_token}
         
-        msg_content = {"content": request.content}
-        
         data = {
             "agent_id": self.agent_id,
-            "userid_list": request.target,
-            "msg": {
-                "msgtype": "text",
-                "text": msg_content
-            }
+            "userid_list": userid_list,
+            "msg": msg,
         }
         
+        path = "markdown" if msg.get("msgtype") == "markdown" else "work_notification"
+        started = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, params=params, json=data, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    result = await response.json()
-                    
-                    if result.get("errcode") == 0:
-                        logger.info(f"[DingTalk] Work notification sent to {request.target}")
-                    else:
-                        logger.error(f"[DingTalk] Failed to send message: {result.get('errmsg')}")
-                        raise DingTalkClientError(f"Send message failed: {result.get('errmsg')}")
+            async with self._http().post(url, params=params, json=data) as response:
+                if response.status >= 500:
+                    raise DingTalkTransientError(f"HTTP {response.status}")
+                result = await response.json()
+        except DingTalkClientError as e:
+            metrics.API_ERRORS.inc("asyncsend_v2", "http")
+            logger.error("[DingTalk] Error sending message: %s", e)
+            raise
         except Exception as e:
-            logger.error(f"[DingTalk] Error sending message: {e}")
-            raise DingTalkClientError(f"Failed to send message: {e}")
+            metrics.API_ERRORS.inc("asyncsend_v2", "network")
+            logger.error("[DingTalk] Error sending message: %s", e)
+            raise DingTalkTransientError(f"Failed to send message: {e}")
+        metrics.SEND_LATENCY.observe(time.perf_counter() - started, path)
+        
+        errcode = result.get("errcode")
+        if errcode == 0:
+            message_logger.info("[DingTalk] Work notification (%s) sent to %s", msg.get("msgtype"), userid_list)
+            return result
+        
+        metrics.API_ERRORS.inc("asyncsend_v2", str(errcode))
+        logger.error("[DingTalk] Failed to send message: %s", result.get("errmsg"))
+        error_cls = DingTalkTransientError if errcode in TRANSIENT_ERRCODES else DingTalkClientError
+        raise error_cls(f"Send message failed: {result.get('errmsg')}")
 
-    async def send_markdown(self, target: str, title: str, content: str) -> None:
+    async def send_markdown(
+        self,
+        target: str,
+        title: str,
+        content: str,
+        priority: str = "normal",
+        conversation_id: str | None = None,
+    ) -> Dict[str, Any]:
         """
-        Send markdown message to DingTalk.
+        Send markdown message to DingTalk; see :meth:`send_message`.
         
         Args:
             target: Target user or chat ID
             title: Message title
             content: Markdown content
+            priority: Scheduling priority (high, normal, low)
+            conversation_id: Reply into this conversation when known
         """
+        return await self.send_message(OutgoingMessageRequest(
+            target=target,
+            content=content,
+            msg_type="markdown",
+            title=title,
+            priority=priority,
+            conversation_id=conversation_id,
+        ))
+
+    async def upload_media(self, media: MediaFile, media_type: str = "image", filename: str = "media") -> str:
+        """Upload media for sending and return its ``media_id``.
+        
+        Content already uploaded (by hash) reuses the cached id, and
+        concurrent uploads of the same content share one request. The file is
+        streamed from disk.
+        
+        Args:
+            media: Spooled or on-disk media with its content hash
+            media_type: ``image`` or ``file``
+            filename: Name shown to the recipient of a file
+        """
+        media_id = self.media.get(media_type, media.digest)
+        if media_id:
+            return media_id
+        key = (media_type, media.digest)
+        upload = self._uploads.get(key)
+        if upload is None:
+            # Opened before anything awaits: the sender that started the upload
+            # may discard its file while others still wait on the shared request
+            try:
+                f = open(media.path, "rb")
+            except OSError as e:
+                raise DingTalkClientError(f"Failed to read media: {e}")
+            upload = self._uploads[key] = asyncio.ensure_future(self._upload(f, media, media_type, filename))
+
+            def done(_: asyncio.Future) -> None:
+                self._uploads.pop(key, None)
+                f.close()
+
+            upload.add_done_callback(done)
+        # Shielded so one cancelled sender does not abort the shared upload
+        return await asyncio.shield(upload)
+
+    async def _upload(self, f: BinaryIO, media: MediaFile, media_type: str, filename: str) -> str:
         access_token = await self._get_access_token()
+        await self.scheduler.acquire("media_upload")
         
-        url = "https://oapi.dingtalk.com/topapi/message/corpconversation/asyncsend_v2"
-        params = {"access_token": access_token}
+        url = f"{self.api_base}/media/upload"
+        params = {"access_token": access_token, "type": media_type}
+        started = time.perf_counter()
+        with tracing.span("media_upload", size=media.size):
+            form = aiohttp.FormData()
+            form.add_field("media", f, filename=filename)
+            try:
+                async with self._http().post(url, params=params, data=form) as response:
+                    if response.status >= 500:
+                        raise DingTalkTransientError(f"HTTP {response.status}")
+                    result = await response.json()
+            except DingTalkClientError:
+                metrics.API_ERRORS.inc("media_upload", "http")
+                raise
+            except Exception as e:
+                metrics.API_ERRORS.inc("media_upload", "network")
+                raise DingTalkTransientError(f"Failed to upload media: {e}")
+        metrics.SEND_LATENCY.observe(time.perf_counter() - started, "media_upload")
         
-        data = {
-            "agent_id": self.agent_id,
-            "userid_list": target,
-            "msg": {
-                "msgtype": "markdown",
-                "markdown": {
-                    "title": title,
-                    "text": content
-                }
-            }
-        }
+        errcode = result.get("errcode")
+        if errcode != 0:
+            metrics.API_ERRORS.inc("media_upload", str(errcode))
+            error_cls = DingTalkTransientError if errcode in TRANSIENT_ERRCODES else DingTalkClientError
+            raise error_cls(f"Media upload failed: {result.get('errmsg')}")
+        media_id = result["media_id"]
+        self.media.put(media_type, media.digest, media_id)
+        logger.info("[DingTalk] Uploaded %s (%d bytes): %s", media_type, media.size, media_id)
+        return media_id
+
+    async def get_send_result(self, task_id: int) -> Dict[str, Any]:
+        """Fetch the per-user outcome of an ``asyncsend_v2`` task.
         
+        Returns:
+            DingTalk's ``send_result``: ``read_user_id_list``,
+            ``unread_user_id_list``, ``failed_user_id_list`` and so on
+        """
+        result = await self._call_topapi(
+            "message/corpconversation/getsendresult",
+            {"agent_id": self.agent_id, "task_id": task_id},
+            family="send_result",
+        )
+        return result.get("send_result") or {}
+
+    async def list_departments(self, dept_id: int) -> list[Dict[str, Any]]:
+        """Direct sub-departments of ``dept_id`` (``dept_id``, ``name``, ``parent_id``)."""
+        result = await self._call_topapi("v2/department/listsub", {"dept_id": dept_id}, family="directory")
+        return result.get("result") or []
+
+    async def list_department_users(self, dept_id: int) -> list[Dict[str, Any]]:
+        """Direct members of ``dept_id`` (``userid``, ``name``, ``mobile`` when permitted)."""
+        users: list[Dict[str, Any]] = []
+        cursor = 0
+        while True:
+            result = await self._call_topapi(
+                "v2/user/list",
+                {"dept_id": dept_id, "cursor": cursor, "size": 100},
+                family="directory",
+            )
+            page = result.get("result") or {}
+            users.extend(page.get("list") or [])
+            if not page.get("has_more"):
+                return users
+            cursor = page.get("next_cursor")
+
+    async def get_user_by_mobile(self, mobile: str) -> str | None:
+        """User id registered with ``mobile``, or ``None`` if there is none."""
+        result = await self._call_topapi(
+            "v2/user/getbymobile",
+            {"mobile": mobile},
+            family="directory",
+            not_found=USER_NOT_FOUND_ERRCODES,
+        )
+        return (result.get("result") or {}).get("userid")
+
+    async def _call_topapi(
+        self,
+        path: str,
+        data: Dict[str, Any],
+        family: str,
+        priority: str = "low",
+        not_found: frozenset = frozenset(),
+    ) -> Dict[str, Any]:
+        """POST to ``/topapi/<path>`` and return the response.
+        
+        Responses with an errcode in ``not_found`` are returned as an empty
+        result instead of raising. Network errors, timeouts and 5xx answers
+        raise :class:`DingTalkTransientError`.
+        """
+        access_token = await self._get_access_token()
+        await self.scheduler.acquire(family, priority=priority)
+        
+        url = f"{self.api_base}/topapi/{path}"
+        name = path.rsplit("/", 1)[-1]
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, params=params, json=data, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    result = await response.json()
-                    
-                    if result.get("errcode") == 0:
-                        logger.info(f"[DingTalk] Markdown message sent to {target}")
-                    else:
-                        logger.error(f"[DingTalk] Failed to send markdown: {result.get('errmsg')}")
-                        raise DingTalkClientError(f"Send markdown failed: {result.get('errmsg')}")
-        except Exception as e:
-            logger.error(f"[DingTalk] Error sending markdown: {e}")
+            async with self._http().post(url, params={"access_token": access_token}, json=data) as response:
+                if response.status >= 500:
+                    raise DingTalkTransientError(f"HTTP {response.status}")
+                result = await response.json()
+        except DingTalkClientError:
+            metrics.API_ERRORS.inc(name, "http")
             raise
+        except Exception as e:
+            # Network errors and timeouts, retried like those of sends and uploads
+            metrics.API_ERRORS.inc(name, "network")
+            raise DingTalkTransientError(f"{name} failed: {e}")
+        errcode = result.get("errcode")
+        if errcode == 0:
+            return result
+        if errcode in not_found:
+            return {}
+        metrics.API_ERRORS.inc(name, str(errcode))
+        error_cls = DingTalkTransientError if errcode in TRANSIENT_ERRCODES else DingTalkClientError
+        raise error_cls(f"{name} failed: {result.get('errmsg')}")
+
+    def start(self) -> None:
+        """Start background maintenance: webhook cache sweeping.
+
+        Token renewal is started separately, by the one process that owns the
+        token (see :meth:`start_token_renewal`).
+        """
+        self.webhooks.start_sweeper()
+
+    def start_token_renewal(self) -> None:
+        """Start the background task that keeps the access token fresh."""
+        if self._token_renewer is None or self._token_renewer.done():
+            self._token_renewer = asyncio.create_task(self._renew_token_loop())
+
+    async def stop_token_renewal(self) -> None:
+        if self._token_renewer and not self._token_renewer.done():
+            self._token_renewer.cancel()
+            try:
+                await self._token_renewer
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._token_renewer = None
+
+    async def access_token(self) -> Tuple[str, float]:
+        """Return the access token and when it expires (``time.time()`` seconds), refreshing it if needed."""
+        token = await self._get_access_token()
+        return token, self._token_expires_at
+
+    async def _renew_token_loop(self) -> None:
+        """Fetch the token up front, then renew it ahead of expiry."""
+        failures = 0
+        while True:
+            try:
+                await self._refresh_access_token()
+                failures = 0
+                delay = self._token_expires_at - time.time() - TOKEN_RENEW_MARGIN
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failures += 1
+                delay = min(TOKEN_RETRY_MAX_DELAY, 2 ** failures)
+                logger.warning("[DingTalk] Token renewal failed, retrying in %.0fs", delay)
+            await asyncio.sleep(max(delay, 1))
 
     async def _get_access_token(self) -> str:
-        """Get or refresh access token."""
-        # Check if token is still valid
+        """Get the cached access token, refreshing it if needed."""
         if self._access_token and time.time() < self._token_expires_at:
             return self._access_token
-        
+        with tracing.span("token_refresh"):
+            return await self._refresh_access_token()
+
+    async def _refresh_access_token(self) -> str:
+        """Refresh the access token, sharing one in-flight request among callers."""
+        if self._token_refresh is None or self._token_refresh.done():
+            self._token_refresh = asyncio.create_task(self._fetch_access_token())
+        # Shield so a cancelled caller does not abort the refresh for everyone else
+        return await asyncio.shield(self._token_refresh)
+
+    async def _fetch_access_token(self) -> str:
+        """Fetch a new access token from DingTalk, or from ``token_source`` if set."""
+        if self.token_source is not None:
+            self._access_token, self._token_expires_at = await self.token_source()
+            return self._access_token
         # Fetch new token (新版API)
-        url = "https://oapi.dingtalk.com/gettoken"
+        url = f"{self.api_base}/gettoken"
         params = {
             "appkey": self.client_id,
             "appsecret": self.client_secret,
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    result = await response.json()
-                    
-                    if result.get("errcode") != 0:
-                        raise DingTalkClientError(f"Get access token failed: {result.get('errmsg')}")
-                    
-                    self._access_token = result.get("access_token")
-                    expires_in = result.get("expires_in", 7200)
-                    self._token_expires_at = time.time() + expires_in - 300  # Refresh 5 minutes early
-                    
-                    logger.info("[DingTalk] Access token refreshed successfully")
-                    return self._access_token
+            async with self._http().get(url, params=params) as response:
+                result = await response.json()
+                
+                if result.get("errcode") != 0:
+                    metrics.API_ERRORS.inc("gettoken", str(result.get("errcode")))
+                    error_cls = DingTalkTransientError if result.get("errcode") in TRANSIENT_ERRCODES else DingTalkClientError
+                    raise error_cls(f"Get access token failed: {result.get('errmsg')}")
+                
+                self._access_token = result.get("access_token")
+                expires_in = result.get("expires_in", 7200)
+                self._token_expires_at = time.time() + expires_in - 300  # Refresh 5 minutes early
+                
+                metrics.TOKEN_REFRESHES.inc("success")
+                if self.token_ready_at is None:
+                    self.token_ready_at = time.monotonic()
+                logger.info("[DingTalk] Access token refreshed successfully")
+                return self._access_token
+        except DingTalkClientError as e:
+            metrics.TOKEN_REFRESHES.inc("failure")
+            logger.error("[DingTalk] Failed to get access token: %s", e)
+            raise
         except Exception as e:
-            logger.error(f"[DingTalk] Failed to get access token: {e}")
-            raise DingTalkClientError(f"Failed to get access token: {e}")
+            metrics.TOKEN_REFRESHES.inc("failure")
+            logger.error("[DingTalk] Failed to get access token: %s", e)
+            raise DingTalkTransientError(f"Failed to get access token: {e}")
@@ -0,0 +1,309 @@
+"""Resolve targets given as mobile number, name or department to DingTalk user ids."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ROOT_DEPT = 1
+PREFIXES = ("mobile:", "name:", "dept:")
+
+# Concurrent directory API calls during the initial load
+LOAD_CONCURRENCY = 4
+
+
+class TargetResolutionError(LookupError):
+    """Raised when a ``mobile:``, ``name:`` or ``dept:`` target matches nobody."""
+
+
+def normalize_mobile(mobile: str) -> str:
+    digits = re.sub(r"\D", "", mobile)
+    if len(digits) == 13 and digits.startswith("86"):
+        digits = digits[2:]
+    return digits
+
+
+class DirectoryIndex:
+    """In-memory index of the org directory, updated one department at a time."""
+
+    def __init__(self) -> None:
+        self._departments: Dict[int, str] = {}
+        self._children: Dict[int, Set[int]] = {}
+        self._members: Dict[int, Set[str]] = {}
+        self._user_depts: Dict[str, Set[int]] = {}
+        self._users: Dict[str, Tuple[str, str]] = {}  # userid -> (name, mobile)
+        self._by_mobile: Dict[str, str] = {}
+        self._by_name: Dict[str, Set[str]] = {}
+
+    @property
+    def departments(self) -> List[int]:
+        return list(self._departments)
+
+    def __contains__(self, dept_id: int) -> bool:
+        return dept_id in self._departments
+
+    def name_department(self, dept_id: int, name: str) -> None:
+        self._departments[dept_id] = name
+        self._children.setdefault(dept_id, set())
+
+    def set_children(self, dept_id: int, children: List[int]) -> None:
+        """Record the current sub-departments of a department, dropping removed ones."""
+        self._departments.setdefault(dept_id, "")
+        current = set(children)
+        for child in self._children.get(dept_id, set()) - current:
+            self.remove_department(child)
+        self._children[dept_id] = current
+
+    def remove_department(self, dept_id: int) -> None:
+        for child in self._children.pop(dept_id, set()):
+            self.remove_department(child)
+        self._departments.pop(dept_id, None)
+        self.set_members(dept_id, [])
+        self._members.pop(dept_id, None)
+
+    def set_members(self, dept_id: int, users: List[Dict[str, Any]]) -> None:
+        """Replace the direct members of a department."""
+        current = {user["userid"] for user in users}
+        for userid in self._members.get(dept_id, set()) - current:
+            depts = self._user_depts.get(userid)
+            if depts is not None:
+                depts.discard(dept_id)
+                if not depts:
+                    self._remove_user(userid)
+        self._members[dept_id] = current
+        for user in users:
+            userid = user["userid"]
+            self._user_depts.setdefault(userid, set()).add(dept_id)
+            self._put_user(userid, user.get("name") or "", normalize_mobile(user.get("mobile") or ""))
+
+    def _put_user(self, userid: str, name: str, mobile: str) -> None:
+        old = self._users.get(userid)
+        if old == (name, mobile):
+            return
+        if old is not None:
+            self._unindex(userid, *old)
+        self._users[userid] = (name, mobile)
+        if name:
+            self._by_name.setdefault(name, set()).add(userid)
+        if mobile:
+            self._by_mobile[mobile] = userid
+
+    def _remove_user(self, userid: str) -> None:
+        self._user_depts.pop(userid, None)
+        old = self._users.pop(userid, None)
+        if old is not None:
+            self._unindex(userid, *old)
+
+    def _unindex(self, userid: str, name: str, mobile: str) -> None:
+        users = self._by_name.get(name)
+        if users is not None:
+            users.discard(userid)
+            if not users:
+                del self._by_name[name]
+        if self._by_mobile.get(mobile) == userid:
+            del self._by_mobile[mobile]
+
+    def by_mobile(self, mobile: str) -> str | None:
+        return self._by_mobile.get(normalize_mobile(mobile))
+
+    def by_name(self, name: str) -> List[str]:
+        return sorted(self._by_name.get(name, ()))
+
+    def by_department(self, ref: str) -> List[str]:
+        """Members of the departments named (or numbered) ``ref``, sub-departments included."""
+        if ref.isdigit() and int(ref) in self._departments:
+            roots = [int(ref)]
+        else:
+            roots = [dept_id for dept_id, name in self._departments.items() if name == ref]
+        users: Set[str] = set()
+        pending = list(roots)
+        while pending:
+            dept_id = pending.pop()
+            users |= self._members.get(dept_id, set())
+            pending.extend(self._children.get(dept_id, ()))
+        return sorted(users)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"departments": len(self._departments), "users": len(self._users)}
+
+
+class UserDirectory:
+    """Resolve ``mobile:``, ``name:`` and ``dept:`` targets against a preloaded index.
+
+    The whole org is loaded once at startup; afterwards one department is
+    re-fetched at a time, spread over ``refresh_interval``, so changes are
+    picked up without periodic bulk reloads. Mobile numbers missing from
+    the index fall back to ``getbymobile``, cached for ``lookup_ttl``
+    seconds (misses included). Plain user ids and conversation ids pass
+    through untouched.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        preload: bool = True,
+        refresh_interval: float = 3600.0,
+        lookup_ttl: float = 3600.0,
+        lookup_cache_size: int = 1024,
+        load_timeout: float = 30.0,
+    ) -> None:
+        self._client = client
+        self._preload = preload
+        self._refresh_interval = refresh_interval
+        self._lookup_ttl = lookup_ttl
+        self._lookup_cache_size = lookup_cache_size
+        self._load_timeout = load_timeout
+        self.index = DirectoryIndex()
+        self._ready = asyncio.Event()
+        self._lookups: "OrderedDict[str, Tuple[str | None, float]]" = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+        self.loaded_at: float | None = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.api_lookups = 0
+
+    def start(self) -> None:
+        if self._preload and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def resolve(self, target: str) -> str:
+        """Return ``target`` with directory references replaced by comma-separated user ids.
+
+        Raises:
+            TargetResolutionError: If a reference matches nobody.
+        """
+        if ":" not in target:
+            return target
+        userids: Dict[str, None] = {}  # Ordered set
+        for part in target.split(","):
+            part = part.strip()
+            if part:
+                userids.update(dict.fromkeys(await self._resolve_one(part)))
+        return ",".join(userids)
+
+    async def _resolve_one(self, part: str) -> List[str]:
+        if part.startswith("mobile:"):
+            userid = await self._lookup_mobile(part[len("mobile:"):])
+            found = [userid] if userid else []
+        elif part.startswith("name:"):
+            await self._wait_ready()
+            found = self.index.by_name(part[len("name:"):].strip())
+        elif part.startswith("dept:"):
+            await self._wait_ready()
+            found = self.index.by_department(part[len("dept:"):].strip())
+        else:
+            return [part]
+        if not found:
+            raise TargetResolutionError(f"No DingTalk user matches {part}")
+        return found
+
+    async def _wait_ready(self) -> None:
+        if not self._preload:
+            raise TargetResolutionError("Directory index is disabled (GATEWAY_DIRECTORY)")
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), self._load_timeout)
+            except asyncio.TimeoutError:
+                raise TargetResolutionError("Directory index is still loading") from None
+
+    async def _lookup_mobile(self, mobile: str) -> str | None:
+        mobile = normalize_mobile(mobile)
+        userid = self.index.by_mobile(mobile)
+        if userid:
+            return userid
+        cached = self._lookups.get(mobile)
+        if cached is not None and cached[1] > time.monotonic():
+            self._lookups.move_to_end(mobile)
+            return cached[0]
+        self.api_lookups += 1
+        userid = await self._client.get_user_by_mobile(mobile)
+        self._lookups[mobile] = (userid, time.monotonic() + self._lookup_ttl)
+        self._lookups.move_to_end(mobile)
+        while len(self._lookups) > self._lookup_cache_size:
+            self._lookups.popitem(last=False)
+        return userid
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._load()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning("[Directory] Initial load failed, retrying in 60s: %s", e)
+                await asyncio.sleep(60)
+        stats = self.index.stats()
+        logger.info("[Directory] Loaded %d users in %d departments", stats["users"], stats["departments"])
+
+        while True:
+            departments = self.index.departments or [ROOT_DEPT]
+            delay = self._refresh_interval / len(departments)
+            for dept_id in departments:
+                await asyncio.sleep(delay)
+                if dept_id not in self.index:
+                    continue  # Removed with its parent meanwhile
+                try:
+                    await self._refresh_department(dept_id)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.refresh_errors += 1
+                    logger.warning("[Directory] Refreshing department %s failed: %s", dept_id, e)
+
+    async def _load(self) -> None:
+        """Walk the department tree from the root, a level at a time."""
+        semaphore = asyncio.Semaphore(LOAD_CONCURRENCY)
+
+        async def load(dept_id: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self._refresh_department(dept_id)
+
+        level = [ROOT_DEPT]
+        while level:
+            children = await asyncio.gather(*(load(dept_id) for dept_id in level))
+            level = [child["dept_id"] for batch in children for child in batch]
+        self.loaded_at = time.time()
+        self._ready.set()
+
+    async def _refresh_department(self, dept_id: int) -> List[Dict[str, Any]]:
+        """Re-fetch one department's sub-departments and members; returns the sub-departments."""
+        children, users = await asyncio.gather(
+            self._client.list_departments(dept_id),
+            self._client.list_department_users(dept_id),
+        )
+        self.index.set_children(dept_id, [child["dept_id"] for child in children])
+        for child in children:
+            # Names come with the parent's listing; new departments get members next cycle
+            self.index.name_department(child["dept_id"], child.get("name") or "")
+        self.index.set_members(dept_id, users)
+        self.refreshes += 1
+        return children
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.index.stats(),
+            "ready": self._ready.is_set(),
+            "loaded_at": self.loaded_at,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "api_lookups": self.api_lookups,
+            "cached_lookups": len(self._lookups),
+        }
@@ -0,0 +1,108 @@
+"""Outbound send dispatcher: ordered per target, parallel across targets."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Job = Tuple[Callable[[], Awaitable[Any]], asyncio.Future]
+
+
+class SendDispatcher:
+    """Run sends on a bounded worker pool, one FIFO lane per target.
+
+    A lane is handed to at most one worker at a time, so sends to the same
+    user or conversation complete in submission order, while different
+    targets proceed in parallel. A busy lane goes back to the end of the
+    ready queue after each send, so one chatty target cannot starve others.
+    """
+
+    def __init__(self, workers: int = 16) -> None:
+        self._worker_count = max(1, workers)
+        self._lanes: Dict[str, Deque[Job]] = {}
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self._worker_count)]
+
+    async def submit(self, key: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Queue ``send`` on the lane for ``key`` and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            self._ready.put_nowait(key)
+        lane.append((send, future))
+        self.submitted += 1
+        return await future
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            send, future = lane.popleft()
+            if not future.cancelled():
+                self.in_flight += 1
+                try:
+                    result = await send()
+                except asyncio.CancelledError:
+                    if not future.done():
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.completed += 1
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.in_flight -= 1
+            if lane:
+                self._ready.put_nowait(key)
+            else:
+                del self._lanes[key]
+
+    async def close(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        for lane in self._lanes.values():
+            for _, future in lane:
+                if not future.done():
+                    future.set_exception(RuntimeError("Dispatcher closed"))
+        self._lanes.clear()
+
+    @property
+    def lanes(self) -> int:
+        """Targets with a send queued or running."""
+        return len(self._lanes)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._worker_count,
+            "lanes": self.lanes,
+            "queued": self.queued,
+            "max_lane_depth": max((len(lane) for lane in self._lanes.values()), default=0),
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -2,18 +2,30 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, ClassVar, Dict, Tuple
+
+from .serialization import dumps
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-@dataclass
+@dataclass(slots=True)
 class IncomingMessageEvent:
-    """Represents a message received from DingTalk."""
+    """Represents a message received from DingTalk.
+
+    The JSON encoding is computed once and cached, so fanning the same event
+    out to many subscribers does not re-encode it.
+    """
+
+    event_type: ClassVar[str] = "incoming_message"
+    _FIELDS: ClassVar[Tuple[str, ...]] = (
+        "msg_id", "sender", "sender_name", "receiver", "content", "is_group",
+        "timestamp", "event_time", "room_id", "room_name", "at_me", "trace_id",
+    )
 
     msg_id: str
     sender: str
@@ -26,12 +38,27 @@ class IncomingMessageEvent:
     room_id: str | None = None
     room_name: str | None = None
     at_me: bool | None = None
+    trace_id: str | None = None  # Pass back when replying to link the reply to this message
+    received_at: float = field(default=0.0, repr=False, compare=False)  # perf_counter() at receipt
+    conversation_id: str | None = field(default=None, repr=False, compare=False)  # Not part of the JSON
+    _json: str | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IncomingMessageEvent":
+        """Rebuild an event from :meth:`asdict` output."""
+        return cls(**{name: data.get(name) for name in cls._FIELDS})
 
     def asdict(self) -> Dict[str, Any]:
-        data = asdict(self)
-        data.setdefault("event_type", "incoming_message")
+        data = {name: getattr(self, name) for name in self._FIELDS}
+        data["event_type"] = self.event_type
         return data
 
+    def to_json(self) -> str:
+        """Return the cached JSON encoding of :meth:`asdict`."""
+        if self._json is None:
+            self._json = dumps(self.asdict())
+        return self._json
+
 
 @dataclass
 class OutgoingMessageRequest:
@@ -40,7 +67,14 @@ class OutgoingMessageRequest:
     target: str
     content: str
     at_list: list[str] | None = None
-    msg_type: str = "text"  # text, markdown, actionCard
+    msg_type: str = "text"  # text, markdown, actionCard, image, file
+    title: str | None = None  # markdown and actionCard title
+    buttons: list[Dict[str, str]] | None = None  # actionCard buttons: {"title": ..., "url": ...}
+    media_id: str | None = None  # image and file messages
+    priority: str = "normal"  # high, normal, low
+    conversation_id: str | None = None  # Reply into this conversation when known
+    trace_id: str | None = None  # Trace of the message being replied to
+    coalesce: bool = True  # Wait the batching window for identical sends to other users
 
     def normalized(self) -> Dict[str, Any]:
         payload: Dict[str, Any] = {
@@ -0,0 +1,165 @@
+"""Server-side event filters for WebSocket subscriptions."""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from re import _constants as sre, _parser as sre_parse
+from typing import Any, FrozenSet, List, Mapping, Pattern
+
+MAX_REGEX_LENGTH = 256
+# Filters run on the event loop for every publish, so patterns are limited to
+# ones whose backtracking stays polynomial, and only see the start of the content
+MAX_REGEX_REPEATS = 2
+MAX_REGEX_INPUT = 512
+
+_REPEATS = (sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT)
+
+
+def event_field(event: Any, name: str) -> Any:
+    """Read a field from an event object or event dict."""
+    if isinstance(event, dict):
+        return event.get(name)
+    return getattr(event, name, None)
+
+
+def _parse_bool(value: str | None, name: str) -> bool | None:
+    if value is None or value == "":
+        return None
+    lowered = value.lower()
+    if lowered in ("true", "1", "yes"):
+        return True
+    if lowered in ("false", "0", "no"):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+def _flag_is(value: Any, expected: bool) -> bool:
+    # A missing flag (None) is unknown, not false: it matches neither value
+    return value is not None and bool(value) == expected
+
+
+def _compile_regex(pattern: str) -> Pattern[str]:
+    """Compile a subscriber's regex, rejecting patterns that can backtrack catastrophically.
+
+    Backreferences, repeats inside repeats and repeated alternatives can take
+    exponential time; more than ``MAX_REGEX_REPEATS`` repeats in a row can
+    take high polynomial time.
+    """
+    if len(pattern) > MAX_REGEX_LENGTH:
+        raise ValueError("regex is too long")
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        raise ValueError(f"invalid regex: {e}") from e
+    repeats = 0
+
+    def walk(items: List[tuple], in_repeat: bool) -> None:
+        nonlocal repeats
+        for op, av in items:
+            if op in _REPEATS:
+                _, high, body = av
+                if high > 1:
+                    if in_repeat:
+                        raise ValueError("regex may not nest repeats")
+                    repeats += 1
+                walk(body, in_repeat or high > 1)
+            elif op is sre.BRANCH:
+                if in_repeat:
+                    raise ValueError("regex may not repeat alternatives; use a character class")
+                for branch in av[1]:
+                    walk(branch, in_repeat)
+            elif op is sre.SUBPATTERN:
+                walk(av[-1], in_repeat)
+            elif op in (sre.ASSERT, sre.ASSERT_NOT):
+                walk(av[1], in_repeat)
+            elif op is sre.ATOMIC_GROUP:
+                walk(av, in_repeat)
+            elif op in (sre.GROUPREF, sre.GROUPREF_EXISTS):
+                raise ValueError("regex may not use backreferences")
+
+    walk(list(parsed), False)
+    if repeats > MAX_REGEX_REPEATS:
+        raise ValueError(f"regex may use at most {MAX_REGEX_REPEATS} repeats")
+    return re.compile(pattern)
+
+
+def _parse_set(value: str | None) -> FrozenSet[str]:
+    if not value:
+        return frozenset()
+    return frozenset(part.strip() for part in value.split(",") if part.strip())
+
+
+@dataclass(frozen=True)
+class EventFilter:
+    """Compiled filter selecting incoming messages; unset criteria match anything.
+
+    Events lacking a filtered field (e.g. non-message events) do not match
+    that criterion.
+    """
+
+    senders: FrozenSet[str] = frozenset()
+    room_ids: FrozenSet[str] = frozenset()
+    is_group: bool | None = None
+    at_me: bool | None = None
+    content_prefix: str | None = None
+    content_regex: Pattern[str] | None = None
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> "EventFilter | None":
+        """Build a filter from ``/ws`` query parameters, or ``None`` if none are given.
+
+        Recognised parameters: ``sender`` and ``room_id`` (comma-separated),
+        ``is_group``, ``at_me``, ``prefix`` and ``regex``. ``regex`` is
+        searched for in the first ``MAX_REGEX_INPUT`` characters of the content.
+
+        Raises:
+            ValueError: If a parameter is malformed, ``regex`` could backtrack
+                catastrophically, or ``at_me`` is false.
+        """
+        regex = params.get("regex") or None
+        compiled = _compile_regex(regex) if regex is not None else None
+        at_me = _parse_bool(params.get("at_me"), "at_me")
+        if at_me is False:
+            # Direct messages carry no at_me and group messages without a mention are never delivered
+            raise ValueError("at_me=false matches no messages; use is_group=false for direct messages")
+
+        event_filter = cls(
+            senders=_parse_set(params.get("sender")),
+            room_ids=_parse_set(params.get("room_id")),
+            is_group=_parse_bool(params.get("is_group"), "is_group"),
+            at_me=at_me,
+            content_prefix=params.get("prefix") or None,
+            content_regex=compiled,
+        )
+        return None if event_filter.is_empty else event_filter
+
+    @property
+    def is_empty(self) -> bool:
+        return (
+            not self.senders
+            and not self.room_ids
+            and self.is_group is None
+            and self.at_me is None
+            and self.content_prefix is None
+            and self.content_regex is None
+        )
+
+    def matches(self, event: Any) -> bool:
+        if self.senders and event_field(event, "sender") not in self.senders:
+            return False
+        if self.room_ids and event_field(event, "room_id") not in self.room_ids:
+            return False
+        if self.is_group is not None and not _flag_is(event_field(event, "is_group"), self.is_group):
+            return False
+        if self.at_me is not None and not _flag_is(event_field(event, "at_me"), self.at_me):
+            return False
+        if self.content_prefix is not None or self.content_regex is not None:
+            content = event_field(event, "content")
+            if not isinstance(content, str):
+                return False
+            if self.content_prefix is not None and not content.startswith(self.content_prefix):
+                return False
+            if self.content_regex is not None and not self.content_regex.search(content, 0, MAX_REGEX_INPUT):
+                return False
+        return True
@@ -0,0 +1,184 @@
+"""Logging off the event loop, with per-message lines sampled and content redacted.
+
+Records go through a bounded queue to a background thread that formats and
+writes them, so a slow stderr never stalls the event loop. Lines logged
+once per message use :data:`message_logger`, whose volume is capped by
+sampling and a rate limit, and message text is wrapped in :func:`content`
+so redaction is applied only if the line is actually written.
+"""
+
+from __future__ import annotations
+
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict
+
+LOG_FORMAT = "[%(asctime)s] %(levelname)s - %(name)s: %(message)s"
+
+# Content policies for message text in logs
+CONTENT_FULL = "full"
+CONTENT_TRUNCATE = "truncate"  # First TRUNCATE_LENGTH characters
+CONTENT_REDACT = "redact"  # Only the length
+CONTENT_POLICIES = (CONTENT_FULL, CONTENT_TRUNCATE, CONTENT_REDACT)
+TRUNCATE_LENGTH = 50
+
+# Logger for lines written once per message (received, sent, suppressed)
+message_logger = logging.getLogger("gateway.messages")
+
+_content_policy = CONTENT_TRUNCATE
+_listener: "_Listener | None" = None
+_queue_handler: "_DroppingQueueHandler | None" = None
+_message_filter: "MessageLogFilter | None" = None
+
+
+class _Content:
+    """Message text rendered by the content policy when the log line is formatted."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+    def __str__(self) -> str:
+        text = self.text or ""
+        if _content_policy == CONTENT_REDACT:
+            return f"<{len(text)} chars>"
+        if _content_policy == CONTENT_TRUNCATE and len(text) > TRUNCATE_LENGTH:
+            return f"{text[:TRUNCATE_LENGTH]}…"
+        return text
+
+
+def content(text: str) -> _Content:
+    """Wrap message text for logging under the configured redaction policy."""
+    return _Content(text)
+
+
+class MessageLogFilter(logging.Filter):
+    """Sample and rate-limit per-message lines below WARNING.
+
+    Lines pass with probability ``sample_rate``, then at most ``per_second``
+    a second (0 for no limit). The next line written reports how many were
+    suppressed in between.
+    """
+
+    def __init__(self, per_second: float = 20.0, sample_rate: float = 1.0) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self.sample_rate = sample_rate
+        self._tokens = per_second
+        self._updated = time.monotonic()
+        self._suppressed = 0
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self._suppress()
+        if self.per_second > 0:
+            now = time.monotonic()
+            self._tokens = min(self.per_second, self._tokens + (now - self._updated) * self.per_second)
+            self._updated = now
+            if self._tokens < 1:
+                return self._suppress()
+            self._tokens -= 1
+        if self._suppressed:
+            record.msg = f"{record.msg} (+{self._suppressed} similar lines suppressed)"
+            self._suppressed = 0
+        return True
+
+    def _suppress(self) -> bool:
+        self._suppressed += 1
+        self.suppressed_total += 1
+        return False
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them; drop instead of blocking when full."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so the record can cross as-is
+        # and be formatted on the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than failing when the queue is full at shutdown
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    message_rate: float = 20.0,
+    sample_rate: float = 1.0,
+    content_policy: str = CONTENT_TRUNCATE,
+) -> None:
+    """Route all logging through a queue to a stderr writer thread.
+
+    Replaces the root logger's handlers; calling it again reconfigures.
+    """
+    global _content_policy, _listener, _queue_handler, _message_filter
+
+    if content_policy not in CONTENT_POLICIES:
+        raise ValueError(f"log content policy must be one of {', '.join(CONTENT_POLICIES)}")
+    stop_logging()
+    _content_policy = content_policy
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue: queue.Queue = queue.Queue(maxsize=max(0, queue_size))
+    _queue_handler = _DroppingQueueHandler(log_queue)
+    _listener = _Listener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+
+    if _message_filter is not None:
+        message_logger.removeFilter(_message_filter)
+    _message_filter = MessageLogFilter(message_rate, sample_rate)
+    message_logger.addFilter(_message_filter)
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the writer thread.
+
+    Records logged afterwards are written directly by the calling thread.
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "content": _content_policy,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "message_lines_suppressed": _message_filter.suppressed_total if _message_filter else 0,
+    }
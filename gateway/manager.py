@@ -4,35 +4,135 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Any, Dict, Union
+import time
+from typing import Any, Dict, List, Tuple, Union
 
-from .broker import MessageBroker
+from . import logs, metrics, tracing
+from .broker import MessageBroker, Subscription, format_event_id
+from .bus import BusUnavailableError, Envelope, EventBus, create_bus
 from .config import GatewayConfig
+from .dedup import MessageDeduplicator
+from .directory import TargetResolutionError, UserDirectory
+from .dispatcher import SendDispatcher
 from .events import IncomingMessageEvent, OutgoingMessageRequest
+from .filters import EventFilter
+from .media import MediaFile
+from .receipts import DELIVERED, FAILED, QUEUED, SENT, DeliveryTracker
 
 logger = logging.getLogger(__name__)
 
 
+# Outbox/API message kind -> DingTalk msgtype
+MSG_TYPES = {"text": "text", "markdown": "markdown", "action_card": "actionCard", "image": "image", "file": "file"}
+
+
+def _remote_result(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the leader's answer to a bus call, re-raising the error it reported."""
+    if "error" not in response:
+        return response
+    from .dingtalk_client import DingTalkClientError, DingTalkTransientError
+    
+    error_types = {
+        "TargetResolutionError": TargetResolutionError,
+        "DingTalkClientError": DingTalkClientError,
+        "DingTalkTransientError": DingTalkTransientError,
+        "DingTalkPartialSendError": DingTalkClientError,
+        "BusUnavailableError": BusUnavailableError,
+        "ValueError": ValueError,
+    }
+    raise error_types.get(response.get("error_type"), RuntimeError)(response["error"])
+
+
+def _outgoing_request(kind: str, payload: Dict[str, Any]) -> OutgoingMessageRequest:
+    return OutgoingMessageRequest(
+        target=payload["target"],
+        content=payload.get("content") or "",
+        at_list=payload.get("at_list"),
+        msg_type=MSG_TYPES[kind],
+        title=payload.get("title") or "通知",
+        buttons=payload.get("buttons"),
+        media_id=payload.get("media_id"),
+        priority=payload.get("priority") or "normal",
+        conversation_id=payload.get("conversation_id"),
+        trace_id=payload.get("trace_id"),
+    )
+
+
 class GatewayManager:
     """Coordinates the DingTalk client and exposes async helpers for the API layer."""
 
     def __init__(self, config: GatewayConfig | None = None) -> None:
         self.config = config or GatewayConfig.load()
         self._loop: asyncio.AbstractEventLoop | None = None
-        self._broker = MessageBroker()
+        self._broker = MessageBroker(capacity=self.config.event_buffer_size)
         self._client: Union[Any, None] = None
+        self._bus: EventBus | None = None
+        self._dispatcher = SendDispatcher(workers=self.config.send_workers)
+        self._dedup: MessageDeduplicator | None = None
+        if self.config.dedup_window > 0:
+            self._dedup = MessageDeduplicator(self.config.dedup_window, self.config.dedup_max_entries)
+        self._directory: UserDirectory | None = None
+        self._stream_task: asyncio.Task | None = None
+        self._started_at: float | None = None  # time.monotonic() when start() began
+        self._api_ready_at: float | None = None  # ... and when it returned
+        self._outbox: Any = None
+        self._sweeper_task: asyncio.Task | None = None
+        self._publish_tasks: set[asyncio.Task] = set()
+        self._receipts = DeliveryTracker(
+            self._fetch_send_result,
+            self._publish_receipt,
+            poll_interval=self.config.receipt_poll_interval,
+            max_entries=self.config.receipt_buffer_size,
+        )
+        self._send_tasks: set[asyncio.Task] = set()
         self.channel_type = self.config.channel_type
 
     async def start(self) -> None:
         if self._loop:
             return
         self._loop = asyncio.get_running_loop()
+        self._started_at = time.monotonic()
         self._broker.attach_loop(self._loop)
+        tracing.TRACER.configure(self.config.trace_sample_rate, self.config.trace_buffer_size)
         
         # Initialize DingTalk client
         await self._start_dingtalk()
+        self._dispatcher.start()
+        self._receipts.start()
+        self._directory = UserDirectory(
+            self._client,
+            preload=self.config.directory_preload,
+            refresh_interval=self.config.directory_refresh,
+            lookup_ttl=self.config.directory_lookup_ttl,
+            load_timeout=self.config.http_timeout * 3,
+        )
         
-        logger.info(f"Gateway manager started with channel: {self.config.channel_type}")
+        # Only the elected leader holds the Stream connection and sends; without
+        # a shared bus this process is the only one
+        self._bus = create_bus(
+            self.config.broker_backend,
+            self.config.broker_path,
+            self.config.redis_url,
+            self.config.leader_ttl,
+        )
+        if self._bus:
+            # Followers borrow the leader's access token instead of renewing their own
+            self._client.token_source = self._leader_token
+            await self._bus.start(
+                self._on_bus_event,
+                self._on_leadership,
+                lambda: self._broker.last_event_id,
+                on_request=self._on_bus_request,
+                admit=self._admit_envelope,
+            )
+        else:
+            await self._on_leadership(True)
+        
+        self._sweeper_task = asyncio.create_task(self._sweep_slow_consumers())
+        self._register_metrics()
+        
+        self._api_ready_at = time.monotonic()
+        logger.info("Gateway manager started with channel: %s", self.config.channel_type)
         logger.info("Message pipeline optimized for low latency")
 
     async def _start_dingtalk(self) -> None:
@@ -51,71 +151,517 @@ class GatewayManager:
             on_message=self._handle_incoming,
             use_stream=self.config.dingtalk_use_stream,
             webhook_secret=self.config.dingtalk_webhook_secret,
+            api_base=self.config.dingtalk_api_base,
+            http_pool_size=self.config.http_pool_size,
+            http_pool_per_host=self.config.http_pool_per_host,
+            http_dns_ttl=self.config.http_dns_ttl,
+            http_keepalive=self.config.http_keepalive,
+            http_timeout=self.config.http_timeout,
+            batch_window=self.config.batch_window_ms / 1000,
+            batch_max_targets=self.config.batch_max_targets,
+            api_qps=self.config.api_qps,
+            webhook_per_minute=self.config.webhook_per_minute,
+            webhook_max_wait=self.config.webhook_max_wait,
+            webhook_cache_size=self.config.webhook_cache_size,
+            stream_fast_ack=self.config.stream_fast_ack,
+            stream_workers=self.config.stream_workers,
+            stream_queue_size=self.config.stream_queue_size,
+            media_cache_ttl=self.config.media_cache_ttl,
+            media_cache_size=self.config.media_cache_size,
         )
         
-        # Start Stream connection if enabled
-        if self.config.dingtalk_use_stream:
-            asyncio.create_task(self._client.start_stream())
+        # Sweep expired session webhooks; the leader also keeps the access token warm
+        self._client.start()
+        
+        logger.info("[DingTalk] Client initialized (Stream: %s)", self.config.dingtalk_use_stream)
+
+    async def _on_leadership(self, leader: bool) -> None:
+        """Take over the Stream connection, access token, directory and outbox when elected; hand them back when not."""
+        if leader:
+            # Renew the token so sends never wait on /gettoken
+            self._client.token_source = None
+            self._client.start_token_renewal()
+            if self.config.dingtalk_use_stream and self._stream_task is None:
+                self._stream_task = asyncio.create_task(self._client.start_stream())
+            self._directory.start()
+            if self.config.outbox_path and self._outbox is None:
+                await self._start_outbox()
+        else:
+            await self._stop_stream()
+            await self._client.stop_token_renewal()
+            if self._bus:
+                self._client.token_source = self._leader_token
+            await self._directory.close()
+            if self._outbox:
+                await self._outbox.close()
+                self._outbox = None
+
+    async def _leader_token(self) -> Tuple[str, float]:
+        response = _remote_result(await self._bus.call({"op": "token"}))
+        return response["access_token"], response["expires_at"]
+
+    async def _stop_stream(self) -> None:
+        if self._stream_task:
+            self._stream_task.cancel()
+            try:
+                await self._stream_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._stream_task = None
+
+    async def _start_outbox(self) -> None:
+        """Open the durable outbox and start its delivery workers."""
+        from .dingtalk_client import DingTalkTransientError
+        from .outbox import Outbox
         
-        logger.info(f"[DingTalk] Client initialized (Stream: {self.config.dingtalk_use_stream})")
+        self._outbox = Outbox(
+            self.config.outbox_path,
+            self._deliver,
+            workers=self.config.outbox_workers,
+            max_attempts=self.config.outbox_max_attempts,
+            is_transient=lambda e: isinstance(e, DingTalkTransientError),
+        )
+        await self._outbox.start()
+
+    def _register_metrics(self) -> None:
+        """Expose queue depths and cache counters, read at scrape time."""
+        broker = self._broker
+        client = self._client
+        register = metrics.REGISTRY.register
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_subscribers", "Connected event subscribers",
+            lambda: broker.subscriber_count,
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_subscriber_max_lag", "Largest number of unread events of any subscriber",
+            lambda: broker.stats()["max_lag"],
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_subscriber_dropped_total", "Events dropped for slow subscribers",
+            lambda: broker.stats()["dropped"], kind="counter",
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_send_queue_depth", "Sends waiting for rate-limit tokens by priority",
+            lambda: {(name,): depth for name, depth in client.scheduler.stats()["queue_by_priority"].items()},
+            labels=("priority",),
+        ))
+        dispatcher = self._dispatcher
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_stream_queue_depth", "Fast-ack Stream callbacks waiting to be processed",
+            lambda: client.stream_stats()["queued"],
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_dispatch_queued", "Sends waiting in per-target dispatcher lanes",
+            lambda: dispatcher.queued,
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_dispatch_in_flight", "Sends being executed by dispatcher workers",
+            lambda: dispatcher.in_flight,
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_webhook_cache_total", "Session webhook cache lookups and fallbacks by result",
+            lambda: {(name,): client.webhooks.stats()[name] for name in ("hits", "misses", "expired", "fallbacks")},
+            labels=("result",), kind="counter",
+        ))
+        register(metrics.CallbackMetric(
+            "dingtalk_gateway_webhook_cache_size", "Cached session webhooks",
+            lambda: len(client.webhooks),
+        ))
+        if self._dedup is not None:
+            dedup = self._dedup
+            register(metrics.CallbackMetric(
+                "dingtalk_gateway_duplicates_suppressed_total", "Redelivered incoming messages dropped by msg_id",
+                lambda: dedup.duplicates, kind="counter",
+            ))
+        if self.config.outbox_path:
+            # Opened and closed with leadership, so look it up at scrape time
+            register(metrics.CallbackMetric(
+                "dingtalk_gateway_outbox_total", "Outbox messages by outcome",
+                lambda: {
+                    (name,): getattr(self._outbox, name) for name in ("enqueued", "delivered", "retried", "dead")
+                } if self._outbox else {},
+                labels=("outcome",), kind="counter",
+            ))
+
+    async def _sweep_slow_consumers(self) -> None:
+        """Periodically evict subscribers that stopped reading."""
+        timeout = self.config.slow_consumer_timeout
+        while True:
+            await asyncio.sleep(max(1.0, timeout / 4))
+            self._broker.evict_slow_consumers(timeout)
 
     async def stop(self) -> None:
         if not self._client:
             return
         
+        if self._sweeper_task:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+        
+        if self._outbox:
+            await self._outbox.close()
+            self._outbox = None
+        
+        await self._dispatcher.close()
+        await self._receipts.close()
+        if self._directory:
+            await self._directory.close()
+        
+        if self._bus:
+            await self._bus.close()
+            self._bus = None
+        
+        await self._stop_stream()
+        
+        await self._client.close()
         logger.info("Gateway manager stopped")
 
-    async def register_listener(self) -> asyncio.Queue:
-        return await self._broker.subscribe()
+    async def register_listener(
+        self,
+        last_event_id: str | None = None,
+        event_filter: EventFilter | None = None,
+        policy: str | None = None,
+        max_lag: int | None = None,
+        max_drops: int | None = None,
+    ) -> Subscription:
+        """Subscribe to incoming events, replaying those after ``last_event_id``.
 
-    async def unregister_listener(self, queue: asyncio.Queue) -> None:
-        await self._broker.unsubscribe(queue)
+        Backpressure settings fall back to the configured defaults.
+
+        Raises:
+            ValueError: If ``last_event_id`` or ``policy`` is malformed.
+        """
+        return await self._broker.subscribe(
+            last_event_id,
+            event_filter,
+            policy=policy or self.config.ws_policy,
+            max_lag=max_lag or self.config.ws_max_lag,
+            max_drops=self.config.ws_max_drops if max_drops is None else max_drops,
+        )
+
+    async def unregister_listener(self, subscription: Subscription) -> None:
+        await self._broker.unsubscribe(subscription)
 
     def _handle_incoming(self, event: IncomingMessageEvent) -> None:
         """Handle incoming message and publish to subscribers.
         
         Note: This is called synchronously from the DingTalk client.
-        We schedule the async publish as a task to avoid blocking.
+        We schedule the async publish as a task to avoid blocking; the event
+        is published as-is and encoded once, when the first subscriber reads it.
         """
-        logger.debug("Incoming message event: %s", event)
+        # Message text only goes through logs.message_logger
+        logger.debug("Incoming message event %s in %s", event.msg_id, event.conversation_id)
         
-        # Schedule async publish as a task (non-blocking)
-        if self._loop:
-            asyncio.run_coroutine_threadsafe(
-                self._broker.async_publish(event.asdict()), 
-                self._loop
-            )
+        if not self._loop:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            # Stream and webhook handlers run on our loop: schedule directly
+            task = self._loop.create_task(self._publish(event))
+            self._publish_tasks.add(task)
+            task.add_done_callback(self._publish_tasks.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self._publish(event), self._loop)
+
+    async def _publish(self, event: IncomingMessageEvent) -> None:
+        # DingTalk redelivers callbacks after slow ACKs or reconnects, possibly
+        # to another worker: with a bus the leader checks, in _admit_envelope
+        if self._bus is None and self._is_duplicate(event.msg_id):
+            return
+        with tracing.span("publish"):
+            if self._bus:
+                await self._bus.publish(self._envelope(event))
+            else:
+                await self._broker.async_publish(event)
+        if event.received_at:
+            metrics.INGEST_LATENCY.observe(time.perf_counter() - event.received_at)
+
+    def _envelope(self, event: IncomingMessageEvent) -> Envelope:
+        """Wrap an event for the bus, with the session webhook it arrived with."""
+        webhook = None
+        entry = self._client.webhooks.entry(event.sender, event.conversation_id)
+        if entry is not None:
+            webhook = {
+                "user_id": entry.user_id,
+                "conversation_id": entry.conversation_id,
+                "url": entry.url,
+                "expires_at_ms": int(entry.expires_at * 1000),
+                "is_group": entry.is_group,
+            }
+        return {"event": event.asdict(), "webhook": webhook}
+
+    def _is_duplicate(self, msg_id: str | None) -> bool:
+        if self._dedup is None or not self._dedup.seen(msg_id):
+            return False
+        logs.message_logger.info("[Gateway] Suppressed duplicate message %s", msg_id)
+        return True
+    
+    def _admit_envelope(self, envelope: Envelope) -> bool:
+        """Drop redelivered events at the leader, the one place every event passes."""
+        event = envelope.get("event")
+        return event is None or not self._is_duplicate(event.get("msg_id"))
+    
+    async def _on_bus_event(self, envelope: Envelope) -> None:
+        """Publish an event sequenced by the bus leader on the local broker."""
+        event_id = format_event_id(envelope["epoch"], envelope["seq"])
+        receipt = envelope.get("receipt")
+        if receipt is not None:
+            await self._broker.async_publish(receipt, event_id=event_id)
+            return
+        webhook = envelope.get("webhook")
+        if webhook:
+            self._client.webhooks.put(**webhook)
+        if self._dedup is not None:
+            # Every worker keeps the window, so a new leader still recognises redeliveries
+            self._dedup.remember(envelope["event"].get("msg_id"))
+        event = IncomingMessageEvent.from_dict(envelope["event"])
+        await self._broker.async_publish(event, event_id=event_id)
 
     async def send_text(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._submit("text", payload)
+    
+    async def send_markdown(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send markdown message."""
+        return await self._submit("markdown", payload)
+    
+    async def send_action_card(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send an actionCard message with one or more link buttons."""
+        return await self._submit("action_card", payload)
+    
+    async def send_media(self, kind: str, payload: Dict[str, Any], media: MediaFile) -> Dict[str, Any]:
+        """Upload an image or file (once per content) and send it by ``media_id``."""
         if not self._client:
             raise RuntimeError("Gateway client not started")
         
-        request = OutgoingMessageRequest(
-            target=payload["target"],
-            content=payload["content"],
-            at_list=payload.get("at_list"),
-        )
+        media_id = await self._client.upload_media(media, kind, payload.get("filename") or "media")
+        return await self._submit(kind, {**payload, "media_id": media_id})
+    
+    async def _submit(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send now, queue in the outbox, or accept for background sending.
+        
+        Followers hand the message to the bus leader, which owns the rate
+        limits, per-target lanes, outbox and receipt store.
+        """
+        if not self._client:
+            raise RuntimeError("Gateway client not started")
+        if self._bus and not self._bus.is_leader:
+            return _remote_result(await self._bus.call({"op": "send", "kind": kind, "payload": payload}))
+        return await self._submit_local(kind, payload)
+    
+    async def _submit_local(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # mobile:/name:/dept: targets become user ids once, before queueing
+        target = await self._directory.resolve(payload["target"])
+        if target != payload["target"]:
+            payload = {**payload, "target": target}
+        
+        if payload.get("async"):
+            return await self._send_async(kind, payload)
         
-        await self._client.send_text(request)
+        if self._outbox:
+            outbox_id = await self._outbox.enqueue(kind, payload)
+            return {"status": "queued", "outbox_id": outbox_id}
         
+        await self._dispatch(kind, payload)
         return {"status": "sent"}
     
-    async def send_markdown(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Send markdown message."""
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send several text/markdown/actionCard messages concurrently.
+        
+        At most ``send_batch_concurrency`` messages are in flight at once.
+        Returns one result per message, in request order; a failed message
+        does not affect the others.
+        """
         if not self._client:
             raise RuntimeError("Gateway client not started")
         
-        target = payload["target"]
-        title = payload.get("title", "通知")
-        content = payload["content"]
+        semaphore = asyncio.Semaphore(max(1, self.config.send_batch_concurrency))
         
-        await self._client.send_markdown(target, title, content)
+        async def send_one(index: int, message: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    result = await self._submit(message.get("type") or "text", message)
+                except Exception as e:
+                    logger.warning("[Batch] Message %d to %s failed: %s", index, message.get("target"), e)
+                    return {"index": index, "status": "error", "error": str(e)}
+                return {"index": index, **result}
         
-        return {"status": "sent"}
+        return await asyncio.gather(*(send_one(i, message) for i, message in enumerate(messages)))
+    
+    async def _send_async(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Accept a message and send it in the background.
+        
+        Returns the ``message_id`` under which delivery receipts are
+        published and the status can be looked up.
+        """
+        message = self._receipts.create(kind, payload["target"], payload.get("trace_id"))
+        if self._outbox:
+            payload = {**payload, "message_id": message.message_id}
+            outbox_id = await self._outbox.enqueue(kind, payload)
+            await self._receipts.update(message.message_id, QUEUED)
+            return {"status": "accepted", "message_id": message.message_id, "outbox_id": outbox_id}
+        
+        task = asyncio.create_task(self._send_tracked(kind, payload, message.message_id))
+        self._send_tasks.add(task)
+        task.add_done_callback(self._send_tasks.discard)
+        return {"status": "accepted", "message_id": message.message_id}
+    
+    async def _send_tracked(self, kind: str, payload: Dict[str, Any], message_id: str) -> None:
+        try:
+            result = await self._dispatch(kind, payload)
+        except Exception as e:
+            logger.warning("[Gateway] Async %s message %s failed: %s", kind, message_id, e)
+            await self._receipts.update(message_id, FAILED, error=str(e))
+        else:
+            await self._record_sent(message_id, result)
+    
+    async def _record_sent(
+        self, message_id: str, result: Dict[str, Any], sent_task_ids: List[int] | None = None
+    ) -> None:
+        """Record a finished send; ``sent_task_ids`` are tasks of earlier, partial attempts."""
+        path = result.get("path")
+        if path == "session_webhook" and not sent_task_ids:
+            # The reply is in the chat already; DingTalk reports nothing further
+            await self._receipts.update(message_id, DELIVERED, path=path)
+        else:
+            # Sends to more users than one call takes come back with several tasks
+            task_ids = [
+                t for t in [*(sent_task_ids or ()), *(result.get("task_ids") or [result.get("task_id")])]
+                if t is not None
+            ]
+            task_id = task_ids[0] if task_ids else None
+            await self._receipts.update(message_id, SENT, path=path, task_id=task_id, task_ids=task_ids)
+    
+    async def _publish_receipt(self, receipt: Dict[str, Any]) -> None:
+        if self._bus:
+            await self._bus.publish({"receipt": receipt})
+        else:
+            await self._broker.async_publish(receipt)
+    
+    async def _fetch_send_result(self, task_id: int) -> Dict[str, Any]:
+        return await self._client.get_send_result(task_id)
+    
+    async def get_message_status(self, message_id: str) -> Dict[str, Any] | None:
+        """Status of a message sent with ``async``, if the leader still tracks it."""
+        if self._bus and not self._bus.is_leader:
+            return _remote_result(await self._bus.call({"op": "status", "message_id": message_id}))["status"]
+        message = self._receipts.get(message_id)
+        return message.asdict() if message is not None else None
+    
+    async def _on_bus_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Carry out a follower's send, status lookup or token request, as the leader."""
+        if request["op"] == "send":
+            return await self._submit_local(request["kind"], request["payload"])
+        if request["op"] == "status":
+            message = self._receipts.get(request["message_id"])
+            return {"status": message.asdict() if message is not None else None}
+        if request["op"] == "token":
+            token, expires_at = await self._client.access_token()
+            return {"access_token": token, "expires_at": expires_at}
+        raise ValueError(f"Unknown bus request {request['op']!r}")
+    
+    async def _deliver(self, kind: str, payload: Dict[str, Any]) -> None:
+        """Send a message stored in the outbox.
+        
+        A work notification that reached only some of its users is retried
+        for the rest; the tasks already sent are kept for its receipt.
+        """
+        from .dingtalk_client import DingTalkPartialSendError, DingTalkTransientError
+        from .outbox import PartialDelivery
+        
+        message_id = payload.get("message_id")
+        try:
+            result = await self._dispatch(kind, payload)
+        except DingTalkPartialSendError as e:
+            if message_id and not isinstance(e.error, DingTalkTransientError):
+                await self._receipts.update(message_id, FAILED, error=str(e))
+            remaining = {
+                **payload,
+                "target": e.failed_targets,
+                "sent_task_ids": [*payload.get("sent_task_ids", ()), *e.result["task_ids"]],
+            }
+            raise PartialDelivery(e.error, remaining) from e
+        except Exception as e:
+            # Transient failures are retried by the outbox
+            if message_id and not isinstance(e, DingTalkTransientError):
+                await self._receipts.update(message_id, FAILED, error=str(e))
+            raise
+        if message_id:
+            await self._record_sent(message_id, result, payload.get("sent_task_ids"))
+    
+    async def _dispatch(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send on the dispatcher lane of the message's conversation or target.
+        
+        A ``trace_id`` from the triggering event joins the send to its trace.
+        """
+        key = payload.get("conversation_id") or payload["target"]
+        _, trace = tracing.TRACER.start(f"send_{kind}", payload.get("trace_id"), target=payload["target"])
+        queued_at = time.perf_counter()
+        
+        async def send() -> Dict[str, Any]:
+            # Dispatcher workers do not inherit our context; carry the trace over
+            with tracing.use(trace):
+                if trace is not None:
+                    trace.add_span("dispatch_queue", queued_at, time.perf_counter(), lane=key)
+                request = _outgoing_request(kind, payload)
+                # Sends on one lane run one at a time and can never share a call;
+                # only wait out the batching window while other lanes are busy
+                request.coalesce = self._dispatcher.lanes > 1
+                with tracing.span(f"send_{kind}", target=payload["target"]):
+                    return await self._client.send_message(request)
+        
+        return await self._dispatcher.submit(key, send)
+    
+    def readiness(self, since: float | None = None) -> Dict[str, Any]:
+        """Startup phases reached so far, in seconds after ``since`` (default: start()).
+
+        ``api`` is when requests are served, ``token`` when the first access
+        token arrived and ``stream`` when the Stream connection was opened
+        (both only listed for the process holding them). Pending phases are
+        ``None``; the gateway is ready once none are.
+        """
+        origin = self._started_at if since is None else since
+        
+        def offset(at: float | None) -> float | None:
+            return None if at is None or origin is None else round(at - origin, 3)
+        
+        client = self._client
+        phases: Dict[str, float | None] = {"api": offset(self._api_ready_at)}
+        if self._bus is None or self._bus.is_leader:
+            phases["token"] = offset(client.token_ready_at if client else None)
+        if self._stream_task is not None:
+            phases["stream"] = offset(client.stream_opened_at)
+        return {"ready": all(at is not None for at in phases.values()), "phases": phases}
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Runtime statistics of the outbound pipeline."""
+        if not self._client:
+            return {}
+        stats: Dict[str, Any] = {
+            "broker": self._broker.stats(),
+            "scheduler": self._client.scheduler.stats(),
+            "webhook_cache": self._client.webhooks.stats(),
+            "media_cache": self._client.media.stats(),
+            "directory": self._directory.stats(),
+            "dispatcher": self._dispatcher.stats(),
+            "stream": self._client.stream_stats(),
+            "tracing": tracing.TRACER.stats(),
+            "logging": logs.stats(),
+            "receipts": self._receipts.stats(),
+        }
+        if self._dedup is not None:
+            stats["dedup"] = self._dedup.stats()
+        if self._bus:
+            stats["bus"] = self._bus.stats()
+        if self._outbox:
+            stats["outbox"] = await self._outbox.stats()
+        return stats
     
-    async def handle_dingtalk_webhook(self, event_data: Dict[str, Any], signature: str = "", timestamp: str = "") -> Dict[str, Any]:
-        """Handle DingTalk webhook event."""
+    async def handle_dingtalk_webhook(self, body: bytes, signature: str = "", timestamp: str = "") -> Dict[str, Any]:
+        """Handle DingTalk webhook event from the raw request body."""
         if not self._client:
             raise RuntimeError("Gateway client not started")
         
-        return await self._client.handle_webhook(event_data, signature, timestamp)
+        return await self._client.handle_webhook(body, signature, timestamp)
@@ -0,0 +1,150 @@
+"""Media spooling and a content-addressed cache of uploaded DingTalk media ids."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Tuple
+
+CHUNK_SIZE = 64 * 1024
+
+Key = Tuple[str, str]  # (media type, sha256 of the content)
+
+
+class MediaTooLargeError(ValueError):
+    """Raised when media exceeds the configured size limit."""
+
+
+class MediaFile:
+    """Media on disk with its content hash, ready to upload."""
+
+    __slots__ = ("path", "digest", "size", "temporary")
+
+    def __init__(self, path: str, digest: str, size: int, temporary: bool) -> None:
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.temporary = temporary  # Spooled by us, removed by discard()
+
+    def discard(self) -> None:
+        if self.temporary:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+async def spool(chunks: AsyncIterator[bytes], max_bytes: int) -> MediaFile:
+    """Write a request body to a temporary file, hashing it on the way.
+
+    Only one chunk is held in memory at a time.
+
+    Raises:
+        MediaTooLargeError: If the body is larger than ``max_bytes``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="dingtalk-media-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise MediaTooLargeError(f"Media larger than {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return MediaFile(path, digest.hexdigest(), size, temporary=True)
+
+
+def _hash_file(path: str, max_bytes: int) -> MediaFile:
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise MediaTooLargeError(f"Media larger than {max_bytes} bytes")
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return MediaFile(path, digest.hexdigest(), size, temporary=False)
+
+
+async def open_file(path: str, max_bytes: int) -> MediaFile:
+    """Hash a file already on disk, off the event loop.
+
+    Raises:
+        MediaTooLargeError: If the file is larger than ``max_bytes``.
+    """
+    return await asyncio.to_thread(_hash_file, path, max_bytes)
+
+
+class MediaCache:
+    """Uploaded media ids keyed by content hash, expiring before DingTalk forgets them.
+
+    When full, expired entries are dropped first and then the least recently
+    used ones.
+    """
+
+    def __init__(self, ttl: float = 86400.0, max_entries: int = 1024) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Key, Tuple[str, float]]" = OrderedDict()  # -> (media_id, expires_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, media_type: str, digest: str) -> str | None:
+        key = (media_type, digest)
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        media_id, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return media_id
+
+    def put(self, media_type: str, digest: str, media_id: str) -> None:
+        key = (media_type, digest)
+        self._entries[key] = (media_id, time.monotonic() + self._ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        self.expired += len(expired)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self._max_entries,
+            "ttl": self._ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
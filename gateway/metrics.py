@@ -0,0 +1,189 @@
+"""Lightweight Prometheus metrics for the gateway hot paths.
+
+Recording is a dict lookup plus an integer increment (histograms add a
+``bisect``), cheap enough to leave on in production. Everything runs on the
+event loop thread, so no locking is needed.
+"""
+
+from __future__ import annotations
+
+import abc
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond local hops to slow API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """Return the exposition lines for this metric, header included."""
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, count in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(count)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._bounds = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = ([0] * (len(self._bounds) + 1), [0.0])
+        series[0][bisect_left(self._bounds, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self._bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.label_names, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose values are read from a callback at scrape time.
+
+    The callback returns a number, or a mapping of label value tuples to numbers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | Dict[LabelValues, float]],
+        labels: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self._callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            value = self._callback()
+        except Exception:
+            return []
+        lines = self.header()
+        items: Iterable = value.items() if isinstance(value, dict) else [((), value)]
+        for values, number in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(number)}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Re-registering a name replaces it (e.g. callbacks of a restarted manager)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+INGEST_LATENCY = REGISTRY.register(Histogram(
+    "dingtalk_gateway_ingest_seconds",
+    "Time from receiving a DingTalk message to publishing it on the broker",
+))
+STREAM_ACK_LATENCY = REGISTRY.register(Histogram(
+    "dingtalk_gateway_stream_ack_seconds",
+    "Time from receiving a Stream callback to acknowledging it",
+))
+DELIVERY_LATENCY = REGISTRY.register(Histogram(
+    "dingtalk_gateway_ws_delivery_seconds",
+    "Time from broker publish to the event being sent on a WebSocket",
+))
+SEND_LATENCY = REGISTRY.register(Histogram(
+    "dingtalk_gateway_send_seconds",
+    "Latency of outbound DingTalk API calls by path",
+    labels=("path",),
+))
+TOKEN_REFRESHES = REGISTRY.register(Counter(
+    "dingtalk_gateway_token_refreshes_total",
+    "Access token fetches by result",
+    labels=("result",),
+))
+API_ERRORS = REGISTRY.register(Counter(
+    "dingtalk_gateway_api_errors_total",
+    "DingTalk API calls that returned a non-zero errcode or failed",
+    labels=("api", "errcode"),
+))
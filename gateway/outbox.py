@@ -0,0 +1,433 @@
+"""Durable SQLite outbox for outgoing messages."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DeliverFunc = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+
+# Most operations the writer thread folds into one transaction (one fsync)
+MAX_GROUP_COMMIT = 512
+
+# Seconds sqlite waits on a lock held by another connection (e.g. another
+# gateway process sharing the file), and how often a batch retries that wait
+BUSY_TIMEOUT = 5.0
+BUSY_RETRIES = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_at);
+"""
+
+# Columns added after the first release, for databases created before them
+_ADDED_COLUMNS = {"owner": "TEXT", "lease_until": "REAL"}
+
+
+class PartialDelivery(Exception):
+    """Raised by a deliver function when only part of a message went out.
+
+    The row is retried (or given up on) as for ``error``, with its payload
+    replaced by ``remaining`` so the part already sent is not sent again.
+    """
+
+    def __init__(self, error: Exception, remaining: Dict[str, Any]) -> None:
+        super().__init__(str(error))
+        self.error = error
+        self.remaining = remaining
+
+
+class _Writer(threading.Thread):
+    """Owns the SQLite connection and applies queued operations with group commit.
+
+    Every operation waiting in the queue when a transaction starts is applied
+    in that transaction, so a burst of enqueues shares a single fsync.
+    """
+
+    def __init__(self, path: str, loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__(name="outbox-writer", daemon=True)
+        self._path = path
+        self._loop = loop
+        self._ops: "queue.Queue[Tuple[Callable[[sqlite3.Connection], Any], asyncio.Future | None] | None]" = queue.Queue()
+        self.commits = 0
+        self.operations = 0
+
+    def submit(self, op: Callable[[sqlite3.Connection], Any]) -> asyncio.Future:
+        future = self._loop.create_future()
+        self._ops.put((op, future))
+        return future
+
+    def stop(self) -> None:
+        self._ops.put(None)
+
+    def run(self) -> None:
+        try:
+            conn = sqlite3.connect(self._path, isolation_level=None, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            _migrate(conn)
+        except sqlite3.Error as e:
+            logger.error("[Outbox] Cannot open %s: %s", self._path, e)
+            self._fail_all(e)
+            return
+        try:
+            while True:
+                item = self._ops.get()
+                if item is None:
+                    return
+                batch = [item]
+                stop = False
+                while len(batch) < MAX_GROUP_COMMIT:
+                    try:
+                        item = self._ops.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._apply(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, batch: List[Tuple[Callable, asyncio.Future | None]]) -> None:
+        """Apply a batch in one transaction; any failure fails its callers, never the thread."""
+        try:
+            results = self._transaction(conn, batch)
+            self.commits += 1
+        except Exception as e:
+            logger.error("[Outbox] Transaction of %d operations failed: %s", len(batch), e)
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass  # sqlite may have rolled back already, e.g. after an I/O error
+            results = [(future, None, e) for _, future in batch]
+        self.operations += len(batch)
+        for future, result, error in results:
+            if future is not None:
+                self._loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def _transaction(
+        self, conn: sqlite3.Connection, batch: List[Tuple[Callable, asyncio.Future | None]],
+    ) -> List[Tuple[asyncio.Future | None, Any, BaseException | None]]:
+        for attempt in range(BUSY_RETRIES):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                # Each attempt already waited BUSY_TIMEOUT for the lock
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                logger.warning("[Outbox] Database busy (attempt %d/%d)", attempt + 1, BUSY_RETRIES)
+        else:
+            raise sqlite3.OperationalError(f"database is locked after {BUSY_RETRIES} attempts")
+        results: List[Tuple[asyncio.Future | None, Any, BaseException | None]] = []
+        for op, future in batch:
+            conn.execute("SAVEPOINT op")
+            try:
+                results.append((future, op(conn), None))
+                conn.execute("RELEASE op")
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                results.append((future, None, e))
+        conn.execute("COMMIT")
+        return results
+
+    def _fail_all(self, error: BaseException) -> None:
+        """Fail every queued and future operation once the connection is unusable."""
+        while True:
+            item = self._ops.get()
+            if item is None:
+                return
+            _, future = item
+            if future is not None:
+                self._loop.call_soon_threadsafe(_resolve, future, None, error)
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+    for name, kind in _ADDED_COLUMNS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE outbox ADD COLUMN {name} {kind}")
+
+
+def _resolve(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Outbox:
+    """Persist outgoing messages and deliver them with retry and jittered backoff.
+
+    Messages are written to SQLite before the caller is answered, so they
+    survive restarts. A pool of workers drains due rows; transient failures
+    are retried with exponential backoff and full jitter, permanent ones (or
+    rows that run out of attempts) are kept with state ``dead``.
+
+    Several processes may share one database. A claimed row carries its
+    owner and a lease the owner renews while it holds the row; only rows
+    whose lease ran out (their owner died) are handed out again.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        deliver: DeliverFunc,
+        workers: int = 4,
+        max_attempts: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        is_transient: Callable[[BaseException], bool] = lambda e: True,
+        lease: float = 60.0,
+    ) -> None:
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease = lease
+        self._deliver = deliver
+        self._worker_count = workers
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._is_transient = is_transient
+
+        self._writer: _Writer | None = None
+        self._jobs: asyncio.Queue | None = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def start(self, run_workers: bool = True) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._writer = _Writer(self.path, asyncio.get_running_loop())
+        self._writer.start()
+        # Rows claimed by a process that died are due again once their lease ran out
+        now = time.time()
+        recovered = await self._writer.submit(lambda conn: _requeue_expired(conn, now))
+        if recovered:
+            logger.info("[Outbox] Recovered %d in-flight messages", recovered)
+        if run_workers:
+            self._jobs = asyncio.Queue(maxsize=self._worker_count * 2)
+            self._tasks.append(asyncio.create_task(self._poll()))
+            self._tasks.append(asyncio.create_task(self._renew_leases()))
+            for _ in range(self._worker_count):
+                self._tasks.append(asyncio.create_task(self._work()))
+        logger.info("[Outbox] Started at %s with %d workers", self.path, self._worker_count)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._writer:
+            # Deliveries were cancelled: hand our rows back without waiting for the lease
+            try:
+                await self._writer.submit(
+                    lambda conn: conn.execute(
+                        "UPDATE outbox SET state='pending', owner=NULL, lease_until=NULL "
+                        "WHERE state='inflight' AND owner=?",
+                        (self.owner,),
+                    )
+                )
+            except sqlite3.Error as e:
+                logger.warning("[Outbox] Releasing in-flight messages failed: %s", e)
+            self._writer.stop()
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        """Durably store a message and return its outbox id."""
+        if self._writer is None:
+            raise RuntimeError("Outbox not started")
+        body = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        row_id = await self._writer.submit(
+            lambda conn: conn.execute(
+                "INSERT INTO outbox (kind, payload, next_at, created_at) VALUES (?, ?, ?, ?)",
+                (kind, body, now, now),
+            ).lastrowid
+        )
+        self.enqueued += 1
+        self._wakeup.set()
+        return row_id
+
+    async def _poll(self) -> None:
+        """Claim due rows and hand them to the workers."""
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            limit = self._worker_count * 2
+            try:
+                rows, next_due = await self._writer.submit(
+                    lambda conn: _claim(conn, now, limit, self.owner, now + self._lease)
+                )
+            except sqlite3.Error as e:
+                logger.warning("[Outbox] Claiming due messages failed, retrying: %s", e)
+                rows, next_due = [], time.time() + 1.0
+            for row in rows:
+                await self._jobs.put(row)
+            if rows:
+                continue
+            timeout = 5.0 if next_due is None else max(0.0, min(5.0, next_due - time.time()))
+            # Not wait_for: on 3.11 it swallows a cancel that lands as the wakeup fires,
+            # and close() would then wait on this loop forever
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    async def _renew_leases(self) -> None:
+        """Extend the lease on every row this process holds, well before it runs out."""
+        while True:
+            await asyncio.sleep(self._lease / 3)
+            until = time.time() + self._lease
+            try:
+                await self._writer.submit(
+                    lambda conn: conn.execute(
+                        "UPDATE outbox SET lease_until=? WHERE state='inflight' AND owner=?",
+                        (until, self.owner),
+                    )
+                )
+            except sqlite3.Error as e:
+                logger.warning("[Outbox] Renewing leases failed: %s", e)
+
+    async def _work(self) -> None:
+        while True:
+            row_id, kind, body, attempts = await self._jobs.get()
+            try:
+                await self._deliver(kind, json.loads(body))
+            except asyncio.CancelledError:
+                raise
+            except PartialDelivery as e:
+                await self._failed(row_id, attempts + 1, e.error, e.remaining)
+            except Exception as e:
+                await self._failed(row_id, attempts + 1, e)
+            else:
+                self.delivered += 1
+                try:
+                    await self._writer.submit(
+                        lambda conn: conn.execute("DELETE FROM outbox WHERE id=?", (row_id,))
+                    )
+                except sqlite3.Error as e:
+                    # The row's lease runs out and it is sent again: at least once
+                    logger.error("[Outbox] Could not remove delivered message %d: %s", row_id, e)
+
+    async def _failed(
+        self, row_id: int, attempts: int, error: Exception, remaining: Dict[str, Any] | None = None
+    ) -> None:
+        # Only the unsent part of a partly delivered message is kept
+        body = json.dumps(remaining, ensure_ascii=False) if remaining is not None else None
+        if self._is_transient(error) and attempts < self._max_attempts:
+            delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempts))
+            self.retried += 1
+            logger.warning(
+                "[Outbox] Message %d failed (attempt %d), retrying in %.1fs: %s", row_id, attempts, delay, error,
+            )
+            op = lambda conn: conn.execute(  # noqa: E731
+                "UPDATE outbox SET state='pending', attempts=?, next_at=?, last_error=?, "
+                "payload=COALESCE(?, payload) WHERE id=?",
+                (attempts, time.time() + delay, str(error), body, row_id),
+            )
+        else:
+            self.dead += 1
+            logger.error("[Outbox] Message %d failed permanently after %d attempts: %s", row_id, attempts, error)
+            op = lambda conn: conn.execute(  # noqa: E731
+                "UPDATE outbox SET state='dead', attempts=?, last_error=?, payload=COALESCE(?, payload) WHERE id=?",
+                (attempts, str(error), body, row_id),
+            )
+        try:
+            await self._writer.submit(op)
+        except sqlite3.Error as e:
+            # The row stays in flight and is retried once its lease runs out
+            logger.error("[Outbox] Could not record failure of message %d: %s", row_id, e)
+        self._wakeup.set()
+
+    async def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        if self._writer is not None:
+            rows = await self._writer.submit(
+                lambda conn: conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall()
+            )
+            counts = dict(rows)
+        return {
+            "pending": counts.get("pending", 0),
+            "inflight": counts.get("inflight", 0),
+            "dead": counts.get("dead", 0),
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.dead,
+            "commits": self._writer.commits if self._writer else 0,
+            "operations": self._writer.operations if self._writer else 0,
+        }
+
+
+def _requeue_expired(conn: sqlite3.Connection, now: float) -> int:
+    # Rows from before leases existed have none
+    return conn.execute(
+        "UPDATE outbox SET state='pending', owner=NULL, lease_until=NULL "
+        "WHERE state='inflight' AND (lease_until IS NULL OR lease_until<?)",
+        (now,),
+    ).rowcount
+
+
+def _claim(
+    conn: sqlite3.Connection, now: float, limit: int, owner: str, lease_until: float,
+) -> Tuple[List[tuple], float | None]:
+    requeued = _requeue_expired(conn, now)
+    if requeued:
+        logger.warning("[Outbox] Requeued %d messages whose owner's lease expired", requeued)
+    rows = conn.execute(
+        "SELECT id, kind, payload, attempts FROM outbox WHERE state='pending' AND next_at<=? "
+        "ORDER BY next_at LIMIT ?",
+        (now, limit),
+    ).fetchall()
+    if rows:
+        conn.executemany(
+            "UPDATE outbox SET state='inflight', owner=?, lease_until=? WHERE id=?",
+            [(owner, lease_until, row[0]) for row in rows],
+        )
+        return rows, None
+    # Wake up for the next due row, or to take over a row whose lease runs out
+    next_due = conn.execute(
+        "SELECT MIN(CASE state WHEN 'pending' THEN next_at ELSE lease_until END) "
+        "FROM outbox WHERE state IN ('pending', 'inflight')"
+    ).fetchone()[0]
+    return rows, next_due
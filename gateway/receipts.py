@@ -0,0 +1,226 @@
+"""Delivery status of asynchronously sent messages."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Set
+
+logger = logging.getLogger(__name__)
+
+# Message states, in the order they are normally reached
+ACCEPTED = "accepted"  # Answered 202, send not finished yet
+QUEUED = "queued"  # Stored in the durable outbox
+SENT = "sent"  # Work notification accepted by DingTalk, awaiting the send result
+DELIVERED = "delivered"  # Reached the user
+READ = "read"
+FAILED = "failed"
+
+FINAL_STATES = (READ, FAILED)
+
+FetchResult = Callable[[int], Awaitable[Dict[str, Any]]]
+Publish = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class MessageStatus:
+    __slots__ = (
+        "message_id", "kind", "target", "status", "created_at", "updated_at",
+        "path", "task_id", "task_ids", "error", "trace_id",
+    )
+
+    def __init__(self, message_id: str, kind: str, target: str, trace_id: str | None) -> None:
+        self.message_id = message_id
+        self.kind = kind
+        self.target = target
+        self.status = ACCEPTED
+        self.created_at = self.updated_at = time.time()
+        self.path: str | None = None
+        self.task_id: int | None = None
+        self.task_ids: List[int] = []  # Every task of a send split into several calls
+        self.error: str | None = None
+        self.trace_id = trace_id
+
+    def asdict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class DeliveryTracker:
+    """Track async sends and poll DingTalk for work notification results.
+
+    Messages sent as work notifications are grouped by ``task_id`` (the
+    notification batcher merges identical messages into one task), and each
+    poll round issues one ``getsendresult`` call per task rather than per
+    message. A send to more users than one call takes spans several tasks;
+    its status comes from their results merged. A message is polled until DingTalk reports it read or failed,
+    or ``max_poll_age`` seconds after it was sent; it then stays delivered
+    if it got that far and fails otherwise. Every status change is handed
+    to ``publish`` as a receipt.
+    """
+
+    def __init__(
+        self,
+        fetch_result: FetchResult,
+        publish: Publish,
+        poll_interval: float = 5.0,
+        max_poll_age: float = 600.0,
+        max_entries: int = 10_000,
+    ) -> None:
+        self._fetch_result = fetch_result
+        self._publish = publish
+        self._poll_interval = poll_interval
+        self._max_poll_age = max_poll_age
+        self._max_entries = max_entries
+        self._messages: "OrderedDict[str, MessageStatus]" = OrderedDict()
+        self._pending: Dict[int, Dict[str, float]] = {}  # task_id -> {message id: sent at}
+        self._results: Dict[int, Dict[str, Any]] = {}  # task_id -> latest send result
+        self._wakeup = asyncio.Event()
+        self._poller: asyncio.Task | None = None
+
+        self.polls = 0
+        self.poll_errors = 0
+
+    def start(self) -> None:
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+
+    async def close(self) -> None:
+        if self._poller and not self._poller.done():
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+        self._poller = None
+
+    def create(self, kind: str, target: str, trace_id: str | None = None) -> MessageStatus:
+        message = MessageStatus(uuid.uuid4().hex, kind, target, trace_id)
+        self._messages[message.message_id] = message
+        while len(self._messages) > self._max_entries:
+            _, evicted = self._messages.popitem(last=False)
+            self._forget(evicted)
+        return message
+
+    def get(self, message_id: str) -> MessageStatus | None:
+        return self._messages.get(message_id)
+
+    async def update(self, message_id: str, status: str, **fields: Any) -> None:
+        """Move a message to ``status`` and publish a receipt."""
+        message = self._messages.get(message_id)
+        if message is None or message.status in FINAL_STATES or message.status == status:
+            return
+        message.status = status
+        message.updated_at = time.time()
+        for name, value in fields.items():
+            setattr(message, name, value)
+        if status == SENT and _tasks(message):
+            sent_at = time.monotonic()
+            for task_id in _tasks(message):
+                self._pending.setdefault(task_id, {})[message_id] = sent_at
+            self._wakeup.set()
+        await self._publish({"event_type": "delivery_receipt", **message.asdict()})
+
+    def _forget(self, message: MessageStatus) -> None:
+        for task_id in _tasks(message):
+            ids = self._pending.get(task_id)
+            if ids is not None:
+                ids.pop(message.message_id, None)
+                if not ids:
+                    del self._pending[task_id]
+                    self._results.pop(task_id, None)
+
+    async def _poll_loop(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # Give DingTalk time to process the send before asking
+            await asyncio.sleep(self._poll_interval)
+            for task_id in list(self._pending):
+                await self._poll_task(task_id)
+
+    async def _poll_task(self, task_id: int) -> None:
+        self.polls += 1
+        try:
+            result = await self._fetch_result(task_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.poll_errors += 1
+            logger.warning("[Receipts] getsendresult failed for task %s: %s", task_id, e)
+        else:
+            self._results[task_id] = result
+
+        now = time.monotonic()
+        waiting = self._pending.get(task_id, {})
+        for message_id, sent_at in list(waiting.items()):
+            message = self._messages.get(message_id)
+            if message is None:  # Evicted while a receipt was being published
+                continue
+            results = [self._results[t] for t in _tasks(message) if t in self._results]
+            status = _target_status(_merge_results(results), message.target) if results else None
+            error = "rejected by DingTalk" if status == FAILED else None
+            done = status in FINAL_STATES
+            if not done and now - sent_at > self._max_poll_age:
+                done = True
+                if status is None and message.status != DELIVERED:
+                    status, error = FAILED, "no send result"
+            if done:
+                self._forget(message)
+            if status is not None:
+                await self.update(message_id, status, error=error)
+        if not waiting:
+            self._pending.pop(task_id, None)
+            self._results.pop(task_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for message in self._messages.values():
+            counts[message.status] = counts.get(message.status, 0) + 1
+        return {
+            "tracked": len(self._messages),
+            "by_status": counts,
+            "pending_tasks": len(self._pending),
+            "polls": self.polls,
+            "poll_errors": self.poll_errors,
+        }
+
+
+def _tasks(message: MessageStatus) -> List[int]:
+    if message.task_ids:
+        return message.task_ids
+    return [message.task_id] if message.task_id is not None else []
+
+
+def _merge_results(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Concatenate the user lists of several ``getsendresult`` answers."""
+    merged: Dict[str, list] = {}
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+    return merged
+
+
+def _target_status(send_result: Dict[str, Any], target: str) -> str | None:
+    """Status of ``target`` in a ``getsendresult`` answer, or ``None`` if not known yet.
+
+    ``target`` may list several comma-separated users: the message is read
+    once all of them read it, and failed if any of them could not get it.
+    """
+    def users(key: str) -> Set[str]:
+        # forbidden_list holds {"userid": ..., "code": ...} objects
+        return {u.get("userid") if isinstance(u, dict) else u for u in send_result.get(key) or ()}
+
+    targets = {part.strip() for part in target.split(",") if part.strip()}
+    failed = users("failed_user_id_list") | users("forbidden_list") | users("invalid_user_id_list")
+    if targets & failed:
+        return FAILED
+    read = users("read_user_id_list")
+    if targets <= read:
+        return READ
+    if targets <= read | users("unread_user_id_list"):
+        return DELIVERED
+    return None
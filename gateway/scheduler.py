@@ -0,0 +1,234 @@
+"""Quota-aware scheduling for outbound DingTalk requests."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List
+
+# Lower value is served first
+PRIORITIES: Dict[str, int] = {"high": 0, "normal": 1, "low": 2}
+
+# Idle session webhook buckets are pruned once there are more than this many
+MAX_IDLE_BUCKETS = 1000
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` tokens per second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def level(self, now: float) -> float:
+        """Tokens currently available."""
+        self._refill(now)
+        return self.tokens
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "family", "key", "future", "enqueued")
+
+    def __init__(self, priority: int, seq: int, family: str, key: str | None, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.family = family
+        self.key = key
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Gate outbound requests on per-API-family and per-session-webhook token buckets.
+
+    Waiting requests are served in priority order. A request only holds back
+    lower-priority requests that need the same bucket, so a throttled session
+    webhook never stalls work notifications to other users.
+    """
+
+    def __init__(self, api_qps: float = 20.0, webhook_per_minute: float = 20.0) -> None:
+        self._api_qps = api_qps
+        self._webhook_rate = webhook_per_minute / 60
+        self._webhook_capacity = webhook_per_minute
+        self._families: Dict[str, TokenBucket] = {}
+        self._webhooks: Dict[str, TokenBucket] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+        self._granted = 0
+        self._delayed = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _buckets(self, family: str, key: str | None) -> List[TokenBucket]:
+        bucket = self._families.get(family)
+        if bucket is None:
+            bucket = self._families[family] = TokenBucket(self._api_qps, self._api_qps)
+        if key is None:
+            return [bucket]
+        webhook_bucket = self._webhooks.get(key)
+        if webhook_bucket is None:
+            if len(self._webhooks) >= MAX_IDLE_BUCKETS:
+                self._prune()
+            webhook_bucket = self._webhooks[key] = TokenBucket(self._webhook_rate, self._webhook_capacity)
+        return [bucket, webhook_bucket]
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, b in self._webhooks.items() if b.is_full(now)]:
+            del self._webhooks[key]
+
+    async def acquire(
+        self,
+        family: str,
+        key: str | None = None,
+        priority: str = "normal",
+        timeout: float | None = None,
+    ) -> float:
+        """Wait for a send slot and return the seconds spent waiting.
+
+        Args:
+            family: API family the request belongs to (e.g. ``work_notification``)
+            key: Optional per-destination bucket key such as a session webhook URL
+            priority: ``high``, ``normal`` or ``low``
+            timeout: Give up after this many seconds (raises ``asyncio.TimeoutError``)
+        """
+        buckets = self._buckets(family, key)
+        now = time.monotonic()
+        if not self._queue and all(b.wait_time(now) <= 0 for b in buckets):
+            for bucket in buckets:
+                bucket.take()
+            self._granted += 1
+            return 0.0
+
+        waiter = _Waiter(
+            PRIORITIES.get(priority, PRIORITIES["normal"]),
+            next(self._seq),
+            family,
+            key,
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._queue, waiter)
+        self._delayed += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        finally:
+            if not waiter.future.done():
+                # Timed out or cancelled: the dispatcher skips cancelled waiters,
+                # and may now grant buckets this waiter held back from others
+                waiter.future.cancel()
+                self._wakeup.set()
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            self._wakeup.clear()
+            now = time.monotonic()
+            blocked: set[int] = set()
+            next_wake: float | None = None
+            remaining: List[_Waiter] = []
+
+            for waiter in sorted(self._queue):
+                if waiter.future.done():
+                    continue
+                buckets = self._buckets(waiter.family, waiter.key)
+                if any(id(b) in blocked for b in buckets):
+                    remaining.append(waiter)
+                    continue
+                wait = max(b.wait_time(now) for b in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.take()
+                    waited = now - waiter.enqueued
+                    self._granted += 1
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+                    waiter.future.set_result(waited)
+                else:
+                    # Reserve the empty buckets for the higher-priority waiter; ones
+                    # with tokens left (e.g. the shared webhook family) stay usable
+                    blocked.update(id(b) for b in buckets if b.wait_time(now) > 0)
+                    next_wake = wait if next_wake is None else min(next_wake, wait)
+                    remaining.append(waiter)
+
+            self._queue = remaining
+            heapq.heapify(self._queue)
+            if not self._queue:
+                break
+            # Not wait_for, which on 3.11 can swallow the cancel from close()
+            try:
+                async with asyncio.timeout(next_wake):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, wait times and bucket levels for tuning."""
+        by_priority = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for waiter in self._queue:
+            if not waiter.future.done():
+                by_priority[names[waiter.priority]] += 1
+        now = time.monotonic()
+        return {
+            "queue_depth": sum(by_priority.values()),
+            "queue_by_priority": by_priority,
+            "granted": self._granted,
+            "delayed": self._delayed,
+            "timeouts": self._timeouts,
+            "wait_ms_avg": round(self._wait_total / self._delayed * 1000, 2) if self._delayed else 0.0,
+            "wait_ms_max": round(self._wait_max * 1000, 2),
+            "family_tokens": {
+                family: round(bucket.level(now), 2) for family, bucket in self._families.items()
+            },
+            "webhook_buckets": len(self._webhooks),
+        }
+
+    async def close(self) -> None:
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        for waiter in self._queue:
+            if not waiter.future.done():
+                waiter.future.cancel()
+        self._queue.clear()
@@ -0,0 +1,33 @@
+"""JSON encoding helpers using the fastest available backend."""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:  # Optional fast path
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+if orjson is not None:
+
+    def dumps(obj: Any) -> str:
+        """Encode ``obj`` as compact JSON text."""
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+else:
+
+    def dumps(obj: Any) -> str:
+        """Encode ``obj`` as compact JSON text."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+BACKEND = "orjson" if orjson is not None else "json"
@@ -0,0 +1,190 @@
+"""Per-message tracing with an in-memory ring of recent traces.
+
+Every incoming message gets a trace id, carried on the event so a reply
+sent with the same ``trace_id`` can be linked to its trigger. Only sampled
+traces record spans; with sampling off, the cost per message is generating
+the id and a few no-op calls.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Tuple
+
+# Most spans kept per trace, so a trace fanned out to many subscribers stays small
+MAX_SPANS = 64
+
+_current: ContextVar["Trace | None"] = ContextVar("dingtalk_gateway_trace", default=None)
+
+
+def new_trace_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Trace:
+    __slots__ = ("trace_id", "kind", "started_at", "_origin", "attrs", "spans")
+
+    def __init__(self, trace_id: str, kind: str, origin: float, attrs: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.kind = kind
+        self.started_at = time.time() - (time.perf_counter() - origin)
+        self._origin = origin  # perf_counter() at the start of the trace
+        self.attrs = attrs
+        self.spans: List[Tuple[str, float, float, Dict[str, Any]]] = []
+
+    def add_span(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        """Record a span given ``time.perf_counter()`` start and end."""
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((name, start, end, attrs))
+
+    def asdict(self) -> Dict[str, Any]:
+        end = max((span[2] for span in self.spans), default=self._origin)
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "started_at": round(self.started_at, 6),
+            "duration_ms": round((end - self._origin) * 1000, 3),
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": round((start - self._origin) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3),
+                    **attrs,
+                }
+                for name, start, end, attrs in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ("_trace", "_name", "_attrs", "_start")
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]) -> None:
+        self._trace = trace
+        self._name = name
+        self._attrs = attrs
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self._attrs["error"] = exc_type.__name__
+        self._trace.add_span(self._name, self._start, time.perf_counter(), **self._attrs)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Use:
+    """Make a trace current for the enclosed block (and tasks created in it)."""
+
+    __slots__ = ("_trace", "_token")
+
+    def __init__(self, trace: Trace | None) -> None:
+        self._trace = trace
+
+    def __enter__(self) -> Trace | None:
+        self._token = _current.set(self._trace)
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+
+
+def span(name: str, **attrs: Any) -> _Span | _NullSpan:
+    """Time the enclosed block as a span of the current trace, if any."""
+    trace = _current.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, attrs)
+
+
+def use(trace: Trace | None) -> _Use:
+    return _Use(trace)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+class Tracer:
+    """Sampler and fixed-size ring of recent traces."""
+
+    def __init__(self, sample_rate: float = 0.0, capacity: int = 256) -> None:
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self.started = 0
+        self.sampled = 0
+
+    def configure(self, sample_rate: float, capacity: int) -> None:
+        self.sample_rate = sample_rate
+        self.capacity = max(1, capacity)
+        while len(self._traces) > self.capacity:
+            self._traces.popitem(last=False)
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self, kind: str, trace_id: str | None = None, origin: float | None = None, **attrs: Any) -> Tuple[str, Trace | None]:
+        """Begin (or join) a trace.
+
+        Returns the trace id, and the trace if it is being recorded. A known
+        ``trace_id`` joins that trace, e.g. a reply joining the message that
+        triggered it.
+        """
+        self.started += 1
+        if trace_id:
+            trace = self._traces.get(trace_id)
+            if trace is not None:
+                return trace_id, trace
+        else:
+            trace_id = new_trace_id()
+        if not self.enabled or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return trace_id, None
+        self.sampled += 1
+        trace = Trace(trace_id, kind, origin or time.perf_counter(), attrs)
+        self._traces[trace_id] = trace
+        if len(self._traces) > self.capacity:
+            self._traces.popitem(last=False)
+        return trace_id, trace
+
+    def get(self, trace_id: str | None) -> Trace | None:
+        if not trace_id or not self._traces:
+            return None
+        return self._traces.get(trace_id)
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Recorded traces, newest first."""
+        traces = list(self._traces.values())[-limit:] if limit > 0 else []
+        return [trace.asdict() for trace in reversed(traces)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "capacity": self.capacity,
+            "buffered": len(self._traces),
+            "started": self.started,
+            "sampled": self.sampled,
+        }
+
+
+TRACER = Tracer()
@@ -17,6 +17,10 @@ if bashio::config.has_value 'webhook_secret'; then
     export DINGTALK_WEBHOOK_SECRET=$(bashio::config 'webhook_secret')
 fi
 
+if bashio::config.true 'durable_outbox'; then
+    export GATEWAY_OUTBOX_PATH=/data/outbox.db
+fi
+
 # Fixed settings for addon environment
 export GATEWAY_HOST=0.0.0.0
 export GATEWAY_PORT=8099
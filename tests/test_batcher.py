@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from gateway.batcher import NotificationBatcher, PartialSendError
+
+MSG = {"msgtype": "text", "text": {"content": "hi"}}
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, userid_list, msg, priority):
+        self.calls.append(userid_list)
+        task_id = len(self.calls)
+        await asyncio.sleep(0)
+        return {"task_id": task_id}
+
+
+def test_send_without_wait_skips_the_window():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=10)
+        result = await asyncio.wait_for(batcher.submit("alice", MSG, wait=False), 1)
+        assert result == {"task_id": 1}
+
+    asyncio.run(main())
+    assert send.calls == ["alice"]
+
+
+def test_send_without_wait_takes_an_open_batch_along():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=10)
+        waiting = asyncio.ensure_future(batcher.submit("alice", MSG))
+        await asyncio.sleep(0)
+        results = await asyncio.wait_for(asyncio.gather(waiting, batcher.submit("bob", MSG, wait=False)), 1)
+        assert results == [{"task_id": 1}, {"task_id": 1}]
+
+    asyncio.run(main())
+    assert send.calls == ["alice,bob"]
+
+
+class FailingChunks(Recorder):
+    """Fails every call that carries one of ``bad`` user ids."""
+
+    def __init__(self, bad):
+        super().__init__()
+        self.bad = bad
+
+    async def __call__(self, userid_list, msg, priority):
+        result = await super().__call__(userid_list, msg, priority)
+        if self.bad & set(userid_list.split(",")):
+            raise ConnectionError("HTTP 502")
+        return result
+
+
+def test_identical_sends_in_one_window_share_a_call():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit("alice", MSG), batcher.submit("bob, carol", MSG), batcher.submit("alice", MSG, "high"),
+        )
+        assert results[0] == results[1]
+        assert results[0] != results[2]  # Different priority: never merged
+
+    asyncio.run(main())
+    assert sorted(send.calls) == ["alice", "alice,bob,carol"]
+
+
+def test_repeated_user_starts_a_new_batch():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=0.01)
+        await asyncio.gather(batcher.submit("alice", MSG), batcher.submit("alice,bob", MSG))
+
+    asyncio.run(main())
+    assert send.calls == ["alice", "alice,bob"]
+
+
+def test_large_send_is_split_into_calls_of_max_targets():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=0.01, max_targets=2)
+        return await batcher.submit("a,b,c,d,e", MSG)
+
+    result = asyncio.run(main())
+    assert sorted(send.calls) == ["a,b", "c,d", "e"]
+    assert sorted(result["task_ids"]) == [1, 2, 3]
+
+
+def test_partly_failed_split_send_names_the_users_not_reached():
+    send = FailingChunks({"c"})
+
+    async def main():
+        batcher = NotificationBatcher(send, window=0.01, max_targets=2)
+        with pytest.raises(PartialSendError) as raised:
+            await batcher.submit("a,b,c,d,e", MSG)
+        return raised.value
+
+    error = asyncio.run(main())
+    assert error.failed_targets == ["c", "d"]
+    assert len(error.results) == 2
+    assert isinstance(error.error, ConnectionError)
+
+
+def test_wholly_failed_split_send_raises_the_error_itself():
+    send = FailingChunks({"a", "c"})
+
+    async def main():
+        batcher = NotificationBatcher(send, window=0.01, max_targets=2)
+        with pytest.raises(ConnectionError):
+            await batcher.submit("a,b,c,d", MSG)
+
+    asyncio.run(main())
+
+
+def test_close_sends_what_is_pending():
+    send = Recorder()
+
+    async def main():
+        batcher = NotificationBatcher(send, window=10)
+        waiting = asyncio.ensure_future(batcher.submit("alice", MSG))
+        await asyncio.sleep(0)
+        await batcher.close()
+        assert (await waiting) == {"task_id": 1}
+
+    asyncio.run(main())
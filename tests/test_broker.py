@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+from gateway.broker import COALESCE, DISCONNECT, DROP_NEWEST, MessageBroker, SlowConsumerError
+from gateway.filters import EventFilter
+
+
+def message(n, sender="alice", room_id=None):
+    return {"event_type": "incoming_message", "msg_id": f"m{n}", "sender": sender, "room_id": room_id}
+
+
+async def attached(capacity):
+    broker = MessageBroker(capacity=capacity)
+    broker.attach_loop(asyncio.get_running_loop())
+    return broker
+
+
+async def drain(subscription):
+    events = []
+    while subscription.lag:
+        events.append((await subscription.get())["msg_id"])
+    return events
+
+
+def test_drop_newest_keeps_the_oldest_events():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe(policy=DROP_NEWEST, max_lag=2)
+        for n in range(5):
+            broker.publish(message(n))
+        assert await drain(subscription) == ["m0", "m1"]
+        assert subscription.dropped == 3
+
+    asyncio.run(main())
+
+
+def test_coalesce_keeps_the_newest_event_per_conversation():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe(policy=COALESCE, max_lag=2)
+        for n, room in enumerate(["a", "b", "a", "b", "a"]):
+            broker.publish(message(n, room_id=room))
+        assert await drain(subscription) == ["m3", "m4"]
+
+    asyncio.run(main())
+
+
+def test_disconnect_policy_closes_after_max_drops():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe(
+            event_filter=EventFilter(senders=frozenset({"alice"})), policy=DISCONNECT, max_lag=2, max_drops=1,
+        )
+        for n in range(4):
+            broker.publish(message(n))
+        assert subscription.closed
+        with pytest.raises(SlowConsumerError):
+            await subscription.get()
+
+    asyncio.run(main())
+
+
+def test_idle_subscriber_with_unread_events_is_evicted():
+    async def main():
+        broker = await attached(16)
+        idle = await broker.subscribe()
+        caught_up = await broker.subscribe()
+        broker.publish(message(0))
+        await caught_up.get()
+        idle.last_read -= 60
+        caught_up.last_read -= 60
+
+        # A caught-up reader holds nothing unread, so only the idle one goes
+        assert broker.evict_slow_consumers(idle_timeout=30) == 1
+        assert idle.closed and not caught_up.closed
+        with pytest.raises(SlowConsumerError):
+            await idle.get()
+        assert broker.evicted == 1
+
+    asyncio.run(main())
+
+
+def test_filtered_subscription_skips_other_events():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe(event_filter=EventFilter(senders=frozenset({"bob"})))
+        broker.publish(message(0, sender="alice"))
+        broker.publish(message(1, sender="bob"))
+        broker.publish({"event_type": "delivery_receipt", "message_id": "x"})
+        assert await drain(subscription) == ["m1"]
+
+    asyncio.run(main())
+
+
+def test_reader_overtaken_by_the_ring_counts_drops():
+    async def main():
+        broker = await attached(4)
+        subscription = await broker.subscribe()
+        for n in range(7):
+            broker.publish(message(n))
+        assert await drain(subscription) == ["m3", "m4", "m5", "m6"]
+        assert subscription.dropped == 3
+
+    asyncio.run(main())
+
+
+def test_waiting_reader_wakes_on_publish():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe()
+        reader = asyncio.create_task(subscription.get())
+        await asyncio.sleep(0)
+        broker.publish(message(0))
+        assert (await asyncio.wait_for(reader, 1))["msg_id"] == "m0"
+
+    asyncio.run(main())
+
+
+def test_event_ids_carry_the_broker_epoch():
+    async def main():
+        broker = await attached(16)
+        event = message(0)
+        broker.publish(event)
+        assert event["event_id"] == f"{broker.epoch}-1" == broker.last_event_id
+        assert MessageBroker().epoch != broker.epoch
+
+    asyncio.run(main())
+
+
+def test_replay_resumes_after_an_id_of_the_same_epoch():
+    async def main():
+        broker = await attached(4)
+        for n in range(6):
+            broker.publish(message(n))
+        epoch = broker.epoch
+        assert await drain(await broker.subscribe(last_event_id=f"{epoch}-4")) == ["m4", "m5"]
+        # Older than the ring: everything still buffered
+        assert await drain(await broker.subscribe(last_event_id=f"{epoch}-0")) == ["m2", "m3", "m4", "m5"]
+        # Caught up, or ahead of this worker: nothing to replay
+        assert await drain(await broker.subscribe(last_event_id=f"{epoch}-6")) == []
+        assert await drain(await broker.subscribe(last_event_id=f"{epoch}-99")) == []
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("last_event_id", ["0123abcd-4", "2"])
+def test_id_of_another_epoch_replays_everything_buffered(last_event_id):
+    async def main():
+        broker = await attached(4)
+        for n in range(6):
+            broker.publish(message(n))
+        assert await drain(await broker.subscribe(last_event_id=last_event_id)) == ["m2", "m3", "m4", "m5"]
+
+    asyncio.run(main())
+
+
+def test_malformed_event_id_is_rejected():
+    async def main():
+        broker = await attached(4)
+        with pytest.raises(ValueError):
+            await broker.subscribe(last_event_id="abc")
+
+    asyncio.run(main())
+
+
+def test_assigned_ids_of_a_new_epoch_start_a_new_range():
+    async def main():
+        broker = await attached(16)
+        subscription = await broker.subscribe()
+        await broker.async_publish(message(0), event_id="aaaa-7")
+        await broker.async_publish(message(1), event_id="aaaa-7")  # Already published
+        await broker.async_publish(message(2), event_id="bbbb-1")
+        assert broker.last_event_id == "bbbb-1"
+        assert await drain(subscription) == ["m0", "m2"]
+        assert await drain(await broker.subscribe(last_event_id="aaaa-7")) == ["m2"]
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import asyncio
+
+from gateway import bus
+from gateway.bus import UnixSocketBus
+
+
+async def wait_for(predicate, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+class Worker:
+    """One bus member with the event log a manager would keep."""
+
+    def __init__(self, path, on_leadership=None):
+        self.bus = UnixSocketBus(path)
+        self.events = []
+        self.last_event_id = "0000-0"
+        self._on_leadership = on_leadership
+
+    async def start(self):
+        async def on_event(envelope):
+            self.events.append((envelope["epoch"], envelope["seq"], envelope["event"]["n"]))
+            self.last_event_id = f"{envelope['epoch']}-{envelope['seq']}"
+
+        async def on_leadership(leader):
+            if self._on_leadership:
+                await self._on_leadership(leader)
+
+        async def on_request(request):
+            return {"answered_by": self.bus.node_id, **request}
+
+        await self.bus.start(on_event, on_leadership, lambda: self.last_event_id, on_request=on_request)
+
+
+def test_failed_takeover_steps_down_and_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(bus, "RETRY_DELAY", 0.01)
+    calls = []
+
+    async def on_leadership(leader):
+        calls.append(leader)
+        if calls == [True]:
+            raise RuntimeError("outbox unavailable")
+
+    async def main():
+        worker = Worker(str(tmp_path / "bus.sock"), on_leadership)
+        await worker.start()
+        await wait_for(lambda: worker.bus.is_leader)
+        assert calls == [True, False, True]
+        await worker.bus.close()
+
+    asyncio.run(main())
+
+
+def test_followers_share_the_leaders_sequence(tmp_path):
+    path = str(tmp_path / "bus.sock")
+
+    async def main():
+        leader = Worker(path)
+        leader.last_event_id = "abcd-7"
+        await leader.start()
+        await wait_for(lambda: leader.bus.is_leader)
+        follower = Worker(path)
+        await follower.start()
+        await wait_for(lambda: follower.bus._upstream is not None)
+
+        await follower.bus.publish({"event": {"n": 1}})
+        await wait_for(lambda: leader.events)
+        await leader.bus.publish({"event": {"n": 2}})
+        await wait_for(lambda: len(follower.events) == 2)
+        assert leader.events == follower.events == [("abcd", 8, 1), ("abcd", 9, 2)]
+
+        response = await follower.bus.call({"op": "ping"})
+        assert response == {"answered_by": leader.bus.node_id, "op": "ping"}
+
+        # The follower takes over and continues the epoch and sequence
+        await leader.bus.close()
+        await wait_for(lambda: follower.bus.is_leader)
+        await follower.bus.publish({"event": {"n": 3}})
+        assert follower.events[-1] == ("abcd", 10, 3)
+        await follower.bus.close()
+
+    asyncio.run(main())
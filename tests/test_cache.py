@@ -0,0 +1,62 @@
+from gateway import cache
+from gateway.cache import SessionWebhookCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def expiring(clock, seconds):
+    return int((clock.now + seconds) * 1000)
+
+
+def test_user_and_conversation_ids_resolve_to_their_webhooks(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    webhooks = SessionWebhookCache()
+    webhooks.put("alice", "cid-direct", "https://direct", expiring(clock, 60), is_group=False)
+    webhooks.put("alice", "cid-group", "https://group-alice", expiring(clock, 60), is_group=True)
+    webhooks.put("bob", "cid-group", "https://group-bob", expiring(clock, 60), is_group=True)
+
+    assert webhooks.lookup("alice") == "https://direct"
+    assert webhooks.lookup("cid-group") == "https://group-bob"  # Newest webhook of the conversation
+    assert webhooks.lookup("alice", "cid-group") == "https://group-alice"
+    assert webhooks.lookup("carol") is None
+    assert (webhooks.hits, webhooks.misses) == (3, 1)
+
+
+def test_expired_webhooks_are_not_used(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    webhooks = SessionWebhookCache()
+    webhooks.put("alice", "cid1", "https://old", expiring(clock, -1), is_group=False)
+    assert len(webhooks) == 0  # Already expired when stored
+
+    webhooks.put("alice", "cid1", "https://live", expiring(clock, 60), is_group=False)
+    webhooks.put("bob", "cid2", "https://bob", expiring(clock, 120), is_group=False)
+    clock.now += 61
+    assert webhooks.lookup("alice") is None
+    assert webhooks.expired == 1
+    clock.now += 60
+    assert webhooks.sweep() == 1
+    assert len(webhooks) == 0
+
+
+def test_least_recently_used_webhook_is_evicted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    webhooks = SessionWebhookCache(max_entries=2)
+    webhooks.put("alice", "cid1", "https://alice", expiring(clock, 60), is_group=False)
+    webhooks.put("bob", "cid2", "https://bob", expiring(clock, 60), is_group=False)
+    assert webhooks.lookup("alice")  # bob is now the least recently used
+    webhooks.put("carol", "cid3", "https://carol", expiring(clock, 60), is_group=False)
+
+    assert webhooks.lookup("bob") is None
+    assert webhooks.lookup("cid2") is None  # The conversation index went with it
+    assert webhooks.lookup("alice") == "https://alice"
+    assert webhooks.lookup("carol") == "https://carol"
+    assert webhooks.evictions == 1
@@ -0,0 +1,78 @@
+from gateway import dedup
+from gateway.dedup import MessageDeduplicator
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_repeated_id_is_a_duplicate():
+    seen = MessageDeduplicator()
+    assert not seen.seen("m1")
+    assert seen.seen("m1")
+    assert not seen.seen("m2")
+    assert (seen.checked, seen.duplicates) == (3, 1)
+
+
+def test_missing_id_is_never_a_duplicate():
+    seen = MessageDeduplicator()
+    assert not seen.seen(None)
+    assert not seen.seen("")
+    assert not seen.seen("")
+    assert len(seen) == 0
+
+
+def test_remembered_id_is_a_duplicate_without_being_counted():
+    seen = MessageDeduplicator()
+    seen.remember("m1")
+    seen.remember(None)
+    assert seen.checked == 0
+    assert seen.seen("m1")
+
+
+def test_ids_expire_after_two_windows(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    seen = MessageDeduplicator(window=10)
+    seen.seen("m1")
+    clock.now += 15  # Rotated once: m1 is in the previous generation
+    assert seen.seen("m1")
+    seen.seen("m2")
+    clock.now += 10  # Rotated again: m2 moves to the previous generation
+    assert seen.seen("m2")
+    clock.now += 10
+    assert not seen.seen("m2")
+
+
+def test_idle_gap_clears_both_generations(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    seen = MessageDeduplicator(window=10)
+    seen.seen("m1")
+    clock.now += 25
+    assert not seen.seen("m1")
+
+
+def test_full_generation_rotates_early():
+    seen = MessageDeduplicator(window=3600, max_entries=4)
+    for n in range(5):
+        seen.seen(f"m{n}")
+    assert len(seen) <= 4
+    assert seen.rotations >= 1
+    # The newest ids are still remembered, the oldest are gone
+    assert seen.seen("m4")
+    assert not seen.seen("m0")
+
+
+def test_remember_does_not_duplicate_the_previous_generation(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    seen = MessageDeduplicator(window=10)
+    seen.remember("m1")
+    clock.now += 10
+    seen.remember("m1")
+    assert len(seen) == 1
@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from benchmarks.fake_dingtalk import FakeDingTalk
+from gateway.dingtalk_client import DingTalkClient, DingTalkClientError, DingTalkTransientError
+from gateway.media import spool
+
+
+async def started_client(latency=0.0, **options):
+    fake = FakeDingTalk(latency=latency)
+    client = DingTalkClient(
+        "client-id", "client-secret", "agent", on_message=lambda event: None, use_stream=False,
+        api_base=await fake.start(), **options,
+    )
+    return fake, client
+
+
+def test_token_comes_from_the_token_source_when_set():
+    async def main():
+        fake, client = await started_client()
+        expires_at = time.time() + 3600
+
+        async def leader_token():
+            return "leader-token", expires_at
+
+        client.token_source = leader_token
+        assert await client.access_token() == ("leader-token", expires_at)
+        assert "gettoken" not in fake.calls
+
+        client.token_source = None
+        client._token_expires_at = 0
+        assert (await client.access_token())[0] == "fake-token"
+        assert fake.calls["gettoken"] == 1
+        await client.close()
+        await fake.stop()
+
+    asyncio.run(main())
+
+
+def signed(secret, timestamp):
+    digest = hmac.new(secret.encode(), f"{timestamp}\n{secret}".encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+WEBHOOK_BODY = json.dumps({
+    "conversationType": "1", "senderStaffId": "alice", "senderNick": "Alice", "msgId": "m1",
+    "conversationId": "cid1", "text": {"content": "hello"},
+}).encode()
+
+
+def webhook_client(received):
+    return DingTalkClient(
+        "client-id", "client-secret", "agent", on_message=received.append, use_stream=False,
+        webhook_secret="webhook-secret",
+    )
+
+
+def test_signed_webhook_is_ingested():
+    received = []
+
+    async def main():
+        client = webhook_client(received)
+        timestamp = str(int(time.time() * 1000))
+        result = await client.handle_webhook(WEBHOOK_BODY, signed("webhook-secret", timestamp), timestamp)
+        assert result == {"success": True}
+
+    asyncio.run(main())
+    assert [(event.sender, event.content) for event in received] == [("alice", "hello")]
+
+
+def test_webhook_with_a_wrong_signature_is_rejected():
+    received = []
+
+    async def main():
+        client = webhook_client(received)
+        timestamp = str(int(time.time() * 1000))
+        for signature in (signed("other-secret", timestamp), "", "not base64"):
+            result = await client.handle_webhook(WEBHOOK_BODY, signature, timestamp)
+            assert result == {"success": False, "error": "invalid_signature"}
+
+    asyncio.run(main())
+    assert received == []
+
+
+def test_stale_webhook_is_rejected_before_parsing():
+    received = []
+
+    async def main():
+        client = webhook_client(received)
+        stale = str(int((time.time() - 2 * 3600) * 1000))
+        for timestamp in (stale, "", "yesterday"):
+            # A body that cannot be parsed shows it was never decoded
+            result = await client.handle_webhook(b"{not json", signed("webhook-secret", timestamp), timestamp)
+            assert result == {"success": False, "error": "stale_timestamp"}
+
+    asyncio.run(main())
+    assert received == []
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_concurrent_uploads_of_the_same_content_share_one_request():
+    async def main():
+        fake, client = await started_client(latency=0.05)
+        first = await spool(chunks(b"png bytes"), max_bytes=100)
+        second = await spool(chunks(b"png bytes"), max_bytes=100)
+        uploads = [asyncio.ensure_future(client.upload_media(m, "image")) for m in (first, second)]
+        await asyncio.sleep(0)
+        # The sender that started the upload gives up and removes its file
+        uploads[0].cancel()
+        first.discard()
+        media_id = await uploads[1]
+
+        assert media_id.startswith("@fake")
+        assert await client.upload_media(second, "image") == media_id  # From the cache
+        assert await client.upload_media(second, "file") != media_id  # Cached per media type
+        assert fake.calls["media_upload"] == 2
+        second.discard()
+        await client.close()
+        await fake.stop()
+
+    asyncio.run(main())
+
+
+async def scripted_topapi(answers):
+    """Serve ``/topapi/...`` with (HTTP status, body) answers, in order."""
+    async def topapi(request):
+        status, body = answers.pop(0)
+        return web.json_response(body, status=status)
+
+    app = web.Application()
+    app.router.add_post("/topapi/{path:.*}", topapi)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    client = DingTalkClient(
+        "client-id", "client-secret", "agent", on_message=lambda event: None, use_stream=False,
+        api_base=f"http://127.0.0.1:{port}",
+    )
+    client._access_token, client._token_expires_at = "token", time.time() + 3600
+    return runner, client
+
+
+def test_topapi_errors_are_transient_only_when_a_retry_can_help():
+    async def main():
+        runner, client = await scripted_topapi([
+            (503, {}),
+            (200, {"errcode": 90018, "errmsg": "rate limited"}),
+            (200, {"errcode": 60011, "errmsg": "no permission"}),
+            (200, {"errcode": 60121, "errmsg": "not found"}),
+            (200, {"errcode": 0, "result": {"userid": "alice"}}),
+        ])
+        with pytest.raises(DingTalkTransientError, match="HTTP 503"):
+            await client.list_departments(1)
+        with pytest.raises(DingTalkTransientError, match="rate limited"):
+            await client.list_departments(1)
+        with pytest.raises(DingTalkClientError, match="no permission") as raised:
+            await client.list_departments(1)
+        assert not isinstance(raised.value, DingTalkTransientError)
+        assert await client.get_user_by_mobile("13800000000") is None
+        assert await client.get_user_by_mobile("13800000001") == "alice"
+
+        # Nothing listening any more: a network error
+        await runner.cleanup()
+        with pytest.raises(DingTalkTransientError):
+            await client.list_departments(1)
+        await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from gateway.directory import TargetResolutionError, UserDirectory
+
+
+class OrgClient:
+    """Directory API answers from an in-memory org chart."""
+
+    def __init__(self):
+        self.departments = {1: [{"dept_id": 2, "name": "研发"}], 2: [{"dept_id": 3, "name": "后端"}], 3: []}
+        self.users = {
+            1: [{"userid": "boss", "name": "老板", "mobile": "13800000000"}],
+            2: [{"userid": "alice", "name": "张三", "mobile": "13800000001"}],
+            3: [{"userid": "bob", "name": "张三", "mobile": ""}, {"userid": "alice", "name": "张三"}],
+        }
+        self.unlisted = {"13900000000": "carol"}  # Found by getbymobile only
+        self.mobile_lookups = 0
+
+    async def list_departments(self, dept_id):
+        return self.departments.get(dept_id, [])
+
+    async def list_department_users(self, dept_id):
+        return self.users.get(dept_id, [])
+
+    async def get_user_by_mobile(self, mobile):
+        self.mobile_lookups += 1
+        return self.unlisted.get(mobile)
+
+
+async def loaded(client, **options):
+    directory = UserDirectory(client, **options)
+    directory.start()
+    await directory._wait_ready()
+    return directory
+
+
+def test_targets_resolve_against_the_index():
+    async def main():
+        directory = await loaded(OrgClient())
+        assert await directory.resolve("mobile:+86 138-0000-0000") == "boss"
+        assert await directory.resolve("name:张三") == "alice,bob"
+        assert await directory.resolve("dept:研发") == "alice,bob"  # Sub-departments included
+        assert await directory.resolve("dept:3, boss, name:老板") == "alice,bob,boss"
+        assert await directory.resolve("cid123==") == "cid123=="  # Not a reference
+        with pytest.raises(TargetResolutionError):
+            await directory.resolve("boss,name:nobody")
+        await directory.close()
+
+    asyncio.run(main())
+
+
+def test_unknown_mobile_falls_back_to_the_api_once():
+    client = OrgClient()
+
+    async def main():
+        directory = await loaded(client)
+        assert await directory.resolve("mobile:13900000000") == "carol"
+        assert await directory.resolve("mobile:13900000000") == "carol"
+        for _ in range(2):
+            with pytest.raises(TargetResolutionError):
+                await directory.resolve("mobile:13700000000")
+        await directory.close()
+
+    asyncio.run(main())
+    assert client.mobile_lookups == 2  # Misses are cached too
+
+
+def test_refresh_drops_departed_users_and_removed_departments():
+    client = OrgClient()
+
+    async def main():
+        directory = await loaded(client)
+        client.users[3] = [{"userid": "alice", "name": "张三"}]
+        await directory._refresh_department(3)
+        assert await directory.resolve("name:张三") == "alice"
+
+        client.departments[1] = []
+        await directory._refresh_department(1)
+        with pytest.raises(TargetResolutionError):
+            await directory.resolve("dept:研发")
+        with pytest.raises(TargetResolutionError):
+            await directory.resolve("name:张三")
+        await directory.close()
+
+    asyncio.run(main())
+
+
+def test_names_need_the_index():
+    async def main():
+        directory = UserDirectory(OrgClient(), preload=False)
+        with pytest.raises(TargetResolutionError, match="disabled"):
+            await directory.resolve("name:张三")
+        assert await directory.resolve("mobile:13900000000") == "carol"
+
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import asyncio
+
+from gateway.dispatcher import SendDispatcher
+
+
+def test_sends_to_one_target_complete_in_order():
+    order = []
+
+    async def main():
+        dispatcher = SendDispatcher(workers=4)
+        dispatcher.start()
+
+        def send(n):
+            async def run():
+                await asyncio.sleep(0.01 if n % 2 == 0 else 0)  # Later sends would overtake if run in parallel
+                order.append(n)
+                return n
+            return run
+
+        results = await asyncio.gather(*(dispatcher.submit("alice", send(n)) for n in range(6)))
+        assert results == list(range(6))
+        assert dispatcher.lanes == 0
+        await dispatcher.close()
+
+    asyncio.run(main())
+    assert order == list(range(6))
+
+
+def test_different_targets_send_in_parallel():
+    async def main():
+        dispatcher = SendDispatcher(workers=4)
+        dispatcher.start()
+        running = 0
+        peak = 0
+
+        async def send():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(dispatcher.submit(f"user{n}", send) for n in range(4)))
+        assert peak == 4
+        assert asyncio.get_running_loop().time() - started < 0.15
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+
+def test_failed_send_does_not_block_its_lane():
+    async def main():
+        dispatcher = SendDispatcher(workers=1)
+        dispatcher.start()
+
+        async def fail():
+            raise ValueError("rejected")
+
+        async def ok():
+            return "sent"
+
+        results = await asyncio.gather(
+            dispatcher.submit("alice", fail), dispatcher.submit("alice", ok), return_exceptions=True,
+        )
+        assert isinstance(results[0], ValueError) and results[1] == "sent"
+        assert (dispatcher.completed, dispatcher.failed) == (1, 1)
+        await dispatcher.close()
+
+    asyncio.run(main())
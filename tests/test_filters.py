@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from gateway.events import IncomingMessageEvent
+from gateway.filters import MAX_REGEX_INPUT, MAX_REGEX_LENGTH, EventFilter
+
+
+def incoming(**fields):
+    values = dict(msg_id="m1", sender="alice", sender_name="Alice", receiver="bot", content="/light on",
+                  is_group=False, timestamp=0)
+    values.update(fields)
+    return IncomingMessageEvent(**values)
+
+
+def test_no_parameters_give_no_filter():
+    assert EventFilter.from_params({}) is None
+    assert EventFilter.from_params({"sender": " , ", "prefix": ""}) is None
+
+
+@pytest.mark.parametrize("params", [
+    {"is_group": "maybe"},
+    {"at_me": "2"},
+    {"at_me": "false"},
+    {"regex": "("},
+    {"regex": "a" * (MAX_REGEX_LENGTH + 1)},
+    {"regex": "(a+)+$"},
+    {"regex": "(a|aa)+$"},
+    {"regex": r"(a)\1"},
+    {"regex": ".*.*.*x"},
+])
+def test_malformed_parameters_are_rejected(params):
+    with pytest.raises(ValueError):
+        EventFilter.from_params(params)
+
+
+def test_senders_and_rooms():
+    event_filter = EventFilter.from_params({"sender": "alice, bob", "room_id": "cid1"})
+    assert event_filter.matches(incoming(is_group=True, room_id="cid1", at_me=True))
+    assert not event_filter.matches(incoming(room_id="cid2"))
+    assert not event_filter.matches(incoming(sender="carol", room_id="cid1"))
+
+
+@pytest.mark.parametrize("params", [{"is_group": "true"}, {"is_group": "false"}, {"at_me": "true"}])
+def test_missing_flag_matches_neither_value(params):
+    event_filter = EventFilter.from_params(params)
+    (name,) = params
+    assert not event_filter.matches({"event_type": "delivery_receipt"})
+    assert not event_filter.matches({name: None})
+
+
+def test_flags():
+    direct = incoming()
+    group = incoming(is_group=True, room_id="cid1", at_me=True)
+    assert EventFilter.from_params({"is_group": "false"}).matches(direct)
+    assert not EventFilter.from_params({"is_group": "false"}).matches(group)
+    assert EventFilter.from_params({"at_me": "yes"}).matches(group)
+    assert not EventFilter.from_params({"at_me": "true"}).matches(direct)  # at_me is unset in direct chats
+
+
+def test_content_prefix_and_regex():
+    event_filter = EventFilter.from_params({"prefix": "/light", "regex": r"\bon$"})
+    assert event_filter.matches(incoming())
+    assert not event_filter.matches(incoming(content="/light off"))
+    assert not event_filter.matches(incoming(content="turn /light on"))
+    assert not event_filter.matches({"event_type": "delivery_receipt", "status": "read"})
+
+
+def test_regex_sees_only_the_start_of_long_content():
+    event_filter = EventFilter.from_params({"regex": "needle"})
+    assert event_filter.matches(incoming(content="needle" + "x" * 10_000))
+    assert not event_filter.matches(incoming(content="x" * MAX_REGEX_INPUT + "needle"))
+
+
+def test_allowed_regex_stays_fast_on_long_content():
+    event_filter = EventFilter.from_params({"regex": ".*.*x"})
+    started = time.perf_counter()
+    assert not event_filter.matches(incoming(content="a" * 100_000))
+    assert time.perf_counter() - started < 1.0
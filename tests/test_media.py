@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from gateway import media
+from gateway.media import MediaCache, MediaTooLargeError, open_file, spool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_spool_hashes_the_body_into_a_temporary_file():
+    spooled = asyncio.run(spool(chunks(b"abc", b"def"), max_bytes=6))
+    try:
+        assert spooled.digest == hashlib.sha256(b"abcdef").hexdigest()
+        assert spooled.size == 6
+        with open(spooled.path, "rb") as f:
+            assert f.read() == b"abcdef"
+    finally:
+        spooled.discard()
+    assert not os.path.exists(spooled.path)
+
+
+def test_oversized_body_is_rejected_and_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(media.tempfile, "tempdir", str(tmp_path))
+    with pytest.raises(MediaTooLargeError):
+        asyncio.run(spool(chunks(b"abc", b"def"), max_bytes=5))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_on_disk_is_hashed_but_never_removed(tmp_path):
+    path = tmp_path / "photo.png"
+    path.write_bytes(b"png")
+    opened = asyncio.run(open_file(str(path), max_bytes=3))
+    opened.discard()
+    assert opened.digest == hashlib.sha256(b"png").hexdigest()
+    assert path.exists()
+    with pytest.raises(MediaTooLargeError):
+        asyncio.run(open_file(str(path), max_bytes=2))
+
+
+def test_cached_media_ids_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(media.time, "monotonic", clock)
+    cache = MediaCache(ttl=60)
+    cache.put("image", "d1", "@m1")
+    assert cache.get("image", "d1") == "@m1"
+    assert cache.get("file", "d1") is None  # Same content, other media type
+    clock.now += 61
+    assert cache.get("image", "d1") is None
+    assert (cache.hits, cache.misses, cache.expired) == (1, 2, 1)
+
+
+def test_full_cache_drops_expired_then_least_recently_used(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(media.time, "monotonic", clock)
+    cache = MediaCache(ttl=60, max_entries=2)
+    cache.put("image", "old", "@old")
+    clock.now += 30
+    cache.put("image", "a", "@a")
+    clock.now += 31  # "old" has expired, "a" has not
+    cache.put("image", "b", "@b")
+    assert (cache.expired, cache.evictions) == (1, 0)
+
+    assert cache.get("image", "a") == "@a"
+    cache.put("image", "c", "@c")
+    assert cache.get("image", "b") is None
+    assert cache.evictions == 1
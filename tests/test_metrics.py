@@ -0,0 +1,43 @@
+import pytest
+
+from gateway.metrics import CallbackMetric, Counter, Histogram, Registry, _Metric
+
+
+def test_metric_without_render_cannot_be_created():
+    class Incomplete(_Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete("x", "doc")
+
+
+def test_counter_and_histogram_exposition():
+    registry = Registry()
+    errors = registry.register(Counter("api_errors_total", "Errors", labels=("api",)))
+    latency = registry.register(Histogram("send_seconds", "Latency", buckets=(0.1, 1.0)))
+    errors.inc('say "hi"')
+    errors.inc('say "hi"', amount=2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP api_errors_total Errors",
+        "# TYPE api_errors_total counter",
+        'api_errors_total{api="say \\"hi\\""} 3',
+        "# HELP send_seconds Latency",
+        "# TYPE send_seconds histogram",
+        'send_seconds_bucket{le="0.1"} 1',
+        'send_seconds_bucket{le="1.0"} 2',
+        'send_seconds_bucket{le="+Inf"} 3',
+        "send_seconds_sum 5.55",
+        "send_seconds_count 3",
+    ]
+
+
+def test_failing_callback_is_left_out():
+    registry = Registry()
+    registry.register(CallbackMetric("lanes", "Lanes", lambda: 1 / 0))
+    registry.register(CallbackMetric("queued", "Queued", lambda: {("high",): 2}, labels=("priority",)))
+    assert registry.render().splitlines()[-1] == 'queued{priority="high"} 2'
+    assert "lanes" not in registry.render()
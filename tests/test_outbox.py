@@ -0,0 +1,247 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from gateway import outbox
+from gateway.outbox import Outbox, PartialDelivery
+
+
+class Transient(Exception):
+    pass
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT state, attempts, payload, owner FROM outbox ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+async def wait_for(predicate, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+def test_writer_survives_locked_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox, "BUSY_TIMEOUT", 0.05)
+    path = str(tmp_path / "outbox.db")
+    delivered = []
+
+    async def deliver(kind, payload):
+        delivered.append(payload["n"])
+
+    async def main():
+        box = Outbox(path, deliver, workers=1)
+        await box.start()
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            await box.enqueue("text", {"n": 1})
+        other.execute("ROLLBACK")
+        other.close()
+
+        # The writer thread kept running and takes the next batch
+        await box.enqueue("text", {"n": 2})
+        await wait_for(lambda: delivered == [2])
+        assert box._writer.is_alive()
+        await box.close()
+
+    asyncio.run(main())
+
+
+def test_failed_operation_fails_only_its_caller(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def main():
+        box = Outbox(path, lambda kind, payload: asyncio.sleep(0))
+        await box.start(run_workers=False)
+
+        def broken(conn):
+            raise sqlite3.IntegrityError("boom")
+
+        results = await asyncio.gather(
+            box.enqueue("text", {"n": 1}), box._writer.submit(broken), box.enqueue("text", {"n": 2}),
+            return_exceptions=True,
+        )
+        assert isinstance(results[1], sqlite3.IntegrityError)
+        assert [r for r in results if isinstance(r, int)] == [1, 2]
+        await box.close()
+
+    asyncio.run(main())
+
+
+def test_unopenable_database_fails_callers(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    (tmp_path / "outbox.db").mkdir()  # A directory cannot be opened as a database
+
+    async def main():
+        box = Outbox(path, lambda kind, payload: asyncio.sleep(0))
+        with pytest.raises(sqlite3.Error):
+            await asyncio.wait_for(box.start(run_workers=False), 3)
+        box._writer.stop()
+
+    asyncio.run(main())
+
+
+def test_transient_failure_is_retried_then_dead(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    calls = []
+
+    async def deliver(kind, payload):
+        calls.append(payload)
+        raise Transient("HTTP 502")
+
+    async def main():
+        box = Outbox(path, deliver, workers=1, max_attempts=3, base_delay=0.01, max_delay=0.01,
+                     is_transient=lambda e: isinstance(e, Transient))
+        await box.start()
+        await box.enqueue("text", {"n": 1})
+        await wait_for(lambda: box.dead == 1)
+        await box.close()
+
+    asyncio.run(main())
+    assert len(calls) == 3
+    state, attempts, _, _ = rows(path)[0]
+    assert (state, attempts) == ("dead", 3)
+
+
+def test_permanent_failure_is_not_retried(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def deliver(kind, payload):
+        raise ValueError("bad message")
+
+    async def main():
+        box = Outbox(path, deliver, workers=1, is_transient=lambda e: isinstance(e, Transient))
+        await box.start()
+        await box.enqueue("text", {"n": 1})
+        await wait_for(lambda: box.dead == 1)
+        assert box.retried == 0
+        await box.close()
+
+    asyncio.run(main())
+
+
+def test_partial_delivery_retries_only_the_rest(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    targets = []
+
+    async def deliver(kind, payload):
+        targets.append(payload["target"])
+        if len(targets) == 1:
+            raise PartialDelivery(Transient("HTTP 502"), {**payload, "target": "b"})
+
+    async def main():
+        box = Outbox(path, deliver, workers=1, base_delay=0.01, max_delay=0.01,
+                     is_transient=lambda e: isinstance(e, Transient))
+        await box.start()
+        await box.enqueue("text", {"target": "a,b"})
+        await wait_for(lambda: box.delivered == 1)
+        await box.close()
+
+    asyncio.run(main())
+    assert targets == ["a,b", "b"]
+
+
+def test_dead_partial_delivery_keeps_unsent_part(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def deliver(kind, payload):
+        raise PartialDelivery(ValueError("rejected"), {**payload, "target": "b"})
+
+    async def main():
+        box = Outbox(path, deliver, workers=1, is_transient=lambda e: isinstance(e, Transient))
+        await box.start()
+        await box.enqueue("text", {"target": "a,b"})
+        await wait_for(lambda: box.dead == 1)
+        await box.close()
+
+    asyncio.run(main())
+    state, _, payload, _ = rows(path)[0]
+    assert state == "dead"
+    assert json.loads(payload)["target"] == "b"
+
+
+def test_leased_rows_move_only_when_the_owner_dies(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    sent = []
+
+    async def main():
+        blocked = asyncio.Event()
+
+        async def stuck(kind, payload):
+            sent.append(("a", payload["n"]))
+            await blocked.wait()
+
+        async def deliver(kind, payload):
+            sent.append(("b", payload["n"]))
+
+        a = Outbox(path, stuck, workers=2, lease=0.3)
+        await a.start()
+        await a.enqueue("text", {"n": 1})
+        await wait_for(lambda: sent == [("a", 1)])
+
+        b = Outbox(path, deliver, workers=2, lease=0.3)
+        await b.start()
+        await asyncio.sleep(0.6)  # Longer than the lease: a renews it meanwhile
+        assert sent == [("a", 1)]
+
+        # a dies without releasing its rows
+        for task in a._tasks:
+            task.cancel()
+        await wait_for(lambda: ("b", 1) in sent)
+        await b.close()
+        a._writer.stop()
+
+    asyncio.run(main())
+
+
+def test_close_hands_rows_back(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def main():
+        started = asyncio.Event()
+
+        async def stuck(kind, payload):
+            started.set()
+            await asyncio.Event().wait()
+
+        box = Outbox(path, stuck, workers=1)
+        await box.start()
+        await box.enqueue("text", {"n": 1})
+        await started.wait()
+        await box.close()
+
+    asyncio.run(main())
+    assert rows(path) == [("pending", 0, '{"n": 1}', None)]
+
+
+def test_old_database_is_migrated(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+        "payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+        "next_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT);"
+        "INSERT INTO outbox (kind, payload, state, next_at, created_at) VALUES ('text', '{\"n\": 9}', 'inflight', 0, 0);"
+    )
+    conn.commit()
+    conn.close()
+    delivered = []
+
+    async def deliver(kind, payload):
+        delivered.append(payload["n"])
+
+    async def main():
+        box = Outbox(path, deliver)
+        await box.start()
+        await wait_for(lambda: delivered == [9])
+        await box.close()
+
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import asyncio
+
+from gateway.receipts import DELIVERED, FAILED, QUEUED, READ, SENT, DeliveryTracker
+
+
+class DingTalk:
+    """getsendresult answers by task id; a missing task fails the call."""
+
+    def __init__(self):
+        self.results = {}
+        self.calls = []
+
+    async def fetch(self, task_id):
+        self.calls.append(task_id)
+        if task_id not in self.results:
+            raise ConnectionError("HTTP 502")
+        return self.results[task_id]
+
+
+def tracker_for(dingtalk, **options):
+    receipts = []
+
+    async def publish(receipt):
+        receipts.append((receipt["message_id"], receipt["status"]))
+
+    return DeliveryTracker(dingtalk.fetch, publish, **options), receipts
+
+
+def test_status_follows_the_send_result():
+    dingtalk = DingTalk()
+
+    async def main():
+        tracker, receipts = tracker_for(dingtalk)
+        message = tracker.create("text", "alice")
+        await tracker.update(message.message_id, QUEUED)
+        await tracker.update(message.message_id, SENT, task_id=7)
+
+        dingtalk.results[7] = {"unread_user_id_list": ["alice"]}
+        await tracker._poll_task(7)
+        dingtalk.results[7] = {"read_user_id_list": ["alice"]}
+        await tracker._poll_task(7)
+        assert tracker.stats()["pending_tasks"] == 0
+        return message.message_id, receipts
+
+    message_id, receipts = asyncio.run(main())
+    assert receipts == [(message_id, QUEUED), (message_id, SENT), (message_id, DELIVERED), (message_id, READ)]
+
+
+def test_messages_sharing_a_task_are_polled_once():
+    dingtalk = DingTalk()
+    dingtalk.results[7] = {"read_user_id_list": ["alice"], "unread_user_id_list": ["bob"]}
+
+    async def main():
+        tracker, _ = tracker_for(dingtalk, poll_interval=0.01)
+        alice = tracker.create("text", "alice")
+        bob = tracker.create("text", "bob")
+        tracker.start()
+        await tracker.update(alice.message_id, SENT, task_id=7)
+        await tracker.update(bob.message_id, SENT, task_id=7)
+        while bob.status != DELIVERED:
+            await asyncio.sleep(0.01)
+        await tracker.close()
+        assert alice.status == READ
+        assert dingtalk.calls[0] == 7 and dingtalk.calls.count(7) == len(dingtalk.calls)
+
+    asyncio.run(main())
+
+
+def test_split_send_merges_the_results_of_its_tasks():
+    dingtalk = DingTalk()
+
+    async def main():
+        tracker, _ = tracker_for(dingtalk)
+        message = tracker.create("text", "alice,bob")
+        await tracker.update(message.message_id, SENT, task_ids=[1, 2])
+
+        dingtalk.results[1] = {"read_user_id_list": ["alice"]}
+        await tracker._poll_task(1)
+        assert message.status == SENT  # Nothing known about bob yet
+
+        dingtalk.results[2] = {"unread_user_id_list": ["bob"]}
+        await tracker._poll_task(2)
+        assert message.status == DELIVERED
+
+        dingtalk.results[2] = {"read_user_id_list": ["bob"]}
+        await tracker._poll_task(2)
+        assert message.status == READ
+
+    asyncio.run(main())
+
+
+def test_user_the_message_could_not_reach_fails_it():
+    dingtalk = DingTalk()
+    dingtalk.results[1] = {"read_user_id_list": ["alice"], "forbidden_list": [{"userid": "bob", "code": "143105"}]}
+
+    async def main():
+        tracker, _ = tracker_for(dingtalk)
+        message = tracker.create("text", "alice,bob")
+        await tracker.update(message.message_id, SENT, task_id=1)
+        await tracker._poll_task(1)
+        assert (message.status, message.error) == (FAILED, "rejected by DingTalk")
+
+    asyncio.run(main())
+
+
+def test_polling_gives_up_after_max_poll_age():
+    dingtalk = DingTalk()
+
+    async def main():
+        tracker, _ = tracker_for(dingtalk, max_poll_age=-1)
+        unknown = tracker.create("text", "alice")
+        await tracker.update(unknown.message_id, SENT, task_id=1)
+        await tracker._poll_task(1)  # getsendresult keeps failing
+        assert (unknown.status, unknown.error) == (FAILED, "no send result")
+
+        # Reached the user but never read: stays delivered
+        delivered = tracker.create("text", "bob")
+        await tracker.update(delivered.message_id, SENT, task_id=2)
+        dingtalk.results[2] = {"unread_user_id_list": ["bob"]}
+        await tracker._poll_task(2)
+        assert (delivered.status, delivered.error) == (DELIVERED, None)
+        assert tracker.stats()["pending_tasks"] == 0
+
+    asyncio.run(main())
+
+
+def test_oldest_messages_are_evicted():
+    dingtalk = DingTalk()
+
+    async def main():
+        tracker, _ = tracker_for(dingtalk, max_entries=2)
+        first = tracker.create("text", "alice")
+        await tracker.update(first.message_id, SENT, task_id=1)
+        tracker.create("text", "bob")
+        tracker.create("text", "carol")
+        assert tracker.get(first.message_id) is None
+        assert tracker.stats()["pending_tasks"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from gateway.scheduler import OutboundScheduler
+
+
+def test_free_bucket_is_granted_immediately():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=5)
+        assert await scheduler.acquire("work_notification") == 0.0
+        assert scheduler.stats()["granted"] == 1
+
+    asyncio.run(main())
+
+
+def test_empty_bucket_delays_until_refill():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=10)
+        for _ in range(10):
+            await scheduler.acquire("work_notification")
+        waited = await scheduler.acquire("work_notification")
+        assert 0.05 <= waited < 0.5
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_higher_priority_is_served_first():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=10)
+        for _ in range(10):
+            await scheduler.acquire("work_notification")
+        order = []
+
+        async def send(priority):
+            await scheduler.acquire("work_notification", priority=priority)
+            order.append(priority)
+
+        await asyncio.gather(send("low"), send("normal"), send("high"))
+        assert order == ["high", "normal", "low"]
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_exhausted_webhook_does_not_stall_other_webhooks():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=20, webhook_per_minute=2)
+        for _ in range(2):
+            await scheduler.acquire("session_webhook", key="A")
+        stuck = asyncio.create_task(scheduler.acquire("session_webhook", key="A", timeout=1.0))
+        await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        await asyncio.wait_for(scheduler.acquire("session_webhook", key="B", timeout=1.0), 0.5)
+        assert time.perf_counter() - started < 0.1
+        with pytest.raises(asyncio.TimeoutError):
+            await stuck
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_abandoned_waiter_wakes_the_dispatcher():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=1, webhook_per_minute=1)
+        await scheduler.acquire("family", key="A")
+        # Needs the family bucket (back in 1s) and webhook A (back in 60s)
+        high = asyncio.create_task(scheduler.acquire("family", key="A", priority="high", timeout=0.2))
+        await asyncio.sleep(0.01)
+        low = asyncio.create_task(scheduler.acquire("family", priority="low"))
+
+        with pytest.raises(asyncio.TimeoutError):
+            await high
+        # Without a wakeup the dispatcher would sleep on the high waiter's 60s
+        await asyncio.wait_for(low, 2.0)
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_close_cancels_waiters():
+    async def main():
+        scheduler = OutboundScheduler(api_qps=1)
+        await scheduler.acquire("family")
+        waiter = asyncio.create_task(scheduler.acquire("family"))
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())